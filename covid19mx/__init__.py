@@ -0,0 +1,50 @@
+"""
+    Descarga, aplanado, agregados, gráficas y mapas de los datos abiertos de COVID-19 de la DGE.
+
+    Los módulos del paquete se importan hasta que se usa alguno de sus nombres: `import covid19mx` no carga nada más y
+    `covid19mx.curvas_epidemicas` sólo carga pandas y numpy. geopandas, folium y plotly se cargan hasta que se pide algo
+    de `covid19mx.mapas` o `covid19mx.graficas`, así que los procesos que sólo bajan datos o calculan conteos no pagan
+    su importación (ver `covid19mx.arranque`).
+"""
+import importlib
+
+# Nombres que se pueden usar directamente desde el paquete, por módulo
+_MODULOS = {
+    'descarga': ['zip_valido', 'descarga_archivo', 'bajar_diccionario', 'bajar_datos_fecha', 'bajar_datos_salud',
+                 'bajar_historicos'],
+    'carga': ['ESQUEMA_DGE', 'convierte_fechas', 'lee_bloques_covid19_MX', 'lee_datos_covid19_MX', 'firma_archivo',
+              'carga_catalogos', 'ResolutorCatalogos', 'rutas_diccionario', 'carga_datos_covid19_MX', 'partes_fecha',
+              'procesa_fechas', 'AlmacenRegistros'],
+    'agregados': ['VALORES_CONFIRMADOS', 'SERIES_EPIDEMICAS', 'mascara_filtros', 'conteos_diarios', 'suma_conteos',
+                  'curvas_de_conteos', 'curvas_epidemicas', 'CuboMunicipal', 'valores_diarios'],
+    'particionada': ['BaseParticionada'],
+    'entidades': ['procesa_entidad', 'procesa_entidades'],
+    'graficas': ['lttb', 'reduce_curvas', 'junta_curvas', 'grafica_curvas', 'exporta_figuras'],
+    'mapas': ['vista_limites', 'vista_mapa', 'AlmacenGeometrias', 'topojson_cuantizado', 'CapasCoropletas',
+              'mapa_capas', 'CoropletasAnimadas', 'mapa_animado'],
+    'arranque': [],
+    'sinteticos': ['genera_datos_sinteticos'],
+    'benchmark': ['corre_benchmark', 'compara_resultados'],
+    'instrumentacion': ['MEDIDOR', 'activa_instrumentacion', 'desactiva_instrumentacion'],
+    'servicio': ['ServicioConsultas', 'sirve'],
+    'cohortes': ['IndiceBanderas'],
+    'vecindades': ['PesosEspaciales'],
+    'flujo': ['EtapaFlujo', 'Flujo', 'flujo_notebook'],
+    'retrasos': ['TrianguloRetrasos'],
+}
+_NOMBRES = {nombre: modulo for modulo, nombres in _MODULOS.items() for nombre in nombres}
+
+__all__ = sorted(_NOMBRES)
+
+def __getattr__(nombre):
+    if nombre in _MODULOS:
+        return importlib.import_module(f'{__name__}.{nombre}')
+    if nombre in _NOMBRES:
+        valor = getattr(importlib.import_module(f'{__name__}.{_NOMBRES[nombre]}'), nombre)
+        # La siguiente vez ya no pasa por aquí
+        globals()[nombre] = valor
+        return valor
+    raise AttributeError(f'module {__name__!r} has no attribute {nombre!r}')
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULOS) | set(__all__))
@@ -0,0 +1,161 @@
+"""
+    Tareas cortas desde la línea de comandos (p. ej. en cron), sin cargar las dependencias de visualización:
+
+        python -m covid19mx descarga 05-05-2021
+        python -m covid19mx curvas 210505 --entidad 27 --salida curvas.parquet --instrumentacion etapas.csv
+        python -m covid19mx arranque
+        python -m covid19mx sinteticos /tmp/sinteticos --registros 1000000
+        python -m covid19mx benchmark /tmp/sinteticos --salida actual.json --anterior anterior.json
+        python -m covid19mx servicio 210505 --puerto 8050 --geojson /content/municipios_pob_2020_simple.json
+        python -m covid19mx flujo 210505 --entidad 27 --salida /content/salida/ --bins 8
+        python -m covid19mx triangulo 210101 210505 --salida /content/triangulo/
+"""
+import argparse
+import logging
+import sys
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(prog='python -m covid19mx')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    descarga = comandos.add_parser('descarga', help='baja la publicación de una fecha y el diccionario de datos')
+    descarga.add_argument('fecha', help="fecha de publicación, '%%d-%%m-%%Y'")
+    descarga.add_argument('--directorio', default='/content/')
+
+    curvas = comandos.add_parser('curvas', help='guarda en parquet las curvas epidémicas de una publicación')
+    curvas.add_argument('fecha', help="fecha de publicación, '%%y%%m%%d'")
+    curvas.add_argument('--entidad', default=None, help='clave de la entidad de residencia, por omisión todo el país')
+    curvas.add_argument('--nivel', default=None, help='columna para tener una curva por grupo')
+    curvas.add_argument('--directorio', default='/content/')
+    curvas.add_argument('--chunksize', type=int, default=500_000)
+    curvas.add_argument('--salida', required=True)
+    curvas.add_argument('--instrumentacion', default=None,
+                        help='CSV (se agrega al final) o JSON con el tiempo y la memoria de cada etapa')
+    curvas.add_argument('--perfil', nargs='+', default=(), help='etapas que se corren con cProfile')
+
+    arranque = comandos.add_parser('arranque', help='revisa el tiempo de importación del camino de sólo datos')
+    arranque.add_argument('--presupuesto', type=float, default=None, help='segundos')
+
+    sinteticos = comandos.add_parser('sinteticos', help='genera una publicación sintética con el formato de la DGE')
+    sinteticos.add_argument('directorio')
+    sinteticos.add_argument('--registros', type=int, default=100_000)
+    sinteticos.add_argument('--fecha', default='210505', help="fecha de publicación, '%%y%%m%%d'")
+    sinteticos.add_argument('--semilla', type=int, default=0)
+
+    benchmark = comandos.add_parser('benchmark', help='mide tiempo y memoria de cada etapa sobre una publicación')
+    benchmark.add_argument('directorio')
+    benchmark.add_argument('--fecha', default='210505', help="fecha de publicación, '%%y%%m%%d'")
+    benchmark.add_argument('--entidad', default=None, help='clave de la entidad de residencia, por omisión todo el país')
+    benchmark.add_argument('--repeticiones', type=int, default=3)
+    benchmark.add_argument('--mapas', action='store_true', help='incluye geometrías y mapas (geopandas y folium)')
+    benchmark.add_argument('--etapas', nargs='+', default=None)
+    benchmark.add_argument('--salida', default=None, help='JSON con los resultados')
+    benchmark.add_argument('--anterior', default=None, help='JSON de una corrida anterior para comparar')
+    benchmark.add_argument('--tolerancia', type=float, default=0.10)
+
+    servicio = comandos.add_parser('servicio', help='servicio HTTP/JSON de consultas sobre una publicación')
+    servicio.add_argument('fecha', help="fecha de publicación, '%%y%%m%%d'")
+    servicio.add_argument('--entidad', default=None, help='clave de la entidad de residencia, por omisión todo el país')
+    servicio.add_argument('--directorio', default='/content/')
+    servicio.add_argument('--host', default='127.0.0.1')
+    servicio.add_argument('--puerto', type=int, default=8050)
+    servicio.add_argument('--tam-cache', type=int, default=256, help='respuestas en el cache LRU')
+    servicio.add_argument('--geojson', default=None,
+                          help="GeoJson de municipios con pob2020 para la métrica 'tasa' de /municipios; sin él no "
+                               "hay tasas")
+
+    flujo = comandos.add_parser('flujo', help='corre el flujo del notebook, ejecutando sólo las etapas que cambiaron')
+    flujo.add_argument('fecha', help="fecha de publicación, '%%y%%m%%d'")
+    flujo.add_argument('--entidad', default=None, help='clave de la entidad de residencia, por omisión todo el país')
+    flujo.add_argument('--directorio', default='/content/')
+    flujo.add_argument('--salida', required=True, help='directorio de las gráficas y el mapa')
+    flujo.add_argument('--sin-descarga', action='store_true', help='usa los archivos que ya están en el directorio')
+    flujo.add_argument('--bins', type=int, default=6)
+    flujo.add_argument('--colores', default='OrRd', help='escala de colores del mapa')
+    flujo.add_argument('--forzar', nargs='+', default=(), help='etapas que se ejecutan aunque estén en el cache')
+    flujo.add_argument('--trabajadores', type=int, default=None)
+    flujo.add_argument('--limpia', action='store_true', help='borra del cache lo que no es de esta corrida')
+
+    triangulo = comandos.add_parser('triangulo', help='conteos por fecha del evento × fecha de publicación')
+    triangulo.add_argument('desde', help="primera publicación, '%%y%%m%%d'")
+    triangulo.add_argument('hasta', help="última publicación, '%%y%%m%%d'")
+    triangulo.add_argument('--directorio', default='/content/')
+    triangulo.add_argument('--salida', required=True, help='directorio donde se guarda el triángulo')
+    triangulo.add_argument('--procesos', type=int, default=None)
+    triangulo.add_argument('--chunksize', type=int, default=None)
+
+    argumentos = parser.parse_args(argumentos)
+    if argumentos.comando == 'descarga':
+        from .descarga import bajar_datos_salud
+        bajar_datos_salud(argumentos.directorio, argumentos.fecha)
+    elif argumentos.comando == 'curvas':
+        from .carga import carga_datos_covid19_MX
+        from .agregados import SERIES_EPIDEMICAS, curvas_epidemicas
+        if argumentos.instrumentacion is not None:
+            from .instrumentacion import activa_instrumentacion
+            medidor = activa_instrumentacion(perfil=argumentos.perfil)
+        columnas = {columna for serie in SERIES_EPIDEMICAS.values() for columna in serie['filtros']}
+        if argumentos.nivel is not None:
+            columnas.add(argumentos.nivel)
+        df = carga_datos_covid19_MX(argumentos.fecha, entidad=argumentos.entidad, columnas=sorted(columnas),
+                                    chunksize=argumentos.chunksize, directorio_datos=argumentos.directorio,
+                                    cache=True)
+        curvas_epidemicas(df, nivel=argumentos.nivel).to_parquet(argumentos.salida, index=False)
+        if argumentos.instrumentacion is not None:
+            medidor.exporta(argumentos.instrumentacion)
+    elif argumentos.comando == 'arranque':
+        from .arranque import PRESUPUESTO_ARRANQUE, MODULOS_DATOS, revisa_arranque
+        presupuesto = PRESUPUESTO_ARRANQUE if argumentos.presupuesto is None else argumentos.presupuesto
+        try:
+            medicion = revisa_arranque(presupuesto)
+        except RuntimeError as error:
+            print(error, file=sys.stderr)
+            return 1
+        print(f'{", ".join(MODULOS_DATOS)}: {medicion["tiempo"]:.2f} s (presupuesto {presupuesto:.2f} s)')
+    elif argumentos.comando == 'sinteticos':
+        from .sinteticos import genera_datos_sinteticos
+        rutas = genera_datos_sinteticos(argumentos.directorio, argumentos.registros, argumentos.fecha,
+                                        argumentos.semilla)
+        for ruta in rutas.values():
+            print(ruta)
+    elif argumentos.comando == 'benchmark':
+        from .benchmark import corre_benchmark, compara_resultados
+        corrida = corre_benchmark(argumentos.directorio, argumentos.fecha, argumentos.entidad,
+                                  argumentos.repeticiones, argumentos.mapas, argumentos.etapas, argumentos.salida)
+        for etapa, medicion in corrida['etapas'].items():
+            print(f'{etapa:20} {medicion["minimo"]:8.3f} s {medicion["pico_mb"]:9.1f} MB')
+        if argumentos.anterior is not None:
+            comparacion = compara_resultados(corrida, argumentos.anterior, argumentos.tolerancia)
+            print(comparacion.to_string())
+            if comparacion['regresion'].any():
+                return 1
+    elif argumentos.comando == 'servicio':
+        from .servicio import sirve, poblacion_municipios
+        logging.basicConfig(level=logging.INFO)
+        poblacion = None if argumentos.geojson is None else poblacion_municipios(argumentos.geojson)
+        sirve(argumentos.fecha, argumentos.directorio, argumentos.entidad, argumentos.host, argumentos.puerto,
+              argumentos.tam_cache, poblacion)
+    elif argumentos.comando == 'flujo':
+        from .flujo import flujo_notebook
+        flujo = flujo_notebook(argumentos.fecha, argumentos.entidad, argumentos.salida, argumentos.directorio,
+                               descargar=not argumentos.sin_descarga, bins=argumentos.bins,
+                               fill_color=argumentos.colores, max_trabajadores=argumentos.trabajadores)
+        tabla = flujo.corre(forzar=argumentos.forzar)
+        print(tabla.to_string())
+        print(f'total: {tabla.attrs["total"]:.2f} s')
+        if argumentos.limpia:
+            print(f'{flujo.limpia():.1f} MB liberados del cache')
+    elif argumentos.comando == 'triangulo':
+        import pandas as pd
+        from .retrasos import TrianguloRetrasos
+        fechas = pd.date_range(pd.to_datetime(argumentos.desde, format='%y%m%d'),
+                               pd.to_datetime(argumentos.hasta, format='%y%m%d'))
+        triangulo = TrianguloRetrasos.construye(fechas, argumentos.directorio, max_procesos=argumentos.procesos,
+                                                chunksize=argumentos.chunksize)
+        triangulo.guarda(argumentos.salida)
+        print(f'{len(triangulo.publicaciones)} publicaciones, de {triangulo.publicaciones[0].date()} '
+              f'a {triangulo.publicaciones[-1].date()}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+    Agregados de la base aplanada: curvas epidémicas y cubo de conteos acumulados por municipio.
+"""
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from .carga import carga_datos_covid19_MX, firma_archivo, rutas_diccionario, _mismas_fuentes, _nombre_cache
+from .instrumentacion import mide
+
+VALORES_CONFIRMADOS = ['CASO DE COVID-19 CONFIRMADO POR ASOCIACIÓN CLÍNICA EPIDEMIOLÓGICA',
+                       'CASO DE COVID-19 CONFIRMADO POR COMITÉ DE DICTAMINACIÓN',
+                       'CASO DE SARS-COV-2 CONFIRMADO']
+
+# Cada serie es: Tipo -> fecha por la que se agrega y filtros columna -> valores aceptados
+SERIES_EPIDEMICAS = {'Casos Confirmados': {'fecha': 'FECHA_SINTOMAS',
+                                          'filtros': {'CLASIFICACION_FINAL': VALORES_CONFIRMADOS}},
+                     'Defunciones': {'fecha': 'FECHA_DEF',
+                                     'filtros': {'CLASIFICACION_FINAL': VALORES_CONFIRMADOS}},
+                     'Hospitalizaciones': {'fecha': 'FECHA_SINTOMAS',
+                                           'filtros': {'CLASIFICACION_FINAL': VALORES_CONFIRMADOS,
+                                                       'TIPO_PACIENTE': ['HOSPITALIZADO']}}}
+
+def _normaliza_espacios(valor):
+    # En los catálogos algunos textos traen espacios dobles ('CASO DE SARS-COV-2  CONFIRMADO')
+    return ' '.join(valor.split()) if isinstance(valor, str) else valor
+
+def mascara_filtros(df, filtros):
+    """
+        Arreglo booleano de los renglones que cumplen todos los `filtros` (columna -> lista de valores aceptados).
+        En las columnas categóricas se comparan sólo las categorías y luego los códigos.
+    """
+    mascara = np.ones(len(df), dtype=bool)
+    for columna, valores in filtros.items():
+        serie = df[columna]
+        valores = {_normaliza_espacios(valor) for valor in valores}
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            aceptados = [i for i, categoria in enumerate(serie.cat.categories)
+                         if _normaliza_espacios(categoria) in valores]
+            mascara &= np.isin(serie.cat.codes.to_numpy(), aceptados)
+        else:
+            mascara &= serie.map(_normaliza_espacios).isin(valores).to_numpy()
+    return mascara
+
+def conteos_diarios(df, series=None, nivel=None, grupos=None):
+    """
+        Conteos diarios de cada serie de `series` (ver `curvas_epidemicas`): diccionario Tipo -> (primer día en días
+        desde 1970-01-01, arreglo de grupos × días). Los grupos son los valores de `grupos` o, si no se dan, las
+        categorías de la columna `nivel`; sin `nivel` hay un solo grupo. Las series sin registros no aparecen.
+    """
+    series = SERIES_EPIDEMICAS if series is None else series
+    if nivel is None:
+        grupo = np.zeros(len(df), dtype=np.int64)
+        num_grupos = 1
+    else:
+        if grupos is None:
+            grupos = df[nivel].astype('category').cat.categories
+        grupo = pd.Categorical(df[nivel], categories=grupos).codes.astype(np.int64)
+        num_grupos = len(grupos)
+
+    # Las series que comparten filtros (p. ej. los confirmados) sólo se filtran una vez
+    mascaras = {}
+    conteos = {}
+    for tipo, serie in series.items():
+        llave_filtros = tuple((columna, tuple(valores)) for columna, valores in serie['filtros'].items())
+        if llave_filtros not in mascaras:
+            mascaras[llave_filtros] = mascara_filtros(df, serie['filtros']) & (grupo >= 0)
+        mascara = mascaras[llave_filtros]
+        fechas = df[serie['fecha']].to_numpy()[mascara].astype('datetime64[D]')
+        validas = ~np.isnat(fechas)
+        dias = fechas[validas].astype(np.int64)
+        if len(dias) == 0:
+            continue
+        inicio = dias.min()
+        num_dias = int(dias.max() - inicio + 1)
+        llave = grupo[mascara][validas] * num_dias + (dias - inicio)
+        conteo = np.bincount(llave, minlength=num_grupos * num_dias).reshape(num_grupos, num_dias)
+        conteos[tipo] = (inicio, conteo)
+    return conteos
+
+def suma_conteos(conteos, otros):
+    """
+        Suma dos resultados de `conteos_diarios` con los mismos grupos, alineando los días.
+    """
+    suma = dict(conteos)
+    for tipo, (inicio, conteo) in otros.items():
+        if tipo not in suma:
+            suma[tipo] = (inicio, conteo)
+            continue
+        inicio_suma, conteo_suma = suma[tipo]
+        nuevo_inicio = min(inicio, inicio_suma)
+        fin = max(inicio + conteo.shape[1], inicio_suma + conteo_suma.shape[1])
+        total = np.zeros((conteo.shape[0], fin - nuevo_inicio), dtype=np.int64)
+        total[:, inicio_suma - nuevo_inicio:inicio_suma - nuevo_inicio + conteo_suma.shape[1]] += conteo_suma
+        total[:, inicio - nuevo_inicio:inicio - nuevo_inicio + conteo.shape[1]] += conteo
+        suma[tipo] = (nuevo_inicio, total)
+    return suma
+
+def curvas_de_conteos(conteos, series=None, nivel=None, grupos=None, ventana=7):
+    """
+        Arma las curvas de `curvas_epidemicas` a partir de los `conteos` de `conteos_diarios`, en el orden de `series`.
+    """
+    series = SERIES_EPIDEMICAS if series is None else series
+    partes = []
+    for tipo in series:
+        if tipo not in conteos:
+            continue
+        inicio, conteo = conteos[tipo]
+        num_grupos, num_dias = conteo.shape
+        acumulado = np.zeros((num_grupos, num_dias + 1))
+        acumulado[:, 1:] = np.cumsum(conteo, axis=1)
+        media_movil = np.full((num_grupos, num_dias), np.nan)
+        media_movil[:, ventana - 1:] = (acumulado[:, ventana:] - acumulado[:, :-ventana]) / ventana
+
+        fechas_serie = pd.date_range(pd.Timestamp(inicio, unit='D'), periods=num_dias)
+        for variable, valores in (('Conteo', conteo), ('Media Móvil', media_movil)):
+            parte = {'Fecha': np.tile(fechas_serie, num_grupos),
+                     'variable': variable,
+                     'value': valores.ravel().astype(float),
+                     'Tipo': tipo}
+            if nivel is not None:
+                parte = {nivel: np.repeat(grupos, num_dias), **parte}
+            partes.append(pd.DataFrame(parte))
+
+    if not partes:
+        # Ninguna serie tiene registros (p. ej. un municipio sin casos confirmados)
+        columnas = ([] if nivel is None else [nivel]) + ['Fecha', 'variable', 'value', 'Tipo']
+        partes = [pd.DataFrame(columns=columnas).astype({'Fecha': 'datetime64[ns]', 'value': float})]
+    curvas = pd.concat(partes, ignore_index=True)
+    curvas['variable'] = curvas['variable'].astype('category')
+    curvas['Tipo'] = curvas['Tipo'].astype('category')
+    return curvas
+
+@mide('curvas_epidemicas')
+def curvas_epidemicas(df, series=None, nivel=None, ventana=7):
+    """
+        Conteos diarios y su media móvil de `ventana` días para cada serie de `series` (por omisión casos confirmados,
+        defunciones y hospitalizaciones, ver SERIES_EPIDEMICAS), opcionalmente por `nivel` geográfico (por ejemplo
+        'CLAVE_MUNICIPIO_RES').
+
+        Regresa un DataFrame largo con columnas [nivel], Fecha, variable ('Conteo' o 'Media Móvil'), value y Tipo.
+        Cada serie cubre todos los días entre su primera y su última fecha, los días sin registros tienen conteo 0.
+        Hay una curva por cada valor de `nivel` que aparece en `df`, aunque no tenga registros de esa serie.
+    """
+    grupos = None if nivel is None else df[nivel].astype('category').cat.remove_unused_categories().cat.categories
+    conteos = conteos_diarios(df, series, nivel, grupos)
+    return curvas_de_conteos(conteos, series, nivel, grupos, ventana)
+
+# Cambiar este número cuando cambie la forma en que se construye o se guarda el cubo
+VERSION_CUBO = 2
+
+class CuboMunicipal:
+    """
+        Conteos acumulados de registros por día × municipio × clasificación final × tipo de paciente × defunción.
+
+        `acumulado[d, m, c, t, f]` es el número de registros del municipio m con clasificación c, tipo de paciente t y
+        defunción f cuya `columna_fecha` es anterior o igual al día d. Los registros sin clasificación o sin tipo de
+        paciente se cuentan en una última categoría None.
+    """
+
+    def __init__(self, acumulado, etiquetas):
+        self.acumulado = acumulado
+        self.etiquetas = etiquetas
+        self.inicio = pd.Timestamp(etiquetas['inicio'])
+        self.municipios = pd.Index(etiquetas['municipios'], name='CLAVE_MUNICIPIO_RES')
+
+    @classmethod
+    @mide('cubo')
+    def construye(cls, df, columna_fecha='FECHA_INGRESO', fuentes=None):
+        """
+            Construye el cubo a partir de una base aplanada con un solo np.bincount. `fuentes` son las firmas
+            {ruta: firma} de los archivos de los que salió la base, se guardan con el cubo. El eje de días va de la
+            primera a la última fecha, así que la base debe tener al menos un registro con `columna_fecha`.
+        """
+        dias = df[columna_fecha].to_numpy().astype('datetime64[D]')
+        dias = dias[~np.isnat(dias)].astype(np.int64)
+        if len(dias) == 0:
+            raise ValueError(f'No hay registros con {columna_fecha} para construir el cubo')
+        inicio = dias.min()
+        num_dias = int(dias.max() - inicio + 1)
+        ejes = {'municipios': list(df['CLAVE_MUNICIPIO_RES'].astype('category').cat.categories)}
+        for columna, nombre in (('CLASIFICACION_FINAL', 'clasificaciones'), ('TIPO_PACIENTE', 'tipos_paciente')):
+            ejes[nombre] = list(df[columna].astype('category').cat.categories) + [None]
+        conteo = cls.cuenta(df, columna_fecha, inicio, num_dias, ejes)
+        return cls.de_conteo(conteo, inicio, columna_fecha, ejes, fuentes)
+
+    @staticmethod
+    def cuenta(df, columna_fecha, inicio, num_dias, ejes):
+        """
+            Conteos (no acumulados) del cubo para los registros de `df`, con el eje de días desde `inicio` (en días
+            desde 1970-01-01) y las etiquetas de municipios, clasificaciones y tipos de paciente de `ejes`. Los
+            resultados de varios pedazos de la base con los mismos ejes se pueden sumar.
+        """
+        dias = df[columna_fecha].to_numpy().astype('datetime64[D]')
+        validos = ~np.isnat(dias)
+        dias = dias.astype(np.int64) - inicio
+        validos &= (dias >= 0) & (dias < num_dias)
+
+        codigos_ejes = []
+        municipio = pd.Categorical(df['CLAVE_MUNICIPIO_RES'], categories=ejes['municipios']).codes.astype(np.int64)
+        validos &= municipio >= 0
+        codigos_ejes.append((municipio, len(ejes['municipios'])))
+        for columna, nombre in (('CLASIFICACION_FINAL', 'clasificaciones'), ('TIPO_PACIENTE', 'tipos_paciente')):
+            # La última etiqueta es None, los registros sin dato o con un valor fuera de los ejes van ahí
+            codigos = pd.Categorical(df[columna], categories=ejes[nombre][:-1]).codes.astype(np.int64)
+            codigos = np.where(codigos < 0, len(ejes[nombre]) - 1, codigos)
+            codigos_ejes.append((codigos, len(ejes[nombre])))
+        codigos_ejes.append((df['DEFUNCION'].to_numpy().astype(np.int64), 2))
+
+        llave = dias[validos]
+        forma = [num_dias]
+        for codigos, tam in codigos_ejes:
+            llave = llave * tam + codigos[validos]
+            forma.append(tam)
+        return np.bincount(llave, minlength=int(np.prod(forma))).reshape(forma)
+
+    @classmethod
+    def de_conteo(cls, conteo, inicio, columna_fecha, ejes, fuentes=None):
+        """
+            El cubo con los acumulados de un arreglo de `cuenta`.
+        """
+        # Si el conteo ya es uint32 se acumula sobre él mismo
+        acumulado = np.cumsum(conteo, axis=0, dtype=np.uint32, out=conteo if conteo.dtype == np.uint32 else None)
+        etiquetas = {'version': VERSION_CUBO,
+                     'columna_fecha': columna_fecha,
+                     'inicio': str(pd.Timestamp(inicio, unit='D').date()),
+                     'fuentes': fuentes,
+                     **ejes}
+        return cls(acumulado, etiquetas)
+
+    def guarda(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, 'acumulado.npy')
+        with open(ruta + '.tmp', 'wb') as f:
+            np.save(f, self.acumulado, allow_pickle=False)
+        os.replace(ruta + '.tmp', ruta)
+        with open(os.path.join(directorio, 'etiquetas.json.tmp'), 'w') as f:
+            json.dump(self.etiquetas, f)
+        os.replace(os.path.join(directorio, 'etiquetas.json.tmp'), os.path.join(directorio, 'etiquetas.json'))
+
+    @classmethod
+    def abre(cls, directorio):
+        """
+            Abre un cubo guardado. El arreglo no se lee completo, sólo se mapea a memoria.
+        """
+        with open(os.path.join(directorio, 'etiquetas.json')) as f:
+            etiquetas = json.load(f)
+        acumulado = np.load(os.path.join(directorio, 'acumulado.npy'), mmap_mode='r')
+        return cls(acumulado, etiquetas)
+
+    @classmethod
+    def para_publicacion(cls, fecha, entidad='27', directorio_datos='/content/', directorio_cache=None,
+                         columna_fecha='FECHA_INGRESO'):
+        """
+            El cubo de la publicación `fecha`: lo abre de `directorio_cache` si ya se construyó a partir del mismo zip
+            de datos y los mismos catálogos y descriptores (las etiquetas de clasificaciones y tipos de paciente salen
+            de ellos), y si no lo construye (usando el cache de `carga_datos_covid19_MX`) y lo guarda.
+        """
+        if directorio_cache is None:
+            directorio_cache = os.path.join(directorio_datos, 'cache')
+        directorio = os.path.join(directorio_cache, f'cubo_{_nombre_cache(fecha, entidad, columna_fecha)}')
+        data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+        fuentes = [data_file, *rutas_diccionario(directorio_datos)]
+        if os.path.exists(os.path.join(directorio, 'etiquetas.json')):
+            cubo = cls.abre(directorio)
+            if cubo.etiquetas['version'] == VERSION_CUBO and _mismas_fuentes(fuentes, cubo.etiquetas.get('fuentes')):
+                return cubo
+        df = carga_datos_covid19_MX(fecha, entidad=entidad, directorio_datos=directorio_datos, cache=True,
+                                    directorio_cache=directorio_cache,
+                                    columnas=['CLASIFICACION_FINAL', 'TIPO_PACIENTE'])
+        cubo = cls.construye(df, columna_fecha,
+                             fuentes={fuente: firma_archivo(fuente, con_hash=True) for fuente in fuentes})
+        cubo.guarda(directorio)
+        return cubo
+
+    @property
+    def fechas(self):
+        return pd.date_range(self.inicio, periods=self.acumulado.shape[0])
+
+    def _dia(self, fecha):
+        # Posición del día en el eje de fechas (la última si fecha es None), -1 si es anterior al inicio
+        if fecha is None:
+            return self.acumulado.shape[0] - 1
+        dia = (pd.Timestamp(fecha) - self.inicio).days
+        return min(dia, self.acumulado.shape[0] - 1)
+
+    def _indices(self, nombre, valores):
+        if valores is None:
+            return slice(None)
+        valores = {_normaliza_espacios(valor) for valor in valores}
+        return [i for i, etiqueta in enumerate(self.etiquetas[nombre]) if _normaliza_espacios(etiqueta) in valores]
+
+    def _filtra(self, arreglo, clasificacion, tipo_paciente, defuncion):
+        # Los últimos tres ejes de `arreglo` son clasificación, tipo de paciente y defunción
+        arreglo = arreglo[..., self._indices('clasificaciones', clasificacion), :, :]
+        arreglo = arreglo[..., self._indices('tipos_paciente', tipo_paciente), :]
+        if defuncion is not None:
+            if defuncion not in (0, 1):
+                raise ValueError(f'defuncion debe ser 0 o 1, no {defuncion!r}')
+            arreglo = arreglo[..., [int(defuncion)]]
+        return arreglo.sum(axis=(-3, -2, -1), dtype=np.int64)
+
+    def _acumulado_al(self, dia, clasificacion, tipo_paciente, defuncion):
+        if dia < 0:
+            return np.zeros(len(self.municipios), dtype=np.int64)
+        return self._filtra(self.acumulado[dia], clasificacion, tipo_paciente, defuncion)
+
+    def diarios(self, clasificacion=None, tipo_paciente=None, defuncion=None):
+        """
+            Arreglo días × municipios con los registros acumulados hasta cada día (ver `fechas` y `municipios`).
+        """
+        return self._filtra(self.acumulado, clasificacion, tipo_paciente, defuncion)
+
+    def _serie(self, valores, nombre):
+        return pd.Series(valores, index=self.municipios, name=nombre)
+
+    def acumulados(self, fecha=None, clasificacion=None, tipo_paciente=None, defuncion=None):
+        """
+            Registros por municipio hasta `fecha` (inclusive, por omisión el último día). `clasificacion` y
+            `tipo_paciente` son listas de valores aceptados y `defuncion` 0 o 1; None no filtra.
+        """
+        return self._serie(self._acumulado_al(self._dia(fecha), clasificacion, tipo_paciente, defuncion),
+                           'Casos Acumulados')
+
+    def nuevos(self, fecha=None, clasificacion=None, tipo_paciente=None, defuncion=None):
+        """
+            Registros por municipio en el día `fecha` (por omisión el último día).
+        """
+        return self.ultimos_dias(fecha, 1, clasificacion, tipo_paciente, defuncion).rename('Nuevos Casos')
+
+    def ultimos_dias(self, fecha=None, dias=14, clasificacion=None, tipo_paciente=None, defuncion=None):
+        """
+            Registros por municipio en los `dias` días que terminan en `fecha` (por omisión el último día).
+        """
+        if dias < 1:
+            raise ValueError(f'dias debe ser al menos 1, no {dias!r}')
+        dia = self._dia(fecha)
+        valores = (self._acumulado_al(dia, clasificacion, tipo_paciente, defuncion)
+                   - self._acumulado_al(dia - dias, clasificacion, tipo_paciente, defuncion))
+        return self._serie(valores, f'Casos {dias} días')
+
+    def tasa(self, poblacion, fecha=None, dias=None, clasificacion=None, tipo_paciente=None, defuncion=None):
+        """
+            Tasa por 100,000 habitantes por municipio, acumulada hasta `fecha` o, si se da `dias`, de los últimos `dias`
+            días. `poblacion` es una serie indexada por la clave de municipio (p. ej. la columna pob2020 de los
+            municipios indexada por municipio_cvegeo).
+        """
+        if dias is None:
+            casos = self.acumulados(fecha, clasificacion, tipo_paciente, defuncion)
+        else:
+            casos = self.ultimos_dias(fecha, dias, clasificacion, tipo_paciente, defuncion)
+        return (casos / poblacion.reindex(casos.index) * 100000).rename('Tasa x 100,000 habitantes')
+
+def valores_diarios(cubo, municipios, clasificacion=VALORES_CONFIRMADOS, ventana=7, clave='municipio_cvegeo',
+                    poblacion='pob2020'):
+    """
+        Arreglos días × municipios (en el orden de los renglones de `municipios`) con los nuevos casos, su media móvil
+        de `ventana` días y la tasa acumulada por 100,000 habitantes según la columna `poblacion`, para los días de
+        `cubo.fechas`. Regresa un diccionario nombre -> arreglo, listo para `mapa_animado`.
+    """
+    acumulado = cubo.diarios(clasificacion=clasificacion)
+    # Los municipios sin registros no están en el cubo; get_indexer les da -1, que apunta a una columna de ceros
+    acumulado = np.column_stack([acumulado, np.zeros(len(acumulado), dtype=np.int64)])
+    acumulado = acumulado[:, cubo.municipios.get_indexer(municipios[clave])]
+    nuevos = np.diff(acumulado, axis=0, prepend=0)
+    anterior = np.zeros_like(acumulado)
+    anterior[ventana:] = acumulado[:-ventana]
+    media_movil = (acumulado - anterior) / ventana
+    # Como en las curvas epidémicas, los primeros días no tienen ventana completa
+    media_movil[:ventana - 1] = np.nan
+    tasa = acumulado / municipios[poblacion].to_numpy(dtype=float) * 100000
+    return {'Nuevos Casos': nuevos, 'Media Móvil': media_movil, 'Tasa x 100,000 habitantes': tasa}
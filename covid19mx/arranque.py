@@ -0,0 +1,52 @@
+"""
+    Medición del arranque en frío del camino de sólo datos: bajar, aplanar y agregar, sin gráficas ni mapas.
+"""
+import os
+import json
+import subprocess
+import sys
+
+# Lo que importa un proceso que sólo baja datos y calcula conteos
+MODULOS_DATOS = ['covid19mx.descarga', 'covid19mx.carga', 'covid19mx.agregados']
+# Dependencias de visualización que ese proceso no debe cargar
+MODULOS_PESADOS = ['geopandas', 'shapely', 'folium', 'branca', 'plotly', 'mapclassify', 'matplotlib', 'openpyxl']
+# Segundos para importar MODULOS_DATOS en un proceso nuevo. Casi todo es pandas (unos 0.4 s en un núcleo); el
+# script con todas las dependencias de visualización tardaba más de 2 s
+PRESUPUESTO_ARRANQUE = 1.0
+
+_CODIGO_MEDICION = '''
+import json, sys, time
+inicio = time.perf_counter()
+for modulo in sys.argv[2:]:
+    __import__(modulo)
+tiempo = time.perf_counter() - inicio
+print(json.dumps({'tiempo': tiempo, 'cargados': [m for m in sys.argv[1].split(',') if m in sys.modules]}))
+'''
+
+def mide_arranque(modulos=MODULOS_DATOS, repeticiones=5):
+    """
+        Segundos que tarda un proceso nuevo de Python en importar `modulos` (el mejor de `repeticiones` procesos, sin
+        contar el arranque del intérprete) y cuáles de MODULOS_PESADOS quedaron cargados.
+    """
+    entorno = dict(os.environ)
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    entorno['PYTHONPATH'] = os.pathsep.join(filter(None, [raiz, entorno.get('PYTHONPATH')]))
+    mediciones = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, '-c', _CODIGO_MEDICION, ','.join(MODULOS_PESADOS), *modulos],
+                                capture_output=True, text=True, check=True, env=entorno)
+        mediciones.append(json.loads(salida.stdout))
+    return min(mediciones, key=lambda medicion: medicion['tiempo'])
+
+def revisa_arranque(presupuesto=PRESUPUESTO_ARRANQUE, modulos=MODULOS_DATOS, repeticiones=5):
+    """
+        `mide_arranque` que además lanza RuntimeError si la importación se pasa de `presupuesto` segundos o si cargó
+        alguna de las dependencias de visualización.
+    """
+    medicion = mide_arranque(modulos, repeticiones)
+    if medicion['cargados']:
+        raise RuntimeError(f'Importar {", ".join(modulos)} carga {", ".join(medicion["cargados"])}')
+    if medicion['tiempo'] > presupuesto:
+        raise RuntimeError(f'Importar {", ".join(modulos)} tarda {medicion["tiempo"]:.2f} s, '
+                           f'el presupuesto es {presupuesto:.2f} s')
+    return medicion
@@ -0,0 +1,247 @@
+"""
+    Tiempos y memoria de cada etapa del notebook (lectura, catálogos, aplanado, fechas, agregados y mapas) sobre una
+    publicación ya en disco, por ejemplo una generada con `covid19mx.sinteticos`, y comparación contra una corrida
+    anterior para detectar regresiones.
+"""
+import os
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .carga import (lee_datos_covid19_MX, lee_catalogos, ResolutorCatalogos, rutas_diccionario,
+                    carga_datos_covid19_MX, procesa_fechas)
+from .agregados import VALORES_CONFIRMADOS, curvas_epidemicas, CuboMunicipal
+
+# Cambiar este número cuando cambie lo que mide alguna etapa, para no comparar contra resultados que no son comparables
+VERSION_BENCHMARK = 1
+
+class Etapa:
+    """
+        Una etapa del benchmark: `prepara(contexto)` regresa los argumentos de `ejecuta` (no se mide) y el resultado de
+        `ejecuta` se guarda en `contexto[guarda]` para las etapas siguientes.
+    """
+
+    def __init__(self, nombre, ejecuta, prepara=None, guarda=None):
+        self.nombre = nombre
+        self.ejecuta = ejecuta
+        self.prepara = prepara if prepara is not None else lambda contexto: ()
+        self.guarda = guarda
+
+def _curvas_grouper(aplanados):
+    # Las curvas como las calcula el notebook original: filtrar, indexar por fecha y agrupar con pd.Grouper
+    confirmados = aplanados.loc[aplanados['CLASIFICACION_FINAL'].isin(VALORES_CONFIRMADOS)]
+    curvas = []
+    for tipo, fecha, datos in [('Casos Confirmados', 'FECHA_SINTOMAS', confirmados),
+                               ('Defunciones', 'FECHA_DEF', confirmados.loc[confirmados['FECHA_DEF'].notnull()]),
+                               ('Hospitalizaciones', 'FECHA_SINTOMAS',
+                                confirmados[confirmados.TIPO_PACIENTE == 'HOSPITALIZADO'])]:
+        diarios = (datos.set_index(fecha)
+                   .groupby(pd.Grouper(freq='D'))[['ID_REGISTRO']]
+                   .size()
+                   .reset_index()
+                   .rename({0: 'Conteo'}, axis=1))
+        diarios['Media Móvil'] = diarios['Conteo'].rolling(window=7).mean()
+        diarios = diarios.melt(id_vars=[fecha], value_vars=['Conteo', 'Media Móvil']).rename({fecha: 'Fecha'}, axis=1)
+        diarios['Tipo'] = tipo
+        curvas.append(diarios)
+    return pd.concat(curvas, ignore_index=True)
+
+def _une_municipios(municipios, aplanados):
+    # La unión de los conteos por municipio con las geometrías, como en el notebook
+    acumulados = (aplanados
+                  .groupby(['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'], observed=True)['ID_REGISTRO']
+                  .size()
+                  .reset_index()
+                  .rename({'ID_REGISTRO': 'Casos Acumulados'}, axis=1))
+    acumulados = (municipios
+                  .merge(acumulados, left_on='municipio_cvegeo', right_on='CLAVE_MUNICIPIO_RES', how='left')
+                  .drop(columns=['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'])
+                  .fillna({'Casos Acumulados': 0}))
+    acumulados['Tasa x 100,000 habitantes'] = acumulados['Casos Acumulados'] / acumulados['pob2020'] * 100000
+    return acumulados
+
+def _carga(contexto, cache):
+    return carga_datos_covid19_MX(contexto['fecha'], entidad=contexto['entidad'],
+                                  directorio_datos=contexto['directorio_datos'], cache=cache,
+                                  directorio_cache=os.path.join(contexto['temporal'], 'cache'))
+
+def _prepara_cache(contexto):
+    # La primera carga escribe el cache; lo que se mide es la lectura con el cache ya escrito
+    if not contexto.get('cache_escrito'):
+        _carga(contexto, cache=True)
+        contexto['cache_escrito'] = True
+    return (contexto,)
+
+def _prepara_geometrias(contexto):
+    directorio = os.path.join(contexto['temporal'], 'geometrias')
+    shutil.rmtree(directorio, ignore_errors=True)
+    return contexto['directorio_datos'], directorio
+
+def _municipios_mapa(geometrias, entidad):
+    if isinstance(entidad, str):
+        return geometrias.entidad(entidad)
+    return geometrias.municipios(zoom=5)
+
+def _renderiza_mapa(municipios):
+    from .mapas import mapa_capas
+    return mapa_capas(municipios, ['Tasa x 100,000 habitantes', 'Casos Acumulados']).get_root().render()
+
+def etapas_benchmark(mapas=False):
+    """
+        Las etapas del benchmark en el orden en que se corren. Con `mapas` se agregan las de geometrías, la unión por
+        municipio y el HTML del mapa de capas (requieren geopandas y folium).
+    """
+    etapas = [
+        Etapa('lectura_csv', lee_datos_covid19_MX,
+              lambda c: (c['data_file'], c['entidad']), guarda='crudos'),
+        Etapa('catalogos', lee_catalogos,
+              lambda c: rutas_diccionario(c['directorio_datos']), guarda='catalogos'),
+        Etapa('aplanado', lambda resolutor, df: resolutor.resuelve(df),
+              lambda c: (ResolutorCatalogos(c['catalogos']), c['crudos'].copy()), guarda='resueltos'),
+        Etapa('fechas', procesa_fechas,
+              lambda c: (c['resueltos'].copy(),), guarda='aplanados'),
+        Etapa('carga_datos', lambda c: _carga(c, cache=False), lambda c: (c,)),
+        Etapa('carga_cache', lambda c: _carga(c, cache=True), _prepara_cache),
+        Etapa('curvas_grouper', _curvas_grouper, lambda c: (c['aplanados'],)),
+        Etapa('curvas_epidemicas', curvas_epidemicas, lambda c: (c['aplanados'],)),
+        Etapa('curvas_municipio', lambda df: curvas_epidemicas(df, nivel='CLAVE_MUNICIPIO_RES'),
+              lambda c: (c['aplanados'],)),
+        Etapa('cubo', CuboMunicipal.construye, lambda c: (c['aplanados'],)),
+    ]
+    if mapas:
+        from .mapas import AlmacenGeometrias
+        etapas += [
+            Etapa('geometrias', lambda directorio_datos, directorio: AlmacenGeometrias.prepara(directorio_datos,
+                                                                                             directorio=directorio),
+                  _prepara_geometrias, guarda='geometrias'),
+            Etapa('une_municipios', _une_municipios,
+                  lambda c: (_municipios_mapa(c['geometrias'], c['entidad']), c['aplanados']), guarda='municipios'),
+            Etapa('mapa_capas', _renderiza_mapa, lambda c: (c['municipios'],)),
+        ]
+    return etapas
+
+def _renglones(resultado):
+    try:
+        return len(resultado)
+    except TypeError:
+        return None
+
+def _commit():
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return salida.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def corre_benchmark(directorio_datos='/content/', fecha='210505', entidad=None, repeticiones=3, mapas=False,
+                    etapas=None, salida=None):
+    """
+        Corre cada etapa de `etapas_benchmark(mapas)` (o sólo las de nombre en `etapas`, junto con las que necesitan)
+        sobre la publicación `fecha` de `directorio_datos`, filtrada a `entidad` (None es todo el país).
+
+        Cada etapa se mide `repeticiones` veces con perf_counter y una vez más con tracemalloc para el pico de memoria
+        de Python (tracemalloc hace lentas las asignaciones, por eso los tiempos se miden sin él). Los caches se
+        escriben en un directorio temporal, así que las corridas no dependen de lo que haya en `directorio_datos`.
+
+        Regresa un diccionario {'meta': ..., 'etapas': {nombre: {...}}} y, si se da `salida`, lo guarda en JSON.
+    """
+    data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+    meta = {'version': VERSION_BENCHMARK,
+            'fecha_corrida': datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'publicacion': fecha,
+            'entidad': entidad,
+            'tam_zip_mb': os.path.getsize(data_file) / 2**20,
+            'repeticiones': repeticiones}
+    resultados = {}
+    temporal = tempfile.mkdtemp(prefix='benchmark_covid19mx_')
+    try:
+        contexto = {'directorio_datos': directorio_datos, 'data_file': data_file, 'fecha': fecha, 'entidad': entidad,
+                    'temporal': temporal}
+        # Las etapas que no se piden se corren una vez si guardan algo que pueden usar las siguientes, pero no se miden
+        for etapa in etapas_benchmark(mapas):
+            reporta = etapas is None or etapa.nombre in etapas
+            if not reporta and etapa.guarda is None:
+                continue
+            tiempos = []
+            for _ in range(repeticiones if reporta else 0):
+                argumentos = etapa.prepara(contexto)
+                gc.collect()
+                inicio = time.perf_counter()
+                resultado = etapa.ejecuta(*argumentos)
+                tiempos.append(time.perf_counter() - inicio)
+                del argumentos, resultado
+            argumentos = etapa.prepara(contexto)
+            gc.collect()
+            tracemalloc.start()
+            resultado = etapa.ejecuta(*argumentos)
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del argumentos
+            if etapa.guarda is not None:
+                contexto[etapa.guarda] = resultado
+            if reporta:
+                resultados[etapa.nombre] = {'tiempos': tiempos,
+                                            'minimo': min(tiempos) if tiempos else None,
+                                            'mediana': float(np.median(tiempos)) if tiempos else None,
+                                            'pico_mb': pico / 2**20,
+                                            'renglones': _renglones(resultado)}
+            del resultado
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+    if 'aplanados' in contexto:
+        meta['renglones'] = len(contexto['aplanados'])
+    corrida = {'meta': meta, 'etapas': resultados}
+    if salida is not None:
+        guarda_resultados(corrida, salida)
+    return corrida
+
+def guarda_resultados(corrida, ruta):
+    with open(ruta + '.tmp', 'w') as f:
+        json.dump(corrida, f, indent=1)
+    os.replace(ruta + '.tmp', ruta)
+
+def lee_resultados(ruta):
+    with open(ruta) as f:
+        return json.load(f)
+
+def compara_resultados(actual, anterior, tolerancia=0.10):
+    """
+        Tabla por etapa con el tiempo mínimo y el pico de memoria de dos corridas (diccionarios de `corre_benchmark` o
+        rutas a sus JSON) y su cambio relativo. `regresion` marca las etapas en que alguno creció más que `tolerancia`.
+        Se compara el mínimo porque es el menos sensible a lo que esté haciendo el resto de la máquina.
+    """
+    actual = lee_resultados(actual) if isinstance(actual, str) else actual
+    anterior = lee_resultados(anterior) if isinstance(anterior, str) else anterior
+    if actual['meta']['version'] != anterior['meta']['version']:
+        raise ValueError(f'Las corridas son de versiones distintas del benchmark '
+                         f'({anterior["meta"]["version"]} y {actual["meta"]["version"]})')
+    renglones = []
+    for etapa in actual['etapas']:
+        if etapa not in anterior['etapas']:
+            continue
+        nuevo, viejo = actual['etapas'][etapa], anterior['etapas'][etapa]
+        renglones.append({'etapa': etapa,
+                          'tiempo_anterior': viejo['minimo'], 'tiempo_actual': nuevo['minimo'],
+                          'memoria_anterior_mb': viejo['pico_mb'], 'memoria_actual_mb': nuevo['pico_mb']})
+    tabla = pd.DataFrame(renglones, columns=['etapa', 'tiempo_anterior', 'tiempo_actual', 'memoria_anterior_mb',
+                                             'memoria_actual_mb']).set_index('etapa')
+    tabla['cambio_tiempo'] = tabla['tiempo_actual'] / tabla['tiempo_anterior'] - 1
+    tabla['cambio_memoria'] = tabla['memoria_actual_mb'] / tabla['memoria_anterior_mb'] - 1
+    tabla['regresion'] = (tabla['cambio_tiempo'] > tolerancia) | (tabla['cambio_memoria'] > tolerancia)
+    return tabla
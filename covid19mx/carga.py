@@ -0,0 +1,718 @@
+"""
+    Lectura y *aplanado* de la base de la DGE: tipos de las columnas, lectura por bloques, catálogos, cache en parquet
+    de las bases aplanadas y almacén incremental de registros.
+"""
+import os
+import glob
+import json
+import hashlib
+import pickle
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .instrumentacion import etapa, mide
+
+FORMATO_FECHA = '%Y-%m-%d'
+
+COLUMNAS_FECHA = ['FECHA_ACTUALIZACION', 'FECHA_INGRESO', 'FECHA_SINTOMAS', 'FECHA_DEF']
+
+CLAVES_ENTIDAD = [f'{clave:02d}' for clave in range(1, 33)] + ['36', '97', '98', '99']
+
+CLAVES_MUNICIPIO = [f'{clave:03d}' for clave in range(1000)]
+
+# Columnas con claves de catálogo (SI_NO, TIPO_PACIENTE, RESULTADO_LAB, etc.), todas caben en un int8
+COLUMNAS_CLAVE_NUMERICA = ['ORIGEN', 'SECTOR', 'SEXO', 'TIPO_PACIENTE', 'INTUBADO', 'NEUMONIA', 'NACIONALIDAD',
+                           'EMBARAZO', 'HABLA_LENGUA_INDIG', 'INDIGENA', 'DIABETES', 'EPOC', 'ASMA', 'INMUSUPR',
+                           'HIPERTENSION', 'OTRA_COM', 'CARDIOVASCULAR', 'OBESIDAD', 'RENAL_CRONICA', 'TABAQUISMO',
+                           'OTRO_CASO', 'TOMA_MUESTRA_LAB', 'RESULTADO_LAB', 'TOMA_MUESTRA_ANTIGENO',
+                           'RESULTADO_ANTIGENO', 'CLASIFICACION_FINAL', 'MIGRANTE', 'UCI']
+
+ESQUEMA_DGE = {'ID_REGISTRO': object,
+               'ENTIDAD_UM': pd.CategoricalDtype(CLAVES_ENTIDAD),
+               'ENTIDAD_NAC': pd.CategoricalDtype(CLAVES_ENTIDAD),
+               'ENTIDAD_RES': pd.CategoricalDtype(CLAVES_ENTIDAD),
+               'MUNICIPIO_RES': pd.CategoricalDtype(CLAVES_MUNICIPIO),
+               'EDAD': 'int16',
+               'PAIS_NACIONALIDAD': 'category',
+               'PAIS_ORIGEN': 'category',
+               **{col: 'int8' for col in COLUMNAS_CLAVE_NUMERICA}}
+
+def convierte_fechas(df):
+    """
+        Convierte a datetime64 las columnas FECHA_* presentes, los valores '9999-99-99' quedan como NaT.
+    """
+    for col in COLUMNAS_FECHA:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], format=FORMATO_FECHA, errors='coerce')
+    return df
+
+# Columnas indispensables para el aplanado y el procesamiento de fechas, siempre se leen aunque se pida
+# un subconjunto de columnas
+COLUMNAS_REQUERIDAS = ['ENTIDAD_RES', 'MUNICIPIO_RES', 'FECHA_INGRESO', 'FECHA_SINTOMAS', 'FECHA_DEF', 'EDAD']
+
+# Nombres de columnas que corregimos al leer (nombre en el CSV -> nombre en los descriptores)
+RENOMBRES_COLUMNAS = {'OTRA_COM': 'OTRAS_COM'}
+
+# Estimación gruesa de lo que ocupa en memoria una celda mientras pandas la lee del CSV y número de
+# columnas del CSV en el formato posterior a 20-11-28
+BYTES_POR_CELDA = 64
+
+NUM_COLUMNAS_DGE = 40
+
+def concatena_bloques(partes):
+    """
+        pd.concat que conserva las columnas categóricas aunque cada bloque haya visto categorías distintas.
+    """
+    if len(partes) == 1:
+        return partes[0]
+    tipos = {}
+    for col in partes[0].columns:
+        if isinstance(partes[0][col].dtype, pd.CategoricalDtype):
+            categorias = pd.api.types.union_categoricals([parte[col] for parte in partes]).categories
+            tipos[col] = pd.CategoricalDtype(categorias)
+    return pd.concat([parte.astype(tipos) for parte in partes])
+
+def lee_bloques_covid19_MX(data_file, entidad=None, columnas=None, chunksize=None):
+    """
+        Generador con los bloques de `chunksize` renglones (uno solo con todo el archivo si no se da) del CSV
+        comprimido de la DGE, ya filtrados por `entidad`, con las fechas convertidas y las columnas renombradas.
+        Ver `lee_datos_covid19_MX`.
+    """
+    usecols = None
+    if columnas is not None:
+        seleccion = set(columnas) | set(COLUMNAS_REQUERIDAS)
+        usecols = lambda col: col in seleccion or RENOMBRES_COLUMNAS.get(col) in seleccion
+    if entidad is not None and isinstance(entidad, str):
+        entidad = [entidad]
+
+    lector = pd.read_csv(data_file, dtype=ESQUEMA_DGE, encoding='latin-1', usecols=usecols, chunksize=chunksize)
+    if chunksize is None:
+        lector = [lector]
+    for bloque in lector:
+        if entidad is not None:
+            bloque = bloque[bloque['ENTIDAD_RES'].isin(entidad)]
+        # Hay un error y el campo OTRA_COMP es OTRAS_COMP según los descriptores
+        yield convierte_fechas(bloque.copy()).rename(columns=RENOMBRES_COLUMNAS)
+
+def lee_datos_covid19_MX(data_file, entidad=None, columnas=None, chunksize=None):
+    """
+        Lee el CSV comprimido de la DGE quedándose sólo con los pacientes que residen en `entidad` (una clave o
+        lista de claves) y con las `columnas` pedidas (más las requeridas para el aplanado). Las columnas se leen con
+        los tipos de `ESQUEMA_DGE` y las fechas se convierten en cada bloque.
+
+        Si se da `chunksize`, el archivo se descomprime y se lee en bloques de ese número de renglones y el filtro
+        se aplica a cada bloque, así en memoria sólo se acumula el resultado filtrado en lugar de la base nacional.
+    """
+    return concatena_bloques(list(lee_bloques_covid19_MX(data_file, entidad, columnas, chunksize)))
+
+# Cambiar este número cuando cambie la forma de aplanar los datos para invalidar las copias en cache
+VERSION_CACHE = 3
+
+# Columnas que el aplanado agrega siempre, sin importar las columnas que se pidan
+COLUMNAS_DERIVADAS = ['CLAVE_MUNICIPIO_RES', 'CLAVE_ENTIDAD_RES', 'DEFUNCION', 'AÑO_INGRESO', 'MES_INGRESO',
+                      'DIA_SEMANA_INGRESO', 'SEMANA_AÑO_INGRESO', 'DIA_MES_INGRESO', 'DIA_AÑO_INGRESO']
+
+def hash_archivo(ruta, tam_bloque=2**20):
+    """
+        sha256 del contenido de un archivo, leído por bloques.
+    """
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def firma_archivo(ruta, con_hash=False):
+    """
+        Tamaño y fecha de modificación (y opcionalmente el hash) de un archivo, para saber si cambió.
+    """
+    info = os.stat(ruta)
+    firma = {'tam': info.st_size, 'mtime': info.st_mtime_ns}
+    if con_hash:
+        firma['sha256'] = hash_archivo(ruta)
+    return firma
+
+def _mismo_archivo(ruta, firma):
+    """
+        Compara un archivo contra una firma guardada. Si el tamaño y la fecha coinciden lo damos por igual,
+        si sólo cambió la fecha (p. ej. se volvió a bajar el mismo archivo) decidimos con el hash.
+    """
+    actual = firma_archivo(ruta)
+    if actual['tam'] != firma['tam']:
+        return False
+    if actual['mtime'] == firma['mtime']:
+        return True
+    return hash_archivo(ruta) == firma.get('sha256')
+
+def _mismas_fuentes(fuentes, firmas):
+    """
+        Compara los archivos `fuentes` contra las firmas guardadas {ruta: firma} de `firma_archivo`: tienen que ser
+        los mismos archivos y ninguno puede haber cambiado.
+    """
+    return (firmas is not None and sorted(firmas) == sorted(fuentes)
+            and all(os.path.exists(fuente) and _mismo_archivo(fuente, firmas[fuente]) for fuente in fuentes))
+
+def _nombre_cache(fecha, entidad, resolver_claves):
+    if entidad is None:
+        entidad = 'nacional'
+    elif not isinstance(entidad, str):
+        entidad = '-'.join(sorted(entidad))
+    return f'{fecha}_{entidad}_{resolver_claves}'
+
+def _columnas_cache(columnas, disponibles):
+    """
+        De las columnas de una base aplanada, las que corresponden a haber leído sólo `columnas` del CSV.
+    """
+    seleccion = set(columnas) | set(COLUMNAS_REQUERIDAS)
+    seleccion |= {RENOMBRES_COLUMNAS.get(col, col) for col in seleccion}
+    if 'RESULTADO_LAB' in seleccion:
+        seleccion.add('RESULTADO')
+    conservar = []
+    for col in disponibles:
+        origen = col[:-4] if col.endswith(('_BIN', '_NOM')) else col
+        if origen in seleccion or col in COLUMNAS_DERIVADAS:
+            conservar.append(col)
+    return conservar
+
+def lee_cache_aplanados(directorio_cache, fecha, entidad, resolver_claves, fuentes, columnas=None):
+    """
+        Regresa la base aplanada guardada en cache o None si no existe o si alguno de los archivos `fuentes`
+        (el zip de datos y los catálogos) cambió desde que se guardó. Sólo se leen de disco las columnas necesarias.
+    """
+    nombre = _nombre_cache(fecha, entidad, resolver_claves)
+    ruta = os.path.join(directorio_cache, nombre + '.parquet')
+    ruta_meta = os.path.join(directorio_cache, nombre + '.json')
+    if not (os.path.exists(ruta) and os.path.exists(ruta_meta)):
+        return None
+    with open(ruta_meta) as f:
+        meta = json.load(f)
+    if meta.get('version') != VERSION_CACHE or sorted(meta['fuentes']) != sorted(fuentes):
+        return None
+    actualizar_meta = False
+    for fuente in fuentes:
+        firma = meta['fuentes'][fuente]
+        if not os.path.exists(fuente) or not _mismo_archivo(fuente, firma):
+            logging.debug(f'Cache inválido para {nombre}: cambió {fuente}')
+            return None
+        mtime = os.stat(fuente).st_mtime_ns
+        if mtime != firma['mtime']:
+            # El contenido es el mismo, guardamos la nueva fecha para no volver a calcular el hash
+            firma['mtime'] = mtime
+            actualizar_meta = True
+    if actualizar_meta:
+        with open(ruta_meta + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(ruta_meta + '.tmp', ruta_meta)
+
+    leer = None
+    if columnas is not None:
+        leer = _columnas_cache(columnas, meta['columnas'])
+    df = pd.read_parquet(ruta, columns=leer, memory_map=True)
+    df.set_index('FECHA_INGRESO', drop=False, inplace=True)
+    # Marcamos el uso para que la limpieza borre primero lo que no se ha usado
+    os.utime(ruta)
+    return df
+
+def guarda_cache_aplanados(df, directorio_cache, fecha, entidad, resolver_claves, fuentes):
+    """
+        Guarda la base aplanada en formato columnar (parquet) junto con la firma de los archivos de los que salió.
+    """
+    os.makedirs(directorio_cache, exist_ok=True)
+    nombre = _nombre_cache(fecha, entidad, resolver_claves)
+    ruta = os.path.join(directorio_cache, nombre + '.parquet')
+    ruta_meta = os.path.join(directorio_cache, nombre + '.json')
+    meta = {'version': VERSION_CACHE,
+            'fuentes': {fuente: firma_archivo(fuente, con_hash=True) for fuente in fuentes},
+            'columnas': list(df.columns)}
+    # Escribimos a un temporal y renombramos para no dejar archivos a medias
+    df.to_parquet(ruta + '.tmp', index=False)
+    os.replace(ruta + '.tmp', ruta)
+    with open(ruta_meta + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(ruta_meta + '.tmp', ruta_meta)
+
+def limpia_cache_aplanados(directorio_cache, limite_mb):
+    """
+        Borra las entradas usadas hace más tiempo hasta que el cache ocupe menos de `limite_mb` megabytes.
+    """
+    entradas = []
+    for ruta in glob.glob(os.path.join(directorio_cache, '*.parquet')):
+        info = os.stat(ruta)
+        entradas.append((info.st_mtime, info.st_size, ruta))
+    total = sum(tam for _, tam, _ in entradas)
+    for _, tam, ruta in sorted(entradas):
+        if total <= limite_mb * 2**20:
+            break
+        logging.debug(f'Borrando del cache {ruta}')
+        os.remove(ruta)
+        ruta_meta = ruta[:-len('.parquet')] + '.json'
+        if os.path.exists(ruta_meta):
+            os.remove(ruta_meta)
+        total -= tam
+
+def dict_claves_numericas(claves, valores):
+    """
+        Diccionario clave -> valor de un catálogo, con las claves como enteros. Los renglones cuya clave no es un
+        número (encabezados mal leídos del excel) se descartan.
+    """
+    claves = pd.to_numeric(claves, errors='coerce')
+    validos = claves.notna()
+    return dict(zip(claves[validos].astype(int), valores[validos]))
+
+def lee_catalogos(catalogos, descriptores, nuevo_formato=True):
+    """
+        Lee el excel de catálogos y el de descriptores y regresa los catálogos que usa el aplanado ya normalizados:
+        diccionarios clave -> descripción (las claves numéricas como enteros) y la lista de campos de tipo SI_NO.
+    """
+    nombres_catalogos = ['Catálogo de ENTIDADES',
+                         'Catálogo MUNICIPIOS',
+                         'Catálogo RESULTADO',
+                         'Catálogo SI_NO',
+                         'Catálogo TIPO_PACIENTE']
+    if nuevo_formato:
+        nombres_catalogos.append('Catálogo CLASIFICACION_FINAL')
+        nombres_catalogos[2] = 'Catálogo RESULTADO_LAB'
+
+    dict_catalogos = pd.read_excel(catalogos,
+                              nombres_catalogos,
+                              dtype=str,
+                              engine='openpyxl')
+
+    entidades = dict_catalogos[nombres_catalogos[0]]
+    municipios = dict_catalogos[nombres_catalogos[1]]
+    tipo_resultado = dict_catalogos[nombres_catalogos[2]]
+    cat_si_no = dict_catalogos[nombres_catalogos[3]]
+    cat_tipo_pac = dict_catalogos[nombres_catalogos[4]]
+    # Arreglar los catálogos que tienen mal las primeras líneas
+    tipo_resultado.columns = ["CLAVE", "DESCRIPCIÓN"]
+    if nuevo_formato:
+        tipo_resultado['DESCRIPCIÓN'] = tipo_resultado['DESCRIPCIÓN'].replace({'POSITIVO A SARS-COV-2': 'Positivo SARS-CoV-2'})
+        clasificacion_final = dict_catalogos[nombres_catalogos[5]]
+        clasificacion_final.columns = ["CLAVE", "CLASIFICACIÓN", "DESCRIPCIÓN"]
+        clasificacion_final = dict_claves_numericas(clasificacion_final['CLAVE'], clasificacion_final['CLASIFICACIÓN'])
+    else:
+        clasificacion_final = {}
+
+    # Construye clave unica de municipios de catálogo para resolver nombres de municipio
+    municipios['CLAVE_MUNICIPIO'] = municipios['CLAVE_ENTIDAD'] + municipios['CLAVE_MUNICIPIO']
+
+    # Necesitamos encontrar todos los campos de tipo SI_NO y eso
+    # viene en los descriptores, en el campo FORMATO_O_FUENTE
+    descriptores = pd.read_excel(descriptores,
+                                 index_col='Nº',
+                                 engine='openpyxl')
+    descriptores.columns = list(map(lambda col: col.replace(' ', '_'), descriptores.columns))
+    descriptores['FORMATO_O_FUENTE'] = descriptores.FORMATO_O_FUENTE.str.strip()
+    datos_si_no = descriptores.query('FORMATO_O_FUENTE == "CATÁLOGO: SI_ NO"')
+
+    return {'entidades': dict(zip(entidades['CLAVE_ENTIDAD'], entidades['ENTIDAD_FEDERATIVA'])),
+            'municipios': dict(zip(municipios['CLAVE_MUNICIPIO'], municipios['MUNICIPIO'])),
+            'resultado': dict_claves_numericas(tipo_resultado['CLAVE'], tipo_resultado['DESCRIPCIÓN']),
+            'si_no': dict_claves_numericas(cat_si_no['CLAVE'], cat_si_no['DESCRIPCIÓN'].str.strip()),
+            'tipo_paciente': dict_claves_numericas(cat_tipo_pac['CLAVE'], cat_tipo_pac['DESCRIPCIÓN']),
+            'clasificacion_final': clasificacion_final,
+            'campos_si_no': list(datos_si_no.NOMBRE_DE_VARIABLE)}
+
+# Cambiar este número cuando cambie lo que regresa lee_catalogos
+VERSION_CACHE_CATALOGOS = 1
+
+# Copia en memoria de los catálogos ya leídos, por (catalogos, descriptores, nuevo_formato)
+_CATALOGOS_MEMO = {}
+
+def carga_catalogos(catalogos, descriptores, nuevo_formato=True, directorio_cache=None):
+    """
+        Igual que `lee_catalogos` pero sin abrir los excel cada vez. Los catálogos normalizados se guardan en un pickle
+        en `directorio_cache` (por omisión el subdirectorio cache junto al excel) y además en memoria, así que sólo se
+        vuelven a leer los excel cuando alguno de los dos archivos cambia.
+    """
+    llave = (catalogos, descriptores, nuevo_formato)
+    firmas = {ruta: firma_archivo(ruta) for ruta in (catalogos, descriptores)}
+    memo = _CATALOGOS_MEMO.get(llave)
+    if memo is not None and memo['firmas'] == firmas:
+        return memo['catalogos']
+
+    if directorio_cache is None:
+        directorio_cache = os.path.join(os.path.dirname(catalogos), 'cache')
+    nombre = os.path.splitext(os.path.basename(catalogos))[0].replace(' ', '_')
+    ruta_cache = os.path.join(directorio_cache, f'{nombre}_{"nuevo" if nuevo_formato else "anterior"}.pkl')
+    contenido = None
+    if os.path.exists(ruta_cache):
+        with open(ruta_cache, 'rb') as f:
+            contenido = pickle.load(f)
+        if (contenido.get('version') != VERSION_CACHE_CATALOGOS
+                or sorted(contenido['firmas']) != sorted(firmas)
+                or not all(_mismo_archivo(ruta, firma) for ruta, firma in contenido['firmas'].items())):
+            logging.debug(f'Cache de catálogos inválido: {ruta_cache}')
+            contenido = None
+
+    if contenido is None:
+        contenido = {'version': VERSION_CACHE_CATALOGOS,
+                     'firmas': {ruta: firma_archivo(ruta, con_hash=True) for ruta in firmas},
+                     'catalogos': lee_catalogos(catalogos, descriptores, nuevo_formato)}
+        os.makedirs(directorio_cache, exist_ok=True)
+        with open(ruta_cache + '.tmp', 'wb') as f:
+            pickle.dump(contenido, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta_cache + '.tmp', ruta_cache)
+
+    _CATALOGOS_MEMO[llave] = {'firmas': firmas, 'catalogos': contenido['catalogos']}
+    return contenido['catalogos']
+
+# Todas las claves únicas de municipio posibles (entidad + municipio), en orden
+CLAVES_MUNICIPIO_COMPUESTAS = [entidad + municipio for entidad in CLAVES_ENTIDAD for municipio in CLAVES_MUNICIPIO]
+
+def _tabla_categorias(mapa, tam):
+    """
+        Tabla de búsqueda para decodificar con índices: tabla[clave] es la posición del valor de la clave en la lista
+        ordenada de valores únicos (-1 si la clave no está en el catálogo).
+    """
+    categorias = sorted(set(mapa.values()))
+    posicion = {valor: i for i, valor in enumerate(categorias)}
+    tabla = np.full(tam, -1, dtype=np.int32)
+    for clave, valor in mapa.items():
+        if 0 <= clave < tam:
+            tabla[clave] = posicion[valor]
+    return tabla, categorias
+
+class ResolutorCatalogos:
+    """
+        Decodifica las columnas con claves de la base de la DGE (leída con `ESQUEMA_DGE`) usando los catálogos que
+        regresa `lee_catalogos`.
+
+        Las tablas de búsqueda se construyen una sola vez. Las claves de cada columna se usan como índices de un
+        arreglo y el resultado se arma como categórica a partir de esos códigos, en lugar de recorrer los renglones con
+        diccionarios o `replace`.
+    """
+
+    def __init__(self, catalogos):
+        self.nombres_entidad = catalogos['entidades']
+        self.campos_si_no = catalogos['campos_si_no']
+        # Las claves int8 se indexan como uint8 para que un valor negativo caiga fuera del catálogo
+        self.tablas = {col: _tabla_categorias(catalogos[catalogo], 256)
+                       for col, catalogo in [('RESULTADO', 'resultado'),
+                                             ('CLASIFICACION_FINAL', 'clasificacion_final'),
+                                             ('TIPO_PACIENTE', 'tipo_paciente'),
+                                             ('SI_NO', 'si_no')]}
+        # Para las binarias las claves que no están en el catálogo se conservan, como hacía replace
+        self.tabla_binaria = np.arange(256, dtype=np.uint8).view(np.int8)
+        for clave, valor in catalogos['si_no'].items():
+            self.tabla_binaria[clave] = 1 if valor == 'SI' else 0
+        # La clave compuesta de municipio es posición de entidad * 1000 + clave de municipio
+        posicion_municipio = {clave: i for i, clave in enumerate(CLAVES_MUNICIPIO_COMPUESTAS)}
+        municipios = {posicion_municipio[clave]: nombre for clave, nombre in catalogos['municipios'].items()
+                      if clave in posicion_municipio}
+        self.tabla_municipios = _tabla_categorias(municipios, len(CLAVES_MUNICIPIO_COMPUESTAS))
+
+    @staticmethod
+    def _decodifica(codigos, tabla, categorias):
+        codigos = tabla[codigos]
+        return pd.Categorical.from_codes(codigos, categorias).remove_unused_categories()
+
+    def decodifica(self, serie, columna):
+        """
+            Decodifica una columna int8 de claves con el catálogo de `columna` ('RESULTADO', 'CLASIFICACION_FINAL',
+            'TIPO_PACIENTE' o 'SI_NO').
+        """
+        tabla, categorias = self.tablas[columna]
+        return pd.Series(self._decodifica(serie.to_numpy().view(np.uint8), tabla, categorias), index=serie.index)
+
+    def resuelve(self, df, resolver_claves='si_no_binarias'):
+        """
+            Resuelve las claves de `df` con los mismos modos que `carga_datos_covid19_MX`: 'sustitucion', 'agregar',
+            'si_no_binarias', 'solo_localidades'.
+        """
+        # Asignar clave única a municipios
+        entidad = df['ENTIDAD_RES'].astype(ESQUEMA_DGE['ENTIDAD_RES']).cat.codes.to_numpy().astype(np.int32)
+        municipio = df['MUNICIPIO_RES'].astype(ESQUEMA_DGE['MUNICIPIO_RES']).cat.codes.to_numpy().astype(np.int32)
+        clave_municipio = np.where((entidad >= 0) & (municipio >= 0), entidad * len(CLAVES_MUNICIPIO) + municipio, -1)
+        tabla, categorias = self.tabla_municipios
+        codigos = np.where(clave_municipio >= 0, tabla[clave_municipio], -1)
+        df['MUNICIPIO_RES'] = pd.Categorical.from_codes(codigos, categorias).remove_unused_categories()
+        df['CLAVE_MUNICIPIO_RES'] = pd.Categorical.from_codes(
+            clave_municipio, CLAVES_MUNICIPIO_COMPUESTAS).remove_unused_categories()
+
+        # Resolver códigos de entidad federal, basta con renombrar las categorías
+        cols_entidad = [col for col in ['ENTIDAD_RES', 'ENTIDAD_UM', 'ENTIDAD_NAC'] if col in df.columns]
+        df['CLAVE_ENTIDAD_RES'] = df['ENTIDAD_RES']
+        for col in cols_entidad:
+            df[col] = df[col].cat.rename_categories(self.nombres_entidad)
+
+        # Resolver resultados y clasificación final
+        df.rename(columns={'RESULTADO_LAB': 'RESULTADO'}, inplace=True)
+        for col in ['RESULTADO', 'CLASIFICACION_FINAL']:
+            if col in df.columns:
+                df[col] = self.decodifica(df[col], col)
+
+        # Resolver datos SI - NO, sólo las columnas presentes
+        campos_si_no = [campo for campo in self.campos_si_no if campo in df.columns]
+        if resolver_claves == 'agregar':
+            nuevos_campos_si_no = [nombre_var + '_NOM' for nombre_var in campos_si_no]
+        elif resolver_claves == 'si_no_binarias':
+            nuevos_campos_si_no = [nombre_var + '_BIN' for nombre_var in campos_si_no]
+        else:
+            nuevos_campos_si_no = campos_si_no
+        tabla, categorias = self.tablas['SI_NO']
+        for campo, nuevo_campo in zip(campos_si_no, nuevos_campos_si_no):
+            claves = df[campo].to_numpy().view(np.uint8)
+            if resolver_claves == 'si_no_binarias':
+                df[nuevo_campo] = self.tabla_binaria[claves]
+            elif (tabla[claves] >= 0).all():
+                df[nuevo_campo] = self._decodifica(claves, tabla, categorias)
+            else:
+                # Hay claves fuera del catálogo, se conservan tal cual como hace replace
+                df[nuevo_campo] = df[campo].replace(self._mapa_si_no()).astype('category')
+
+        # Resolver tipos de paciente
+        if 'TIPO_PACIENTE' in df.columns:
+            df['TIPO_PACIENTE'] = self.decodifica(df['TIPO_PACIENTE'], 'TIPO_PACIENTE')
+        return df
+
+    def _mapa_si_no(self):
+        tabla, categorias = self.tablas['SI_NO']
+        return {clave: categorias[codigo] for clave, codigo in enumerate(tabla) if codigo >= 0}
+
+def rutas_diccionario(directorio_datos='/content/', fecha_formato='201128'):
+    """
+        Rutas del excel de catálogos y del de descriptores.
+    """
+    return (os.path.join(directorio_datos, f'{fecha_formato} Catalogos.xlsx'),
+            os.path.join(directorio_datos, f'{fecha_formato} Descriptores_.xlsx'))
+
+@mide('carga_datos')
+def carga_datos_covid19_MX(fecha='210505', resolver_claves='si_no_binarias', entidad='27',
+                           columnas=None, chunksize=None, memoria_max_mb=None,
+                           directorio_datos='/content/', cache=False, directorio_cache=None, limite_cache_mb=2048):
+    """
+        Lee en un DataFrame el CSV con el reporte de casos de la Secretaría de Salud de México publicado en una fecha dada. Esta función
+        también lee el diccionario de datos que acompaña a estas publicaciones para preparar algunos campos, en particular permite la funcionalidad
+        de generar columnas binarias para datos con valores 'SI', 'No'.
+
+        **Nota**: En esta versión el nombre de los archivos es fijo. Asumimos que todos se encuentran en `directorio_datos`
+        (por omisión '/content/').
+
+        **Nota 2**: Por las actualizaciones a los formatos de datos, esta función sólo va a servir para archivos posteriores a 20-11-28
+
+        resolver_claves: 'sustitucion', 'agregar', 'si_no_binarias', 'solo_localidades'. Resuelve los valores del conjunto de datos usando el
+        diccionario de datos y los catálogos. 'sustitucion' remplaza los valores en las columnas, 'agregar'
+        crea nuevas columnas. 'si_no_binarias' cambia valores SI, NO, No Aplica, SE IGNORA, NO ESPECIFICADO por 1, 0, 0, 0, 0 respectivamente.
+
+        entidad: clave o lista de claves de `ENTIDAD_RES`, None lee todo el país.
+
+        columnas: lista de columnas a conservar, además de las que se necesitan para el aplanado. None conserva todas.
+
+        chunksize, memoria_max_mb: activan la lectura por bloques. `chunksize` es el número de renglones por bloque;
+        si en su lugar se da `memoria_max_mb` el tamaño del bloque se calcula para que cada uno ocupe aproximadamente
+        esa memoria. En este modo el pico de memoria queda acotado por el tamaño del resultado filtrado más un bloque.
+
+        cache: guarda la base aplanada en `directorio_cache` (por omisión `directorio_datos`/cache) en formato parquet, una vez
+        por (fecha, entidad, resolver_claves). Las siguientes cargas leen de ahí sólo las columnas pedidas, mientras no cambien
+        el zip de datos ni los catálogos. Cuando el cache pasa de `limite_cache_mb` se borran las entradas usadas hace más tiempo.
+        Los catálogos ya leídos siempre se guardan en `directorio_cache` (ver `carga_catalogos`).
+
+    """
+    fecha_formato = '201128'
+    nuevo_formato = True
+    fecha_carga = pd.to_datetime(fecha, yearfirst=True)
+    if fecha_carga < datetime.strptime('20-11-28', "%y-%m-%d"):
+      raise ValueError('La fecha debe ser posterior a 20-11-28.')
+    
+    catalogos, descriptores = rutas_diccionario(directorio_datos, fecha_formato)
+    data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+    fuentes = [data_file, catalogos, descriptores]
+    if directorio_cache is None:
+        directorio_cache = os.path.join(directorio_datos, 'cache')
+    if cache:
+        with etapa('cache_lectura') as registro:
+            df = lee_cache_aplanados(directorio_cache, fecha, entidad, resolver_claves, fuentes, columnas)
+            registro['renglones'] = None if df is None else len(df)
+        if df is not None:
+            return df
+        # En el cache guardamos siempre todas las columnas y al final regresamos sólo las pedidas
+        columnas_pedidas, columnas = columnas, None
+    if chunksize is None and memoria_max_mb is not None:
+        num_columnas = len(columnas) + len(COLUMNAS_REQUERIDAS) if columnas is not None else NUM_COLUMNAS_DGE
+        chunksize = max(1, int(memoria_max_mb * 2**20 / (num_columnas * BYTES_POR_CELDA)))
+    with etapa('lectura_csv') as registro:
+        df = lee_datos_covid19_MX(data_file, entidad=entidad, columnas=columnas, chunksize=chunksize)
+        registro['renglones'] = len(df)
+    with etapa('catalogos'):
+        resolutor = ResolutorCatalogos(carga_catalogos(catalogos, descriptores, nuevo_formato, directorio_cache))
+    with etapa('aplanado', len(df)):
+        df = resolutor.resuelve(df, resolver_claves)
+
+    with etapa('fechas', len(df)):
+        df = procesa_fechas(df)
+
+    if cache:
+        with etapa('cache_escritura', len(df)):
+            guarda_cache_aplanados(df, directorio_cache, fecha, entidad, resolver_claves, fuentes)
+            limpia_cache_aplanados(directorio_cache, limite_cache_mb)
+        if columnas_pedidas is not None:
+            df = df[_columnas_cache(columnas_pedidas, df.columns)]
+
+    return df
+
+def partes_fecha(fechas):
+    """
+        Año, mes, día de la semana (lunes = 0), semana ISO, día del mes y día del año de una serie de fechas completas
+        (sin NaT), como enteros chicos. Se calculan con aritmética sobre los días desde 1970-01-01.
+    """
+    dias = fechas.to_numpy().astype('datetime64[D]')
+    # 1970-01-01 fue jueves
+    dia_semana = (dias.astype(np.int64) + 3) % 7
+    # La semana ISO es la del jueves de esa misma semana, contada desde el inicio del año de ese jueves
+    jueves = dias + (3 - dia_semana)
+    semana_iso = (jueves - jueves.astype('datetime64[Y]')).astype(np.int64) // 7 + 1
+    inicio_mes = dias.astype('datetime64[M]')
+    inicio_año = dias.astype('datetime64[Y]')
+    return {'AÑO': (inicio_año.astype(np.int64) + 1970).astype(np.int16),
+            'MES': (inicio_mes.astype(np.int64) % 12 + 1).astype(np.int8),
+            'DIA_SEMANA': dia_semana.astype(np.int8),
+            'SEMANA_AÑO': semana_iso.astype(np.int8),
+            'DIA_MES': ((dias - inicio_mes).astype(np.int64) + 1).astype(np.int8),
+            'DIA_AÑO': ((dias - inicio_año).astype(np.int64) + 1).astype(np.int16)}
+
+def procesa_fechas(covid_df, copiar=False):
+    """
+        Convierte las fechas, agrega la columna DEFUNCION y las partes de la fecha de ingreso (AÑO_INGRESO, MES_INGRESO,
+        DIA_SEMANA_INGRESO, SEMANA_AÑO_INGRESO con la semana ISO, DIA_MES_INGRESO y DIA_AÑO_INGRESO) e indexa por
+        FECHA_INGRESO.
+
+        Para no duplicar la base en memoria, `covid_df` se modifica directamente, salvo que se pida `copiar`.
+    """
+    df = covid_df.copy() if copiar else covid_df
+
+    # Si los datos se leyeron con ESQUEMA_DGE las fechas ya vienen convertidas y esto no hace nada
+    df = convierte_fechas(df)
+    df['DEFUNCION'] = (df['FECHA_DEF'].notna()).astype('int8')
+    df['EDAD'] = df['EDAD'].astype(ESQUEMA_DGE['EDAD'], copy=False)
+
+    for parte, valores in partes_fecha(df['FECHA_INGRESO']).items():
+        df[f'{parte}_INGRESO'] = valores
+    df.set_index('FECHA_INGRESO', drop=False, inplace=True)
+
+    return df
+
+# Columnas que se guardan en la bitácora de cambios, además del ID_REGISTRO y el tipo de cambio
+COLUMNAS_BITACORA = ['ENTIDAD_RES', 'MUNICIPIO_RES', 'FECHA_INGRESO', 'FECHA_SINTOMAS', 'FECHA_DEF',
+                     'CLASIFICACION_FINAL', 'TIPO_PACIENTE']
+
+TIPOS_CAMBIO = pd.CategoricalDtype(['alta', 'cambio', 'baja'])
+
+def hash_registros(df):
+    """
+        Hash (uint64) de cada renglón con todas las columnas salvo FECHA_ACTUALIZACION, que cambia en cada publicación.
+    """
+    columnas = [col for col in df.columns if col not in ('FECHA_ACTUALIZACION', 'HASH_REGISTRO')]
+    return pd.util.hash_pandas_object(df[columnas], index=False).to_numpy()
+
+class AlmacenRegistros:
+    """
+        Último estado conocido de cada registro de la DGE, guardado en `directorio`, que se actualiza publicación por
+        publicación aplicando sólo lo que cambió.
+
+        El estado se guarda sin aplanar (con los tipos de `ESQUEMA_DGE`) junto con el hash de cada renglón, y por cada
+        publicación ingerida se escribe en `directorio`/bitacora un parquet con las altas, cambios y bajas.
+    """
+
+    def __init__(self, directorio, entidad=None):
+        self.directorio = directorio
+        self.ruta_estado = os.path.join(directorio, 'estado.parquet')
+        self.ruta_meta = os.path.join(directorio, 'meta.json')
+        self.directorio_bitacora = os.path.join(directorio, 'bitacora')
+        if os.path.exists(self.ruta_meta):
+            with open(self.ruta_meta) as f:
+                self.meta = json.load(f)
+            if self.meta['entidad'] != entidad:
+                raise ValueError(f'El almacén en {directorio} es de la entidad {self.meta["entidad"]}, no de {entidad}')
+        else:
+            self.meta = {'entidad': entidad, 'publicaciones': []}
+        self._estado = None
+
+    @property
+    def estado(self):
+        if self._estado is None and os.path.exists(self.ruta_estado):
+            self._estado = pd.read_parquet(self.ruta_estado)
+        return self._estado
+
+    @property
+    def publicaciones(self):
+        return list(self.meta['publicaciones'])
+
+    def ingiere(self, fecha, directorio_datos='/content/', chunksize=None):
+        """
+            Aplica al almacén la publicación de `fecha` (formato '%y%m%d', como en `carga_datos_covid19_MX`) y regresa
+            cuántas altas, cambios y bajas tuvo.
+        """
+        if self.meta['publicaciones'] and fecha <= self.meta['publicaciones'][-1]:
+            raise ValueError(f'La publicación {fecha} no es posterior a la última ingerida '
+                             f'({self.meta["publicaciones"][-1]})')
+        data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+        nuevo = lee_datos_covid19_MX(data_file, entidad=self.meta['entidad'], chunksize=chunksize)
+        nuevo = nuevo.reset_index(drop=True)
+        nuevo['HASH_REGISTRO'] = hash_registros(nuevo)
+
+        estado = self.estado
+        if estado is None:
+            estado = nuevo.iloc[:0]
+        # Posición de cada registro nuevo en el estado anterior, -1 si no existía
+        posicion = pd.Index(estado['ID_REGISTRO']).get_indexer(nuevo['ID_REGISTRO'])
+        es_alta = posicion < 0
+        es_cambio = np.zeros(len(nuevo), dtype=bool)
+        es_cambio[~es_alta] = (estado['HASH_REGISTRO'].to_numpy()[posicion[~es_alta]]
+                               != nuevo['HASH_REGISTRO'].to_numpy()[~es_alta])
+        sigue = np.zeros(len(estado), dtype=bool)
+        sigue[posicion[~es_alta]] = True
+        es_baja = ~sigue
+        # Los registros que cambiaron se quitan del estado y se vuelven a agregar con sus valores nuevos
+        sin_cambio = sigue.copy()
+        sin_cambio[posicion[es_cambio]] = False
+        modificados = nuevo[es_alta | es_cambio]
+        self._estado = concatena_bloques([estado[sin_cambio], modificados]).reset_index(drop=True)
+
+        tipo = np.where(es_alta[es_alta | es_cambio], 'alta', 'cambio')
+        bitacora = concatena_bloques([
+            modificados[['ID_REGISTRO'] + COLUMNAS_BITACORA].assign(TIPO_CAMBIO=tipo),
+            estado.loc[es_baja, ['ID_REGISTRO'] + COLUMNAS_BITACORA].assign(TIPO_CAMBIO='baja')])
+        bitacora['TIPO_CAMBIO'] = bitacora['TIPO_CAMBIO'].astype(TIPOS_CAMBIO)
+        self._guarda(fecha, bitacora)
+        return {'altas': int(es_alta.sum()), 'cambios': int(es_cambio.sum()), 'bajas': int(es_baja.sum())}
+
+    def _guarda(self, fecha, bitacora):
+        os.makedirs(self.directorio_bitacora, exist_ok=True)
+        ruta_bitacora = os.path.join(self.directorio_bitacora, f'{fecha}.parquet')
+        bitacora.to_parquet(ruta_bitacora + '.tmp', index=False)
+        os.replace(ruta_bitacora + '.tmp', ruta_bitacora)
+        self._estado.to_parquet(self.ruta_estado + '.tmp', index=False)
+        os.replace(self.ruta_estado + '.tmp', self.ruta_estado)
+        # La lista de publicaciones se escribe al final: si algo falla antes, la fecha no cuenta como ingerida
+        self.meta['publicaciones'].append(fecha)
+        with open(self.ruta_meta + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.ruta_meta + '.tmp', self.ruta_meta)
+
+    def bitacora(self, desde=None, hasta=None):
+        """
+            Cambios de las publicaciones ingeridas entre `desde` y `hasta` (inclusive, formato '%y%m%d'), con la fecha de
+            publicación en la columna FECHA_PUBLICACION.
+        """
+        partes = []
+        for fecha in self.meta['publicaciones']:
+            if (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta):
+                parte = pd.read_parquet(os.path.join(self.directorio_bitacora, f'{fecha}.parquet'))
+                parte['FECHA_PUBLICACION'] = pd.to_datetime(fecha, format='%y%m%d')
+                partes.append(parte)
+        if not partes:
+            return pd.DataFrame(columns=['ID_REGISTRO'] + COLUMNAS_BITACORA + ['TIPO_CAMBIO', 'FECHA_PUBLICACION'])
+        return concatena_bloques(partes)
+
+    def aplanados(self, resolver_claves='si_no_binarias', directorio_datos='/content/'):
+        """
+            El estado actual aplanado igual que con `carga_datos_covid19_MX`.
+        """
+        catalogos, descriptores = rutas_diccionario(directorio_datos)
+        resolutor = ResolutorCatalogos(carga_catalogos(catalogos, descriptores))
+        df = self.estado.drop(columns='HASH_REGISTRO')
+        return procesa_fechas(resolutor.resuelve(df, resolver_claves))
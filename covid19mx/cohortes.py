@@ -0,0 +1,176 @@
+"""
+    Índice compacto de la base aplanada para consultas de cohortes ("confirmados, hospitalizados, diabéticos y obesos
+    de más de 60 años") sin recorrer la base: las banderas SI_NO de cada registro empacadas en un entero, y la
+    clasificación, el tipo de paciente, la edad, el municipio y las fechas como arreglos chicos.
+"""
+import numpy as np
+import pandas as pd
+
+from .agregados import _normaliza_espacios
+
+# Días desde 1970-01-01 que representan una fecha vacía (NaT) en el índice
+SIN_FECHA = np.iinfo(np.int32).min
+
+COLUMNAS_FECHA_INDICE = ['FECHA_INGRESO', 'FECHA_SINTOMAS', 'FECHA_DEF']
+
+def _codigos(serie):
+    # Códigos compactos y categorías de una columna categórica (o que se puede convertir)
+    categorica = serie.astype('category')
+    codigos = categorica.cat.codes.to_numpy()
+    tipo = np.int8 if len(categorica.cat.categories) < 2**7 else np.int16
+    return codigos.astype(tipo), pd.Index(categorica.cat.categories)
+
+def _dias(serie):
+    fechas = serie.to_numpy().astype('datetime64[D]')
+    return np.where(np.isnat(fechas), SIN_FECHA, fechas.astype(np.int64)).astype(np.int32)
+
+class IndiceBanderas:
+    """
+        Banderas SI_NO (las columnas _BIN de `resolver_claves='si_no_binarias'`) y DEFUNCION de cada registro en un
+        solo uint32, un bit por bandera, junto con la clasificación final, el tipo de paciente y el municipio como
+        códigos, la edad y las fechas como días desde 1970-01-01. Son unos 22 bytes por registro.
+
+        Las consultas combinan las banderas con operaciones de bits sobre todo el arreglo y regresan máscaras, conteos
+        o conteos por día o por municipio. Los registros están en el orden de la base con que se construyó, así que
+        `posiciones` sirve para `df.iloc`.
+    """
+
+    def __init__(self, banderas, nombres, columnas, categorias):
+        self.banderas = banderas
+        self.nombres = list(nombres)
+        self.bits = {nombre: np.uint32(1 << i) for i, nombre in enumerate(self.nombres)}
+        self.columnas = columnas
+        self.categorias = categorias
+
+    @classmethod
+    def construye(cls, df):
+        """
+            Índice de una base aplanada con `resolver_claves='si_no_binarias'`. Las banderas se nombran sin el sufijo
+            _BIN ('DIABETES', 'OBESIDAD', ...), más DEFUNCION.
+        """
+        nombres = [columna[:-len('_BIN')] for columna in df.columns if columna.endswith('_BIN')]
+        if not nombres:
+            raise ValueError("La base no tiene columnas _BIN; cárgala con resolver_claves='si_no_binarias'")
+        nombres.append('DEFUNCION')
+        if len(nombres) > 32:
+            raise ValueError(f'{len(nombres)} banderas no caben en 32 bits')
+        banderas = np.zeros(len(df), dtype=np.uint32)
+        for i, nombre in enumerate(nombres):
+            columna = 'DEFUNCION' if nombre == 'DEFUNCION' else nombre + '_BIN'
+            banderas |= (df[columna].to_numpy() == 1).astype(np.uint32) << np.uint32(i)
+        columnas, categorias = {}, {}
+        for columna in ['CLASIFICACION_FINAL', 'TIPO_PACIENTE', 'CLAVE_MUNICIPIO_RES']:
+            columnas[columna], categorias[columna] = _codigos(df[columna])
+        columnas['EDAD'] = df['EDAD'].to_numpy().astype(np.int16)
+        for columna in COLUMNAS_FECHA_INDICE:
+            columnas[columna] = _dias(df[columna])
+        return cls(banderas, nombres, columnas, categorias)
+
+    def __len__(self):
+        return len(self.banderas)
+
+    @property
+    def nbytes(self):
+        return self.banderas.nbytes + sum(arreglo.nbytes for arreglo in self.columnas.values())
+
+    def _bits(self, nombres):
+        mascara = np.uint32(0)
+        for nombre in nombres:
+            nombre = nombre[:-len('_BIN')] if nombre.endswith('_BIN') else nombre
+            if nombre not in self.bits:
+                raise ValueError(f'No hay bandera {nombre!r}, las banderas son {self.nombres}')
+            mascara |= self.bits[nombre]
+        return mascara
+
+    def _en(self, columna, valores):
+        # Máscara de los registros cuyo valor de `columna` está en `valores`, comparando sólo códigos
+        valores = {_normaliza_espacios(valor) for valor in valores}
+        aceptados = [i for i, categoria in enumerate(self.categorias[columna])
+                     if _normaliza_espacios(categoria) in valores]
+        codigos = self.columnas[columna]
+        if len(aceptados) <= 4:
+            # Con pocos códigos unas cuantas comparaciones son más rápidas que indexar una tabla
+            mascara = np.zeros(len(codigos), dtype=bool)
+            for codigo in aceptados:
+                mascara |= codigos == codigo
+            return mascara
+        # Una tabla por código (más el -1 de los vacíos, que queda al final) evita np.isin sobre todo el arreglo
+        tabla = np.zeros(len(self.categorias[columna]) + 1, dtype=bool)
+        tabla[aceptados] = True
+        return tabla[codigos]
+
+    def mascara(self, con=(), sin=(), alguna=(), clasificacion=None, tipo_paciente=None, edad_min=None,
+                edad_max=None, municipios=None, desde=None, hasta=None, columna_fecha='FECHA_INGRESO'):
+        """
+            Arreglo booleano de los registros de la cohorte.
+
+            con: banderas que deben estar todas en 1 (p. ej. ['DIABETES', 'OBESIDAD', 'DEFUNCION']).
+            sin: banderas que deben estar todas en 0.
+            alguna: banderas de las que al menos una debe estar en 1.
+            clasificacion, tipo_paciente, municipios: listas de valores aceptados (CLASIFICACION_FINAL, TIPO_PACIENTE y
+            CLAVE_MUNICIPIO_RES).
+            edad_min, edad_max: edad en años, inclusive.
+            desde, hasta: fechas de `columna_fecha`, inclusive; los registros sin esa fecha quedan fuera.
+        """
+        mascara = np.ones(len(self), dtype=bool)
+        requeridas, prohibidas, opcionales = self._bits(con), self._bits(sin), self._bits(alguna)
+        if requeridas or prohibidas:
+            # Una sola comparación: los bits de `con` en 1 y los de `sin` en 0
+            mascara &= (self.banderas & (requeridas | prohibidas)) == requeridas
+        if opcionales:
+            mascara &= (self.banderas & opcionales) != 0
+        if clasificacion is not None:
+            mascara &= self._en('CLASIFICACION_FINAL', clasificacion)
+        if tipo_paciente is not None:
+            mascara &= self._en('TIPO_PACIENTE', tipo_paciente)
+        if municipios is not None:
+            mascara &= self._en('CLAVE_MUNICIPIO_RES', municipios)
+        if edad_min is not None:
+            mascara &= self.columnas['EDAD'] >= edad_min
+        if edad_max is not None:
+            mascara &= self.columnas['EDAD'] <= edad_max
+        if desde is not None or hasta is not None:
+            dias = self.columnas[columna_fecha]
+            mascara &= dias != SIN_FECHA
+            if desde is not None:
+                mascara &= dias >= pd.Timestamp(desde).to_datetime64().astype('datetime64[D]').astype(np.int64)
+            if hasta is not None:
+                mascara &= dias <= pd.Timestamp(hasta).to_datetime64().astype('datetime64[D]').astype(np.int64)
+        return mascara
+
+    def cuenta(self, **filtros):
+        """
+            Número de registros de la cohorte (`filtros` como en `mascara`).
+        """
+        return int(np.count_nonzero(self.mascara(**filtros)))
+
+    def posiciones(self, **filtros):
+        """
+            Posiciones de los registros de la cohorte en la base original, para `df.iloc`.
+        """
+        return np.flatnonzero(self.mascara(**filtros))
+
+    def por_dia(self, columna_fecha='FECHA_INGRESO', **filtros):
+        """
+            Registros de la cohorte por día de `columna_fecha`, con todos los días entre el primero y el último (los
+            días sin registros en 0).
+        """
+        dias = self.columnas[columna_fecha]
+        dias = dias[self.mascara(**filtros) & (dias != SIN_FECHA)].astype(np.int64)
+        if len(dias) == 0:
+            return pd.Series([], index=pd.DatetimeIndex([], name=columna_fecha), dtype=np.int64, name='Registros')
+        inicio = dias.min()
+        conteo = np.bincount(dias - inicio)
+        fechas = pd.date_range(pd.Timestamp(inicio, unit='D'), periods=len(conteo), name=columna_fecha)
+        return pd.Series(conteo, index=fechas, name='Registros')
+
+    def por_municipio(self, **filtros):
+        """
+            Registros de la cohorte por CLAVE_MUNICIPIO_RES (todos los municipios de la base, con 0 los que no tienen
+            registros de la cohorte).
+        """
+        codigos = self.columnas['CLAVE_MUNICIPIO_RES']
+        categorias = self.categorias['CLAVE_MUNICIPIO_RES']
+        codigos = codigos[self.mascara(**filtros) & (codigos >= 0)].astype(np.int64)
+        conteo = np.bincount(codigos, minlength=len(categorias))
+        return pd.Series(conteo, index=pd.Index(categorias, name='CLAVE_MUNICIPIO_RES'), name='Registros')
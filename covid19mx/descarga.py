@@ -0,0 +1,140 @@
+"""
+    Descarga de los datos abiertos de COVID-19 que publica la Dirección General de Epidemiología (DGE) y de su
+    diccionario de datos.
+"""
+import os
+import zipfile
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+import requests
+
+from .instrumentacion import mide
+
+URL_SALUD_HISTORICOS = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/historicos/'
+
+URL_DICCIONARIO = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/diccionario_datos_covid19.zip'
+
+TAM_BLOQUE_DESCARGA = 2**20
+
+def zip_valido(ruta, completo=False):
+    """
+        Revisa que `ruta` sea un zip que se puede abrir. Con `completo` además verifica el CRC de cada archivo,
+        lo que implica leerlo completo.
+    """
+    try:
+        with zipfile.ZipFile(ruta) as zip_ref:
+            return zip_ref.testzip() is None if completo else True
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+def _descarga_parcial(url, parcial, tam_bloque, timeout):
+    inicio = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+    encabezados = {'Range': f'bytes={inicio}-'} if inicio else {}
+    with requests.get(url, headers=encabezados, stream=True, allow_redirects=True, timeout=timeout) as r:
+        # 416 quiere decir que el .part ya tenía todo el archivo
+        if r.status_code == 416:
+            return
+        r.raise_for_status()
+        # Si el servidor no respeta Range (regresa 200) empezamos de cero
+        modo = 'ab' if r.status_code == 206 else 'wb'
+        with open(parcial, modo) as f:
+            for bloque in r.iter_content(tam_bloque):
+                f.write(bloque)
+
+def descarga_archivo(url, ruta, tam_bloque=TAM_BLOQUE_DESCARGA, timeout=60, intentos=3, es_zip=True):
+    """
+        Descarga `url` en `ruta` escribiendo por bloques, sin tener el archivo completo en memoria.
+
+        La descarga se escribe en `ruta`.part y sólo se renombra a `ruta` cuando terminó y (si `es_zip`) es un zip
+        íntegro. Si la conexión se corta, o si ya existe un .part de una descarga anterior, se pide al servidor sólo lo
+        que falta (encabezado Range), hasta `intentos` veces.
+    """
+    parcial = ruta + '.part'
+    for intento in range(1, intentos + 1):
+        try:
+            _descarga_parcial(url, parcial, tam_bloque, timeout)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as error:
+            if intento == intentos:
+                raise
+            logging.debug(f'Se interrumpió la descarga de {url} ({error}), reintentando')
+    if es_zip and not zip_valido(parcial, completo=True):
+        os.remove(parcial)
+        raise IOError(f'{url} no es un zip válido, se borró la descarga')
+    os.replace(parcial, ruta)
+    return ruta
+
+def _extraido(directorio, info):
+    # Un archivo del zip ya descomprimido en `directorio`, completo
+    ruta = os.path.join(directorio, info.filename)
+    return os.path.isfile(ruta) and os.path.getsize(ruta) == info.file_size
+
+def bajar_diccionario(directorio_datos='/content/', url_diccionario=URL_DICCIONARIO):
+    """
+        Descarga el diccionario de datos (catálogos y descriptores) si no se ha bajado antes y descomprime los archivos
+        que falten o estén incompletos en `directorio_datos`.
+    """
+    diccionario_ruta = os.path.join(directorio_datos, 'diccionario.zip')
+    if zip_valido(diccionario_ruta):
+        logging.debug('Ya existe diccionario.zip')
+    else:
+        descarga_archivo(url_diccionario, diccionario_ruta)
+    with zipfile.ZipFile(diccionario_ruta, 'r') as zip_ref:
+        # Que el zip esté completo no quiere decir que se haya descomprimido: la descompresión pudo interrumpirse
+        faltantes = [info for info in zip_ref.infolist() if not info.is_dir() and not _extraido(directorio_datos, info)]
+        if faltantes:
+            zip_ref.extractall(directorio_datos, members=faltantes)
+    return diccionario_ruta
+
+def bajar_datos_fecha(fecha, directorio_datos='/content/', url_historicos=URL_SALUD_HISTORICOS):
+    """
+        Descarga el archivo de datos publicado en `fecha` (datetime) si no existe ya un zip válido.
+    """
+    archivo_nombre = f'{fecha.strftime("%y%m%d")}COVID19MEXICO.csv.zip'
+    archivo_ruta = os.path.join(directorio_datos, archivo_nombre)
+    # Abrir el zip sólo lee el directorio del final, así que un archivo truncado no pasa
+    if zip_valido(archivo_ruta):
+        logging.debug(f'Ya existe {archivo_nombre}')
+        return archivo_ruta
+    print(f'Bajando datos {fecha.strftime("%d.%m.%Y")}')
+    url_dia = "{}/{}/datos_abiertos_covid19_{}.zip".format(fecha.strftime('%Y'),
+                                                            fecha.strftime('%m'),
+                                                            fecha.strftime('%d.%m.%Y'))
+    return descarga_archivo(url_historicos + url_dia, archivo_ruta)
+
+@mide('descarga')
+def bajar_datos_salud(directorio_datos='/content/', fecha='05-05-2021'):
+    '''
+        Descarga el archivo de datos y los diccionarios para la fecha solicitada.
+    '''
+    fecha = datetime.strptime(fecha, "%d-%m-%Y")
+    bajar_datos_fecha(fecha, directorio_datos)
+    bajar_diccionario(directorio_datos)
+
+@mide('descarga_historicos')
+def bajar_historicos(fecha_inicio, fecha_fin, directorio_datos='/content/', max_trabajadores=4,
+                     url_historicos=URL_SALUD_HISTORICOS, url_diccionario=URL_DICCIONARIO):
+    """
+        Descarga en paralelo los archivos de datos publicados entre `fecha_inicio` y `fecha_fin` (inclusive, formato
+        '%d-%m-%Y') con a lo más `max_trabajadores` descargas simultáneas. El diccionario se baja una sola vez.
+
+        Las fechas que ya están descargadas se saltan y las descargas interrumpidas se continúan. Regresa un
+        diccionario fecha -> ruta del archivo, o la excepción si la descarga de esa fecha falló.
+    """
+    bajar_diccionario(directorio_datos, url_diccionario)
+    fechas = pd.date_range(datetime.strptime(fecha_inicio, "%d-%m-%Y"), datetime.strptime(fecha_fin, "%d-%m-%Y"))
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max_trabajadores) as ejecutor:
+        futuros = {ejecutor.submit(bajar_datos_fecha, fecha, directorio_datos, url_historicos): fecha
+                   for fecha in fechas}
+        for futuro in as_completed(futuros):
+            fecha = futuros[futuro].strftime('%d-%m-%Y')
+            try:
+                resultados[fecha] = futuro.result()
+            except Exception as error:
+                logging.warning(f'No se pudo bajar {fecha}: {error}')
+                resultados[fecha] = error
+    return dict(sorted(resultados.items(), key=lambda item: datetime.strptime(item[0], "%d-%m-%Y")))
@@ -0,0 +1,116 @@
+"""
+    Procesamiento de todas las entidades a partir de una sola lectura de la base nacional, en paralelo.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from .carga import carga_datos_covid19_MX
+from .agregados import VALORES_CONFIRMADOS, curvas_epidemicas, CuboMunicipal
+from .instrumentacion import mide
+
+@mide('entidad')
+def procesa_entidad(entidad, df, municipios_entidad, directorio_salida):
+    """
+        Curvas epidémicas (estatales y por municipio) y mapa de casos confirmados acumulados y tasa por 100,000
+        habitantes de una entidad, a partir de sus registros aplanados `df`. Guarda curvas.parquet,
+        curvas_municipio.parquet y mapa.html en `directorio_salida`/`entidad` y regresa los tiempos de cada paso.
+    """
+    inicio = time.perf_counter()
+    tiempos = {'entidad': entidad, 'registros': len(df), 'proceso': os.getpid()}
+    directorio = os.path.join(directorio_salida, entidad)
+    os.makedirs(directorio, exist_ok=True)
+
+    t = time.perf_counter()
+    curvas_epidemicas(df).to_parquet(os.path.join(directorio, 'curvas.parquet'), index=False)
+    curvas_epidemicas(df, nivel='CLAVE_MUNICIPIO_RES').to_parquet(os.path.join(directorio, 'curvas_municipio.parquet'),
+                                                                  index=False)
+    tiempos['curvas'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    # folium y geopandas se cargan hasta aquí, así que su importación cuenta en el tiempo de los mapas
+    from .mapas import mapa_capas
+    cubo = CuboMunicipal.construye(df)
+    poblacion = municipios_entidad.set_index('municipio_cvegeo')['pob2020']
+    capas = {'Casos Acumulados': cubo.acumulados(clasificacion=VALORES_CONFIRMADOS),
+             'Tasa x 100,000 habitantes': cubo.tasa(poblacion, clasificacion=VALORES_CONFIRMADOS)}
+    # Los municipios sin registros quedan en 0
+    municipios_entidad = municipios_entidad.assign(**{
+        nombre: valores.reindex(municipios_entidad['municipio_cvegeo']).fillna(0).to_numpy()
+        for nombre, valores in capas.items()})
+    mapa_capas(municipios_entidad, list(capas)).save(os.path.join(directorio, 'mapa.html'))
+    tiempos['mapas'] = time.perf_counter() - t
+
+    tiempos['total'] = time.perf_counter() - inicio
+    return tiempos
+
+def _tareas(df, posiciones, entidades, geometrias, directorio_salida):
+    # Generador: cada entidad se copia de la base nacional hasta que se va a procesar, así no están todas a la vez
+    categoricas = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    for entidad in entidades:
+        if entidad not in posiciones:
+            continue
+        parte = df.iloc[posiciones[entidad]]
+        # Las categorías de todo el país (p. ej. los 2,000 y tantos municipios) harían crecer las curvas y el cubo
+        parte = parte.assign(**{col: parte[col].cat.remove_unused_categories() for col in categoricas})
+        yield entidad, parte, geometrias.entidad(entidad), directorio_salida
+
+def _registro(entidad, registros, calcula):
+    # Los tiempos de la entidad, o su error: una entidad que falla no detiene a las demás
+    try:
+        tiempos = calcula()
+    except Exception as error:
+        logging.warning(f'No se pudo procesar la entidad {entidad}: {error}')
+        return {'entidad': entidad, 'registros': registros, 'error': f'{type(error).__name__}: {error}'}
+    logging.debug(f'Entidad {entidad}: {tiempos["total"]:.1f} s')
+    return {**tiempos, 'error': None}
+
+def procesa_entidades(fecha, geometrias, directorio_salida, entidades=None, max_procesos=None,
+                      directorio_datos='/content/', cache=True, chunksize=500_000):
+    """
+        Ejecuta `procesa_entidad` para cada entidad (por omisión todas las del `AlmacenGeometrias` `geometrias`) leyendo
+        una sola vez los datos nacionales de la publicación `fecha`. Las entidades se reparten en un pool de `max_procesos`
+        procesos (por omisión uno por núcleo); con max_procesos=1 todo corre en el proceso actual.
+
+        Regresa un DataFrame con los tiempos por entidad (en segundos) y la columna error, con el error de las
+        entidades que fallaron (sin tiempos) o None; el tiempo de la lectura nacional queda en `attrs['carga']` y el
+        total en `attrs['total']`.
+    """
+    inicio = time.perf_counter()
+    if entidades is None:
+        entidades = geometrias.entidades
+    df = carga_datos_covid19_MX(fecha, entidad=None, directorio_datos=directorio_datos, cache=cache,
+                                chunksize=chunksize, columnas=['CLASIFICACION_FINAL', 'TIPO_PACIENTE'])
+    carga = time.perf_counter() - inicio
+    logging.debug(f'{len(df)} registros nacionales leídos en {carga:.1f} s')
+
+    posiciones = df.groupby(df['CLAVE_ENTIDAD_RES'].astype(str)).indices
+    tareas = _tareas(df, posiciones, entidades, geometrias, directorio_salida)
+    del df
+
+    resultados = []
+    if max_procesos == 1:
+        for tarea in tareas:
+            resultados.append(_registro(tarea[0], len(tarea[1]), lambda: procesa_entidad(*tarea)))
+    else:
+        with ProcessPoolExecutor(max_workers=max_procesos) as pool:
+            # Sólo se mandan al pool una tarea más que procesos; las demás entidades se copian de la base nacional
+            # conforme van terminando las anteriores
+            en_vuelo = (max_procesos or os.cpu_count() or 1) + 1
+            pendientes = {}
+            for tarea in tareas:
+                if len(pendientes) >= en_vuelo:
+                    listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    for futuro in listos:
+                        resultados.append(_registro(*pendientes.pop(futuro), futuro.result))
+                pendientes[pool.submit(procesa_entidad, *tarea)] = (tarea[0], len(tarea[1]))
+            for futuro in as_completed(pendientes):
+                resultados.append(_registro(*pendientes[futuro], futuro.result))
+
+    tiempos = pd.DataFrame(resultados).sort_values('entidad').reset_index(drop=True)
+    tiempos.attrs['carga'] = carga
+    tiempos.attrs['total'] = time.perf_counter() - inicio
+    return tiempos
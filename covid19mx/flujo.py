@@ -0,0 +1,369 @@
+"""
+    El flujo del notebook (descarga → lectura y aplanado → curvas y gráficas, geometrías → cubo → mapas) como etapas
+    con nombre que declaran sus entradas, parámetros, archivos de entrada y archivos de salida.
+
+    Cada etapa tiene una huella: el sha256 de su función y versión, sus parámetros, el contenido de sus archivos de
+    entrada y el contenido de los resultados de las etapas de las que depende. Los resultados se guardan en un cache
+    direccionado por contenido (`directorio_cache`/objetos/<sha256 del resultado>.pkl) y cada huella apunta a su
+    resultado, así que al volver a correr el flujo sólo se ejecutan las etapas cuya huella cambió. Si una etapa se vuelve
+    a ejecutar y da el mismo resultado, las que dependen de ella no se ejecutan.
+
+    Las etapas que no dependen entre sí (p. ej. las gráficas de curvas y los mapas) corren al mismo tiempo en hilos:
+
+        flujo = flujo_notebook('210505', entidad='27', directorio_salida='/content/salida/')
+        flujo.corre()                                   # todo
+        flujo = flujo_notebook('210505', entidad='27', directorio_salida='/content/salida/', bins=8)
+        flujo.corre()                                   # sólo el mapa
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+from .carga import firma_archivo, hash_archivo
+from .instrumentacion import MEDIDOR
+
+# Cambiar este número cuando cambie la forma de calcular las huellas o de guardar los resultados
+VERSION_FLUJO = 1
+
+def _sha256(*partes):
+    # Los parámetros tienen que poder escribirse en JSON; lo que no, se describe con repr
+    texto = json.dumps(partes, sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+class EtapaFlujo:
+    """
+        Una etapa del flujo: `funcion(**entradas, **parametros)`.
+
+        entradas: nombres de las etapas cuyos resultados recibe la función, como lista (el argumento se llama como la
+        etapa) o diccionario argumento -> etapa.
+        parametros: argumentos fijos de la función, parte de la huella.
+        archivos: rutas de archivos que lee la función; su contenido es parte de la huella.
+        salidas: rutas de archivos que escribe la función; si falta alguno, la etapa se vuelve a ejecutar.
+        guarda: con False el resultado no se guarda en el cache y la etapa se ejecuta en cada corrida en que se
+        necesita (para resultados que no se pueden o no vale la pena guardar).
+        version: cambiarla cuando cambie lo que hace la función.
+    """
+
+    def __init__(self, nombre, funcion, entradas=(), parametros=None, archivos=(), salidas=(), guarda=True,
+                 version=1):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.entradas = dict(entradas) if isinstance(entradas, dict) else {entrada: entrada for entrada in entradas}
+        self.parametros = {} if parametros is None else parametros
+        self.archivos = list(archivos)
+        self.salidas = list(salidas)
+        self.guarda = guarda
+        self.version = version
+
+class Flujo:
+    """
+        Etapas con sus dependencias y el cache de sus resultados en `directorio_cache`. `corre` ejecuta las etapas
+        necesarias en `max_trabajadores` hilos (por omisión los de ThreadPoolExecutor) y `resultado` regresa el
+        resultado de una etapa de la última corrida, leyéndolo del cache si no se ejecutó.
+    """
+
+    def __init__(self, etapas, directorio_cache, max_trabajadores=None):
+        self.etapas = {}
+        for etapa in etapas:
+            if etapa.nombre in self.etapas:
+                raise ValueError(f'Hay dos etapas {etapa.nombre!r}')
+            self.etapas[etapa.nombre] = etapa
+        for etapa in self.etapas.values():
+            faltantes = set(etapa.entradas.values()) - set(self.etapas)
+            if faltantes:
+                raise ValueError(f'La etapa {etapa.nombre!r} depende de etapas que no existen: {sorted(faltantes)}')
+        self.directorio = directorio_cache
+        self.max_trabajadores = max_trabajadores
+        # Hash del resultado de cada etapa en la última corrida y los resultados que ya están en memoria
+        self.hashes = {}
+        self.huellas = {}
+        self._valores = {}
+        self.tabla = None
+
+    def _ruta(self, *partes):
+        return os.path.join(self.directorio, *partes)
+
+    def orden(self, objetivos=None):
+        """
+            Las etapas que hacen falta para `objetivos` (por omisión todas), cada una después de sus entradas.
+        """
+        objetivos = list(self.etapas) if objetivos is None else list(objetivos)
+        orden, visitando, visitadas = [], set(), set()
+
+        def visita(nombre):
+            if nombre in visitadas:
+                return
+            if nombre not in self.etapas:
+                raise KeyError(f'No hay etapa {nombre!r}')
+            if nombre in visitando:
+                raise ValueError(f'Hay un ciclo de dependencias en {nombre!r}')
+            visitando.add(nombre)
+            for entrada in self.etapas[nombre].entradas.values():
+                visita(entrada)
+            visitando.discard(nombre)
+            visitadas.add(nombre)
+            orden.append(nombre)
+
+        for nombre in objetivos:
+            visita(nombre)
+        return orden
+
+    def _hash_archivo(self, ruta, hashes_archivos):
+        # El sha256 de un archivo grande (el zip de datos) sólo se recalcula si cambió su tamaño o su fecha
+        ruta = os.path.abspath(ruta)
+        firma = firma_archivo(ruta)
+        anterior = hashes_archivos.get(ruta)
+        if anterior is None or anterior['tam'] != firma['tam'] or anterior['mtime'] != firma['mtime']:
+            hashes_archivos[ruta] = anterior = {**firma, 'sha256': hash_archivo(ruta)}
+        return anterior['sha256']
+
+    def huella(self, etapa, hashes_archivos):
+        """
+            sha256 de todo lo que determina el resultado de la `etapa`; sus entradas ya deben tener hash en esta
+            corrida.
+        """
+        funcion = f'{getattr(etapa.funcion, "__module__", "")}.{getattr(etapa.funcion, "__qualname__", etapa.funcion)}'
+        archivos = {ruta: self._hash_archivo(ruta, hashes_archivos) for ruta in etapa.archivos}
+        entradas = {argumento: self.hashes[entrada] for argumento, entrada in etapa.entradas.items()}
+        return _sha256(VERSION_FLUJO, etapa.nombre, funcion, etapa.version, etapa.parametros, archivos, entradas)
+
+    def _lee_registro(self, etapa, huella):
+        ruta = self._ruta('etapas', f'{huella}.json')
+        if not etapa.guarda or not os.path.exists(ruta):
+            return None
+        with open(ruta) as f:
+            registro = json.load(f)
+        if not os.path.exists(self._ruta('objetos', f'{registro["resultado"]}.pkl')):
+            return None
+        if not all(os.path.exists(salida) for salida in etapa.salidas):
+            return None
+        return registro
+
+    def _escribe(self, ruta, datos):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta + '.tmp', 'wb') as f:
+            f.write(datos)
+        os.replace(ruta + '.tmp', ruta)
+
+    def _valor(self, nombre):
+        hash_resultado = self.hashes[nombre]
+        if hash_resultado not in self._valores:
+            with open(self._ruta('objetos', f'{hash_resultado}.pkl'), 'rb') as f:
+                self._valores[hash_resultado] = pickle.load(f)
+        return self._valores[hash_resultado]
+
+    def _ejecuta(self, etapa, huella):
+        # Corre en un hilo del pool; las entradas ya están calculadas
+        argumentos = {argumento: self._valor(entrada) for argumento, entrada in etapa.entradas.items()}
+        inicio = time.perf_counter()
+        with MEDIDOR.etapa(etapa.nombre):
+            resultado = etapa.funcion(**argumentos, **etapa.parametros)
+        tiempo = time.perf_counter() - inicio
+        if not etapa.guarda:
+            return resultado, huella, tiempo
+        datos = pickle.dumps(resultado, protocol=pickle.HIGHEST_PROTOCOL)
+        hash_resultado = hashlib.sha256(datos).hexdigest()
+        ruta = self._ruta('objetos', f'{hash_resultado}.pkl')
+        if not os.path.exists(ruta):
+            self._escribe(ruta, datos)
+        registro = {'etapa': etapa.nombre, 'resultado': hash_resultado, 'tiempo': tiempo,
+                    'fecha': datetime.now().isoformat(timespec='seconds')}
+        self._escribe(self._ruta('etapas', f'{huella}.json'), json.dumps(registro).encode('utf-8'))
+        return resultado, hash_resultado, tiempo
+
+    def corre(self, objetivos=None, forzar=()):
+        """
+            Ejecuta las etapas de `objetivos` (por omisión todas) y sus dependencias cuyo resultado no esté en el cache
+            (y las de `forzar` aunque lo esté). Regresa un DataFrame con el estado ('cache' o 'ejecutada') y el tiempo
+            de cada etapa; el tiempo de la corrida completa queda en `attrs['total']`.
+        """
+        inicio = time.perf_counter()
+        ruta_archivos = self._ruta('archivos.json')
+        hashes_archivos = {}
+        if os.path.exists(ruta_archivos):
+            with open(ruta_archivos) as f:
+                hashes_archivos = json.load(f)
+        self.hashes, self.huellas = {}, {}
+        pendientes = self.orden(objetivos)
+        filas = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_trabajadores) as ejecutor:
+                corriendo = {}
+                while pendientes or corriendo:
+                    # Se decide cada etapa en cuanto sus entradas tienen hash; las que están en el cache pueden
+                    # destrabar a otras en la misma vuelta
+                    decidida = True
+                    while decidida:
+                        decidida = False
+                        for nombre in list(pendientes):
+                            etapa = self.etapas[nombre]
+                            if any(entrada not in self.hashes for entrada in etapa.entradas.values()):
+                                continue
+                            pendientes.remove(nombre)
+                            decidida = True
+                            huella = self.huella(etapa, hashes_archivos)
+                            self.huellas[nombre] = huella
+                            registro = None if nombre in forzar else self._lee_registro(etapa, huella)
+                            if registro is not None:
+                                self.hashes[nombre] = registro['resultado']
+                                filas.append({'etapa': nombre, 'estado': 'cache', 'tiempo': 0.0,
+                                              'huella': huella[:12]})
+                            else:
+                                corriendo[ejecutor.submit(self._ejecuta, etapa, huella)] = nombre
+                    if not corriendo:
+                        break
+                    hechos, _ = wait(corriendo, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        nombre = corriendo.pop(futuro)
+                        resultado, hash_resultado, tiempo = futuro.result()
+                        self.hashes[nombre] = hash_resultado
+                        self._valores[hash_resultado] = resultado
+                        filas.append({'etapa': nombre, 'estado': 'ejecutada', 'tiempo': tiempo,
+                                      'huella': self.huellas[nombre][:12]})
+                        logging.debug(f'Etapa {nombre}: {tiempo:.2f} s')
+        finally:
+            self._escribe(ruta_archivos, json.dumps(hashes_archivos).encode('utf-8'))
+        # En memoria sólo se quedan los resultados de esta corrida
+        vigentes = set(self.hashes.values())
+        self._valores = {hash_resultado: valor for hash_resultado, valor in self._valores.items()
+                         if hash_resultado in vigentes}
+        self.tabla = pd.DataFrame(filas, columns=['etapa', 'estado', 'tiempo', 'huella']).set_index('etapa')
+        self.tabla.attrs['total'] = time.perf_counter() - inicio
+        return self.tabla
+
+    def resultado(self, nombre):
+        """
+            El resultado de la etapa `nombre` en la última corrida.
+        """
+        if nombre not in self.hashes:
+            raise KeyError(f'La etapa {nombre!r} no está en la última corrida')
+        return self._valor(nombre)
+
+    def limpia(self):
+        """
+            Borra del cache los resultados y registros que no son de la última corrida. Regresa los MB liberados.
+        """
+        vigentes = {f'{hash_resultado}.pkl' for hash_resultado in self.hashes.values()}
+        vigentes |= {f'{huella}.json' for huella in self.huellas.values()}
+        liberados = 0
+        for subdirectorio in ['objetos', 'etapas']:
+            directorio = self._ruta(subdirectorio)
+            if not os.path.isdir(directorio):
+                continue
+            for nombre in os.listdir(directorio):
+                if nombre not in vigentes:
+                    liberados += os.path.getsize(os.path.join(directorio, nombre))
+                    os.remove(os.path.join(directorio, nombre))
+        return liberados / 2**20
+
+# Etapas del notebook. Importan sus módulos hasta que se ejecutan, así que definir el flujo no carga geopandas ni
+# plotly
+
+def _descarga(fecha, directorio_datos):
+    from .descarga import bajar_datos_salud
+    bajar_datos_salud(directorio_datos, datetime.strptime(fecha, '%y%m%d').strftime('%d-%m-%Y'))
+    return os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+
+def _aplanados(fecha, entidad, directorio_datos, datos=None):
+    from .carga import carga_datos_covid19_MX
+    return carga_datos_covid19_MX(fecha, entidad=entidad, directorio_datos=directorio_datos)
+
+def _curvas(aplanados, nivel=None):
+    from .agregados import curvas_epidemicas
+    return curvas_epidemicas(aplanados, nivel=nivel)
+
+def _graficas(curvas, curvas_municipio, directorio_salida, max_puntos):
+    from .graficas import grafica_curvas, exporta_figuras
+    figuras = {'curvas': grafica_curvas(curvas, max_puntos=max_puntos),
+               'curvas_municipio': grafica_curvas(curvas_municipio, 'CLAVE_MUNICIPIO_RES', max_puntos=max_puntos)}
+    return exporta_figuras(figuras, directorio_salida, indice=None)
+
+def _descarga_municipios(directorio_datos):
+    from .descarga import descarga_archivo
+    from .mapas import URL_MUNICIPIOS
+    ruta = os.path.join(directorio_datos, 'municipios_pob_2020_simple.json')
+    if not os.path.exists(ruta):
+        descarga_archivo(URL_MUNICIPIOS, ruta, es_zip=False)
+    return ruta
+
+def _municipios(directorio_datos, entidad, zoom, geojson=None):
+    from .mapas import AlmacenGeometrias
+    geometrias = AlmacenGeometrias.prepara(directorio_datos)
+    if entidad is None:
+        return geometrias.municipios(zoom=None if zoom == 'auto' else zoom)
+    return geometrias.entidad(entidad, zoom)
+
+def _cubo(aplanados):
+    from .agregados import CuboMunicipal
+    return CuboMunicipal.construye(aplanados)
+
+def _metricas(municipios, cubo):
+    from .agregados import VALORES_CONFIRMADOS
+    poblacion = municipios.set_index('municipio_cvegeo')['pob2020']
+    capas = {'Casos Acumulados': cubo.acumulados(clasificacion=VALORES_CONFIRMADOS),
+             'Tasa x 100,000 habitantes': cubo.tasa(poblacion, clasificacion=VALORES_CONFIRMADOS)}
+    # Los municipios sin registros quedan en 0
+    return municipios.assign(**{nombre: valores.reindex(municipios['municipio_cvegeo']).fillna(0).to_numpy()
+                                for nombre, valores in capas.items()})
+
+def _mapa(metricas, ruta, bins, fill_color, fill_opacity, line_opacity):
+    from .mapas import mapa_capas
+    mapa_capas(metricas, ['Casos Acumulados', 'Tasa x 100,000 habitantes'], bins=bins, fill_color=fill_color,
+               fill_opacity=fill_opacity, line_opacity=line_opacity).save(ruta + '.tmp.html')
+    os.replace(ruta + '.tmp.html', ruta)
+    return ruta
+
+def flujo_notebook(fecha='210505', entidad='27', directorio_salida='/content/salida/', directorio_datos='/content/',
+                   directorio_cache=None, descargar=True, zoom='auto', bins=6, fill_color='OrRd', fill_opacity=0.7,
+                   line_opacity=0.2, max_puntos=20_000, max_trabajadores=None):
+    """
+        El flujo del notebook para la publicación `fecha` y la `entidad` (None para todo el país): gráficas de las
+        curvas epidémicas estatales y por municipio (curvas.html y curvas_municipio.html) y mapa de casos acumulados y
+        tasa por 100,000 habitantes (mapa.html) en `directorio_salida`. El cache queda en `directorio_cache` (por
+        omisión `directorio_datos`/cache/flujo).
+
+        Los parámetros de las gráficas y del mapa sólo están en la huella de su etapa, así que cambiarlos no vuelve a
+        leer el CSV. Con descargar=False se usan los archivos que ya estén en `directorio_datos`.
+    """
+    from .carga import rutas_diccionario
+    if directorio_cache is None:
+        directorio_cache = os.path.join(directorio_datos, 'cache', 'flujo')
+    os.makedirs(directorio_salida, exist_ok=True)
+    datos = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+    geojson = os.path.join(directorio_datos, 'municipios_pob_2020_simple.json')
+    mapa = os.path.join(directorio_salida, 'mapa.html')
+    etapas = [
+        EtapaFlujo('aplanados', _aplanados, entradas={'datos': 'descarga'} if descargar else {},
+                   parametros={'fecha': fecha, 'entidad': entidad, 'directorio_datos': directorio_datos},
+                   archivos=[datos, *rutas_diccionario(directorio_datos)]),
+        EtapaFlujo('curvas', _curvas, entradas=['aplanados']),
+        EtapaFlujo('curvas_municipio', _curvas, entradas=['aplanados'],
+                   parametros={'nivel': 'CLAVE_MUNICIPIO_RES'}),
+        EtapaFlujo('graficas', _graficas, entradas=['curvas', 'curvas_municipio'],
+                   parametros={'directorio_salida': directorio_salida, 'max_puntos': max_puntos},
+                   salidas=[os.path.join(directorio_salida, nombre)
+                            for nombre in ['curvas.html', 'curvas_municipio.html']]),
+        EtapaFlujo('municipios', _municipios, entradas={'geojson': 'descarga_municipios'} if descargar else {},
+                   parametros={'directorio_datos': directorio_datos, 'entidad': entidad, 'zoom': zoom},
+                   archivos=[geojson]),
+        EtapaFlujo('cubo', _cubo, entradas=['aplanados']),
+        EtapaFlujo('metricas', _metricas, entradas=['municipios', 'cubo']),
+        EtapaFlujo('mapa', _mapa, entradas=['metricas'],
+                   parametros={'ruta': mapa, 'bins': bins, 'fill_color': fill_color, 'fill_opacity': fill_opacity,
+                               'line_opacity': line_opacity},
+                   salidas=[mapa]),
+    ]
+    if descargar:
+        # Siempre corren (sólo bajan lo que falta); lo que bajan entra en la huella de las etapas que lo leen
+        etapas += [EtapaFlujo('descarga', _descarga,
+                              parametros={'fecha': fecha, 'directorio_datos': directorio_datos}, guarda=False),
+                   EtapaFlujo('descarga_municipios', _descarga_municipios,
+                              parametros={'directorio_datos': directorio_datos}, guarda=False)]
+    return Flujo(etapas, directorio_cache, max_trabajadores)
@@ -0,0 +1,175 @@
+"""
+    Gráficas de plotly de las curvas epidémicas.
+
+    Con muchas curvas (todas las entidades o todos los municipios en toda la historia) las figuras llegan a cientos de
+    miles de puntos y el HTML tarda en generarse y en abrirse. Por eso las líneas se dibujan con WebGL y, arriba de
+    `MAX_PUNTOS` puntos por figura, cada curva se reduce con LTTB (Largest-Triangle-Three-Buckets), que conserva los
+    picos y la forma de la curva con muchos menos puntos.
+"""
+import os
+import importlib.util
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# Puntos por figura arriba de los cuales se reducen las curvas; una entidad completa (3 tipos × 2 variables × ~450
+# días) queda muy por debajo
+MAX_PUNTOS = 20_000
+
+# Ninguna curva se reduce a menos de estos puntos, aunque la figura quede arriba de MAX_PUNTOS
+MIN_PUNTOS_CURVA = 100
+
+# Nombre del plotly.js que comparten todos los HTML de `exporta_figuras`
+PLOTLYJS = 'plotly.min.js'
+
+def lttb(valores, puntos):
+    """
+        Máscara booleana de los `puntos` que conserva LTTB en cada renglón de `valores` (curvas × días, con los días
+        igualmente espaciados). Siempre se conservan el primer y el último día. Los NaN cuentan como 0 para escoger
+        los puntos.
+
+        LTTB parte los días intermedios en `puntos` - 2 cubetas y de cada una se queda con el punto que forma el
+        triángulo más grande con el punto escogido en la cubeta anterior y el promedio de la siguiente. Las cubetas se
+        recorren una por una, pero cada paso es sobre todas las curvas a la vez.
+    """
+    valores = np.nan_to_num(np.atleast_2d(np.asarray(valores, dtype=float)))
+    num_curvas, num_dias = valores.shape
+    conserva = np.zeros((num_curvas, num_dias), dtype=bool)
+    if puntos >= num_dias or puntos < 3:
+        conserva[:] = True
+        return conserva
+
+    # Límites de las cubetas de los días 1 .. num_dias - 2; la última "cubeta siguiente" es el último día
+    limites = (np.arange(puntos - 1) * (num_dias - 2) / (puntos - 2)).astype(np.int64) + 1
+    limites[-1] = num_dias - 1
+    limites = np.append(limites, num_dias)
+    curvas = np.arange(num_curvas)
+    conserva[:, 0] = conserva[:, -1] = True
+    anterior = np.zeros(num_curvas, dtype=np.int64)
+    for i in range(puntos - 2):
+        inicio, fin, fin_siguiente = limites[i], limites[i + 1], limites[i + 2]
+        x_siguiente = (fin + fin_siguiente - 1) / 2
+        y_siguiente = valores[:, fin:fin_siguiente].mean(axis=1)
+        x_anterior = anterior.astype(float)
+        y_anterior = valores[curvas, anterior]
+        x = np.arange(inicio, fin)
+        # Dos veces el área del triángulo (anterior, candidato, promedio siguiente) de cada candidato de la cubeta
+        areas = np.abs((x_anterior - x_siguiente)[:, None] * (valores[:, inicio:fin] - y_anterior[:, None])
+                       - (x_anterior[:, None] - x) * (y_siguiente - y_anterior)[:, None])
+        anterior = inicio + areas.argmax(axis=1)
+        conserva[curvas, anterior] = True
+    return conserva
+
+def reduce_curvas(curvas, nivel=None, max_puntos=MAX_PUNTOS):
+    """
+        Curvas de `curvas_epidemicas` con a lo más unos `max_puntos` puntos en total: si tienen más, cada curva (Tipo ×
+        variable × valor de `nivel`) se reduce con `lttb` a la parte que le toca, pero nunca a menos de
+        MIN_PUNTOS_CURVA. Los días con valor NaN (el inicio de la media móvil) se quitan.
+    """
+    if max_puntos is None or len(curvas) <= max_puntos:
+        return curvas
+    claves = ['Tipo', 'variable'] + ([] if nivel is None else [nivel])
+    num_curvas = curvas.groupby(claves, observed=True).ngroups
+    puntos = max(max_puntos // max(num_curvas, 1), MIN_PUNTOS_CURVA)
+
+    partes = []
+    for (tipo, variable), parte in curvas.groupby(['Tipo', 'variable'], observed=True, sort=False):
+        # Dentro de un Tipo todas las curvas cubren los mismos días, así que caben en una matriz curvas × días
+        if nivel is None:
+            ancho = pd.DataFrame([parte['value'].to_numpy()], columns=parte['Fecha'])
+        else:
+            ancho = parte.pivot(index=nivel, columns='Fecha', values='value')
+        matriz = ancho.to_numpy(dtype=float)
+        filas, columnas = np.nonzero(lttb(matriz, puntos) & ~np.isnan(matriz))
+        reducida = {'Fecha': ancho.columns[columnas], 'variable': variable, 'value': matriz[filas, columnas],
+                    'Tipo': tipo}
+        if nivel is not None:
+            reducida = {nivel: ancho.index[filas], **reducida}
+        partes.append(pd.DataFrame(reducida))
+    reducidas = pd.concat(partes, ignore_index=True)[list(curvas.columns)]
+    for columna in ['variable', 'Tipo'] + ([] if nivel is None else [nivel]):
+        if isinstance(curvas[columna].dtype, pd.CategoricalDtype):
+            reducidas[columna] = reducidas[columna].astype(curvas[columna].dtype)
+    return reducidas
+
+def junta_curvas(curvas, nivel):
+    """
+        Junta en un solo DataFrame largo, con un solo concat, las curvas de un diccionario {valor de `nivel`: curvas}
+        (p. ej. las curvas.parquet de cada entidad de `procesa_entidades`), para graficarlas con `grafica_curvas(...,
+        nivel)`.
+    """
+    juntas = pd.concat(curvas, names=[nivel]).reset_index(level=0).reset_index(drop=True)
+    for columna in ['variable', 'Tipo']:
+        juntas[columna] = juntas[columna].astype('category')
+    return juntas
+
+def grafica_curvas(curvas, nivel=None, max_puntos=MAX_PUNTOS, webgl=True):
+    """
+        Gráfica de las curvas de `curvas_epidemicas`, con una faceta por Tipo y cada faceta con su propio eje y (las
+        escalas de casos, defunciones y hospitalizaciones son muy diferentes). Si las curvas son por `nivel`, cada valor
+        del nivel es una línea y sólo se grafica la media móvil.
+
+        Las líneas se dibujan con WebGL (webgl=False para SVG) y, si la figura tendría más de `max_puntos` puntos,
+        las curvas se reducen con `reduce_curvas` (max_puntos=None para graficar todos los puntos).
+    """
+    modo = 'webgl' if webgl else 'svg'
+    if nivel is None:
+        curvas = reduce_curvas(curvas, max_puntos=max_puntos)
+        fig = px.line(curvas, x='Fecha', y='value', color='variable', facet_col='Tipo', facet_col_wrap=1,
+                      render_mode=modo)
+    else:
+        curvas = reduce_curvas(curvas[curvas['variable'] == 'Media Móvil'], nivel, max_puntos)
+        fig = px.line(curvas, x='Fecha', y='value', color=nivel, facet_col='Tipo', facet_col_wrap=1,
+                      render_mode=modo)
+    fig.update_yaxes(matches=None)
+    return fig
+
+def _escribe(ruta, texto):
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(ruta + '.tmp', ruta)
+
+def exporta_figuras(figuras, directorio, formatos=('html',), indice='index.html', escala=1):
+    """
+        Guarda cada figura del diccionario {nombre: figura} `figuras` en `directorio` como nombre.html (y nombre.png,
+        .svg, ... para los demás `formatos`). Todos los HTML cargan un solo plotly.js (PLOTLYJS) guardado una vez en
+        `directorio`, en lugar de llevar cada uno sus ~4.5 MB. Con `indice` también se guarda una página con todas las
+        figuras.
+
+        Las imágenes estáticas necesitan kaleido (`pip install kaleido`) y se generan todas en una sola sesión.
+        Regresa las rutas de los archivos guardados.
+    """
+    estaticos = [formato for formato in formatos if formato != 'html']
+    if estaticos and importlib.util.find_spec('kaleido') is None:
+        raise ImportError(f'Exportar a {", ".join(estaticos)} necesita kaleido: pip install kaleido')
+    os.makedirs(directorio, exist_ok=True)
+    rutas = []
+
+    if 'html' in formatos or indice:
+        from plotly.offline import get_plotlyjs
+        ruta = os.path.join(directorio, PLOTLYJS)
+        _escribe(ruta, get_plotlyjs())
+        rutas.append(ruta)
+    if 'html' in formatos:
+        for nombre, fig in figuras.items():
+            ruta = os.path.join(directorio, f'{nombre}.html')
+            _escribe(ruta, fig.to_html(include_plotlyjs=PLOTLYJS))
+            rutas.append(ruta)
+    if indice:
+        secciones = [f'<h2>{nombre}</h2>\n' + fig.to_html(include_plotlyjs=False, full_html=False)
+                     for nombre, fig in figuras.items()]
+        ruta = os.path.join(directorio, indice)
+        _escribe(ruta, '<html>\n<head><meta charset="utf-8" />\n'
+                       f'<script src="{PLOTLYJS}"></script></head>\n<body>\n' + '\n'.join(secciones) +
+                       '\n</body>\n</html>\n')
+        rutas.append(ruta)
+
+    if estaticos:
+        import plotly.io as pio
+        nombres = list(figuras)
+        for formato in estaticos:
+            rutas_formato = [os.path.join(directorio, f'{nombre}.{formato}') for nombre in nombres]
+            pio.write_images([figuras[nombre] for nombre in nombres], rutas_formato, format=formato, scale=escala)
+            rutas.extend(rutas_formato)
+    return rutas
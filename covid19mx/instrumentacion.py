@@ -0,0 +1,229 @@
+"""
+    Instrumentación por etapa del flujo lectura → aplanado → agregados → mapas: tiempo de reloj y de CPU, memoria del
+    proceso y renglones de cada etapa, con perfiles opcionales (cProfile o tracemalloc) de etapas específicas y
+    exportación a JSON o CSV para seguir las corridas de varios días.
+
+    Está apagada por omisión y así casi no cuesta nada. Se prende con `activa_instrumentacion()` o con la variable de
+    entorno COVID19MX_INSTRUMENTACION=1:
+
+        from covid19mx.instrumentacion import MEDIDOR, activa_instrumentacion
+        activa_instrumentacion(perfil=['aplanado'])
+        df = carga_datos_covid19_MX('210505')
+        MEDIDOR.tabla()
+        MEDIDOR.agrega_csv('etapas.csv')
+
+    Sólo se registran las etapas del proceso actual: lo que corre en otros procesos (p. ej. `procesa_entidades` con
+    varios procesos) no aparece.
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows no tiene resource; ahí no se mide el pico de memoria del proceso
+    resource = None
+
+import pandas as pd
+
+# Columnas de cada registro, en el orden de la exportación a CSV
+CAMPOS = ['corrida', 'inicio', 'ruta', 'etapa', 'nivel', 'tiempo', 'cpu', 'rss_mb', 'rss_pico_mb', 'pico_python_mb',
+          'renglones', 'error']
+
+def memoria_proceso():
+    """
+        Memoria residente (RSS) actual y máxima del proceso en MB, None la que no se pueda medir en este sistema.
+    """
+    actual = pico = None
+    try:
+        with open('/proc/self/statm') as f:
+            actual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        pico = pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+    return actual, pico
+
+class Medidor:
+    """
+        Registro de etapas con nombre. `etapa(nombre)` es un administrador de contexto que mide lo que pasa dentro y
+        regresa el registro de la etapa, donde se pueden anotar los renglones procesados. Las etapas se pueden anidar:
+        la ruta de una etapa es la de su padre más su nombre ('carga_datos/aplanado'). Con `activo` en False no se mide
+        nada.
+
+        perfil: nombres de etapas que se corren con cProfile; el resumen queda en `perfiles[ruta]['cprofile']`.
+        memoria: nombres de etapas que se corren con tracemalloc, que da el pico de memoria de Python y las líneas que
+        más memoria asignaron (`perfiles[ruta]['tracemalloc']`). Las dos hacen más lenta la etapa.
+    """
+
+    def __init__(self, activo=False, perfil=(), memoria=(), lineas_perfil=25):
+        self.activo = activo
+        self.perfil = set(perfil)
+        self.memoria = set(memoria)
+        self.lineas_perfil = lineas_perfil
+        # Cada hilo tiene su propia pila de etapas anidadas (p. ej. las consultas del servicio)
+        self._hilo = threading.local()
+        self.reinicia()
+
+    @property
+    def _pila(self):
+        if not hasattr(self._hilo, 'pila'):
+            self._hilo.pila = []
+        return self._hilo.pila
+
+    def reinicia(self):
+        """
+            Borra los registros y los perfiles y empieza una corrida nueva.
+        """
+        self.corrida = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.registros = []
+        self.perfiles = {}
+
+    @contextlib.contextmanager
+    def etapa(self, nombre, renglones=None):
+        if not self.activo:
+            yield {}
+            return
+        self._pila.append(nombre)
+        ruta = '/'.join(self._pila)
+        registro = {'corrida': self.corrida, 'inicio': datetime.now().isoformat(timespec='milliseconds'),
+                    'ruta': ruta, 'etapa': nombre, 'nivel': len(self._pila) - 1, 'renglones': renglones,
+                    'pico_python_mb': None, 'error': None}
+        perfilador = None
+        if nombre in self.perfil:
+            import cProfile
+            perfilador = cProfile.Profile()
+        rastreo = nombre in self.memoria
+        if rastreo:
+            import tracemalloc
+            # Si ya se estaba rastreando (una etapa anidada) sólo se reinicia el pico
+            rastreo_previo = tracemalloc.is_tracing()
+            if rastreo_previo:
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        reloj, cpu = time.perf_counter(), time.process_time()
+        if perfilador is not None:
+            perfilador.enable()
+        try:
+            yield registro
+        except BaseException as error:
+            registro['error'] = type(error).__name__
+            raise
+        finally:
+            if perfilador is not None:
+                perfilador.disable()
+            registro['tiempo'] = time.perf_counter() - reloj
+            registro['cpu'] = time.process_time() - cpu
+            if perfilador is not None:
+                import pstats
+                texto = io.StringIO()
+                pstats.Stats(perfilador, stream=texto).sort_stats('cumulative').print_stats(self.lineas_perfil)
+                self.perfiles.setdefault(ruta, {})['cprofile'] = texto.getvalue()
+            if rastreo:
+                _, pico = tracemalloc.get_traced_memory()
+                lineas = tracemalloc.take_snapshot().statistics('lineno')[:self.lineas_perfil]
+                if not rastreo_previo:
+                    tracemalloc.stop()
+                registro['pico_python_mb'] = pico / 2**20
+                self.perfiles.setdefault(ruta, {})['tracemalloc'] = [str(linea) for linea in lineas]
+            registro['rss_mb'], registro['rss_pico_mb'] = memoria_proceso()
+            self._pila.pop()
+            self.registros.append(registro)
+            logging.debug(f'Etapa {ruta}: {registro["tiempo"]:.3f} s, {registro["renglones"]} renglones')
+
+    def tabla(self):
+        """
+            DataFrame con un renglón por etapa medida, en el orden en que terminaron.
+        """
+        return pd.DataFrame(self.registros, columns=CAMPOS)
+
+    def resumen(self):
+        """
+            Totales por ruta de etapa: número de veces, tiempo y CPU sumados, renglones sumados y RSS máximo.
+        """
+        return (self.tabla()
+                .groupby('ruta', sort=False)
+                .agg(veces=('etapa', 'size'), tiempo=('tiempo', 'sum'), cpu=('cpu', 'sum'),
+                     renglones=('renglones', 'sum'), rss_max_mb=('rss_mb', 'max')))
+
+    def guarda_json(self, ruta):
+        """
+            Guarda los registros y los perfiles de la corrida en `ruta`.
+        """
+        with open(ruta + '.tmp', 'w') as f:
+            json.dump({'corrida': self.corrida, 'registros': self.registros, 'perfiles': self.perfiles}, f, indent=1)
+        os.replace(ruta + '.tmp', ruta)
+
+    def agrega_csv(self, ruta):
+        """
+            Agrega los registros al final de `ruta` (con encabezado si el archivo es nuevo), para juntar en un solo CSV
+            las corridas de varios días.
+        """
+        nuevo = not os.path.exists(ruta)
+        with open(ruta, 'a', newline='') as f:
+            escritor = csv.DictWriter(f, fieldnames=CAMPOS, extrasaction='ignore')
+            if nuevo:
+                escritor.writeheader()
+            escritor.writerows(self.registros)
+
+    def exporta(self, ruta):
+        """
+            `guarda_json` o `agrega_csv` según la extensión de `ruta`.
+        """
+        if ruta.endswith('.csv'):
+            self.agrega_csv(ruta)
+        else:
+            self.guarda_json(ruta)
+
+MEDIDOR = Medidor(activo=os.environ.get('COVID19MX_INSTRUMENTACION', '') not in ('', '0'))
+
+def activa_instrumentacion(perfil=(), memoria=(), reiniciar=True):
+    """
+        Prende la instrumentación de `MEDIDOR`, con cProfile en las etapas de `perfil` y tracemalloc en las de
+        `memoria`, y por omisión empieza una corrida nueva.
+    """
+    MEDIDOR.activo = True
+    MEDIDOR.perfil = set(perfil)
+    MEDIDOR.memoria = set(memoria)
+    if reiniciar:
+        MEDIDOR.reinicia()
+    return MEDIDOR
+
+def desactiva_instrumentacion():
+    MEDIDOR.activo = False
+
+def etapa(nombre, renglones=None):
+    """
+        `MEDIDOR.etapa(nombre, renglones)`.
+    """
+    return MEDIDOR.etapa(nombre, renglones)
+
+def mide(nombre):
+    """
+        Decorador que mide cada llamada de la función como la etapa `nombre` y anota como renglones el largo del
+        resultado cuando lo tiene.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def medida(*args, **kwargs):
+            if not MEDIDOR.activo:
+                return funcion(*args, **kwargs)
+            with MEDIDOR.etapa(nombre) as registro:
+                resultado = funcion(*args, **kwargs)
+                if registro.get('renglones') is None and hasattr(resultado, '__len__'):
+                    registro['renglones'] = len(resultado)
+                return resultado
+        return medida
+    return decorador
@@ -0,0 +1,383 @@
+"""
+    Geometrías de los municipios y mapas de coropletas con folium.
+"""
+import os
+import json
+import base64
+import shutil
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import folium
+from folium.elements import JSCSSMixin
+from branca.element import MacroElement, Template
+from branca.colormap import StepColormap
+from branca.utilities import color_brewer
+
+from .descarga import descarga_archivo
+from .carga import firma_archivo, _mismo_archivo
+from .instrumentacion import mide
+
+URL_MUNICIPIOS = 'https://www.dropbox.com/s/2zw0fh3vdl0rxh4/municipios_pob_2020_simple.json?dl=1'
+
+# Niveles de zoom de folium para los que se guardan geometrías simplificadas
+ZOOMS_GEOMETRIA = [5, 7, 9, 11]
+
+# Cambiar este número cuando cambie la forma de guardar o simplificar las geometrías
+VERSION_GEOMETRIAS = 1
+
+def tolerancia_zoom(zoom):
+    """
+        Tamaño en grados de un pixel en el nivel `zoom` de los mosaicos web (256 pixeles por mosaico).
+    """
+    return 360 / (256 * 2 ** zoom)
+
+def simplifica_geometrias(gdf, zoom):
+    """
+        Copia de `gdf` con las geometrías simplificadas a un pixel del nivel `zoom` y las coordenadas redondeadas a
+        un décimo de pixel (así el GeoJson que genera folium también es más corto).
+    """
+    tolerancia = tolerancia_zoom(zoom)
+    decimales = int(np.ceil(-np.log10(tolerancia / 10)))
+    simplificadas = gdf.geometry.simplify(tolerancia, preserve_topology=True).to_numpy()
+    simplificado = gdf.copy()
+    simplificado['geometry'] = shapely.transform(simplificadas, lambda coordenadas: np.round(coordenadas, decimales))
+    return simplificado
+
+def vista_limites(limites, ancho=1024, alto=512, zoom_max=12):
+    """
+        Centro ([lat, lon]) y zoom_start de folium para que el rectángulo `limites` (minx, miny, maxx, maxy en
+        EPSG:4326) quepa en un mapa de `ancho` × `alto` pixeles. En el zoom z un mosaico de 256 pixeles cubre
+        360 / 2**z grados de longitud; en latitud la proyección de Mercator estira las distancias por 1 / cos(lat).
+    """
+    minx, miny, maxx, maxy = limites
+    centro = [float(miny + maxy) / 2, float(minx + maxx) / 2]
+    zooms = [zoom_max]
+    if maxx > minx:
+        zooms.append(np.log2(360 * ancho / 256 / (maxx - minx)))
+    if maxy > miny:
+        zooms.append(np.log2(360 * alto / 256 * np.cos(np.radians(centro[0])) / (maxy - miny)))
+    return {'location': centro, 'zoom_start': max(1, int(min(zooms)))}
+
+def vista_mapa(geometrias, ancho=1024, alto=512, zoom_max=12):
+    """
+        `vista_limites` de los límites de `geometrias`.
+    """
+    return vista_limites(geometrias.total_bounds, ancho, alto, zoom_max)
+
+class AlmacenGeometrias:
+    """
+        Geometrías de los municipios guardadas en `directorio` en GeoParquet, un archivo por entidad y por nivel de
+        simplificación: original/{entidad}.parquet y z{zoom}/{entidad}.parquet para cada zoom de ZOOMS_GEOMETRIA.
+        Los archivos ya leídos se quedan en memoria.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        with open(os.path.join(directorio, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self._leidas = {}
+
+    @classmethod
+    @mide('geometrias')
+    def prepara(cls, directorio_datos='/content/', url=URL_MUNICIPIOS, directorio=None):
+        """
+            Baja el GeoJson de municipios a `directorio_datos` si no está y lo parte en `directorio` (por omisión
+            `directorio_datos`/cache/geometrias), salvo que ya se haya partido a partir del mismo archivo.
+        """
+        ruta = os.path.join(directorio_datos, 'municipios_pob_2020_simple.json')
+        if not os.path.exists(ruta):
+            descarga_archivo(url, ruta, es_zip=False)
+        if directorio is None:
+            directorio = os.path.join(directorio_datos, 'cache', 'geometrias')
+        if os.path.exists(os.path.join(directorio, 'meta.json')):
+            almacen = cls(directorio)
+            if (almacen.meta['version'] == VERSION_GEOMETRIAS and almacen.meta['zooms'] == ZOOMS_GEOMETRIA
+                    and _mismo_archivo(ruta, almacen.meta['fuente'])):
+                return almacen
+
+        municipios = gpd.read_file(ruta)
+        temporal = directorio + '.tmp'
+        shutil.rmtree(temporal, ignore_errors=True)
+        entidades = {}
+        for entidad, parte in municipios.groupby('entidad_cvegeo'):
+            parte = parte.reset_index(drop=True)
+            versiones = {'original': parte, **{f'z{zoom}': simplifica_geometrias(parte, zoom) for zoom in ZOOMS_GEOMETRIA}}
+            for nombre, version in versiones.items():
+                os.makedirs(os.path.join(temporal, nombre), exist_ok=True)
+                version.to_parquet(os.path.join(temporal, nombre, f'{entidad}.parquet'), index=False)
+            entidades[entidad] = {'limites': [float(limite) for limite in parte.total_bounds],
+                                  'municipios': list(parte['municipio_cvegeo'])}
+        meta = {'version': VERSION_GEOMETRIAS,
+                'fuente': firma_archivo(ruta, con_hash=True),
+                'zooms': ZOOMS_GEOMETRIA,
+                'entidades': entidades}
+        with open(os.path.join(temporal, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(directorio, ignore_errors=True)
+        os.replace(temporal, directorio)
+        return cls(directorio)
+
+    @property
+    def entidades(self):
+        return sorted(self.meta['entidades'])
+
+    def vista(self, entidad, ancho=1024, alto=512):
+        """
+            Centro y zoom_start de folium para la `entidad`, sin leer sus geometrías.
+        """
+        return vista_limites(self.meta['entidades'][entidad]['limites'], ancho, alto)
+
+    def _version(self, zoom):
+        # La simplificación más gruesa que sigue viéndose bien en `zoom`; None o un zoom mayor a todos es la original
+        if zoom is None or zoom > max(self.meta['zooms']):
+            return 'original'
+        return f'z{min(guardado for guardado in self.meta["zooms"] if guardado >= zoom)}'
+
+    def _lee(self, entidad, version):
+        if (entidad, version) not in self._leidas:
+            self._leidas[(entidad, version)] = gpd.read_parquet(os.path.join(self.directorio, version,
+                                                                             f'{entidad}.parquet'))
+        return self._leidas[(entidad, version)]
+
+    def entidad(self, entidad, zoom='auto'):
+        """
+            Los municipios de la `entidad` con la simplificación del nivel `zoom`. Con 'auto' se usa el zoom de
+            `vista`, None regresa las geometrías originales.
+        """
+        if zoom == 'auto':
+            zoom = self.vista(entidad)['zoom_start']
+        return self._lee(entidad, self._version(zoom)).copy()
+
+    def municipios(self, claves=None, zoom=None):
+        """
+            Los municipios con las claves `claves` (municipio_cvegeo) en ese orden, por omisión todos los del país,
+            con la simplificación del nivel `zoom` (None regresa las geometrías originales).
+        """
+        version = self._version(zoom)
+        if claves is None:
+            return pd.concat([self._lee(entidad, version) for entidad in self.entidades], ignore_index=True)
+        claves = list(claves)
+        partes = [self._lee(entidad, version) for entidad in sorted({clave[:2] for clave in claves})]
+        municipios = pd.concat(partes, ignore_index=True).set_index('municipio_cvegeo', drop=False)
+        return municipios.loc[claves].reset_index(drop=True)
+
+def topojson_cuantizado(geometrias, propiedades=None, cuantizacion=10_000, nombre='municipios'):
+    """
+        TopoJSON (como diccionario) de la GeoSeries `geometrias` con un solo objeto `nombre`. Las coordenadas se
+        cuantizan a una cuadrícula de `cuantizacion` × `cuantizacion` sobre los límites de las geometrías y cada anillo
+        es un arco de diferencias entre puntos consecutivos. Cada geometría lleva como id su posición y, si se da
+        `propiedades` (DataFrame en el mismo orden), los valores de su renglón.
+
+        No se buscan arcos compartidos: las geometrías simplificadas por separado ya no tienen bordes idénticos.
+    """
+    minx, miny, maxx, maxy = geometrias.total_bounds
+    escala = np.array([(maxx - minx) / (cuantizacion - 1) or 1, (maxy - miny) / (cuantizacion - 1) or 1])
+    origen = np.array([minx, miny])
+    registros = [{}] * len(geometrias) if propiedades is None else propiedades.to_dict('records')
+    arcos = []
+    objetos = []
+    for i, (geometria, registro) in enumerate(zip(geometrias, registros)):
+        if geometria is None or geometria.is_empty:
+            objetos.append({'type': None, 'id': i, 'properties': registro})
+            continue
+        poligonos = []
+        for poligono in shapely.get_parts(geometria):
+            anillos = []
+            for anillo in shapely.get_rings(poligono):
+                puntos = np.round((shapely.get_coordinates(anillo) - origen) / escala).astype(np.int64)
+                # La cuantización deja puntos repetidos seguidos
+                puntos = puntos[np.r_[True, (np.diff(puntos, axis=0) != 0).any(axis=1)]]
+                anillos.append([len(arcos)])
+                arcos.append(np.diff(puntos, axis=0, prepend=[[0, 0]]).tolist())
+            poligonos.append(anillos)
+        objetos.append({'type': 'MultiPolygon', 'arcs': poligonos, 'id': i, 'properties': registro})
+    return {'type': 'Topology',
+            'transform': {'scale': escala.tolist(), 'translate': origen.tolist()},
+            'objects': {nombre: {'type': 'GeometryCollection', 'geometries': objetos}},
+            'arcs': arcos}
+
+class CapasCoropletas(JSCSSMixin, MacroElement):
+    """
+        Elemento de folium con una geometría TopoJSON compartida y una capa de geojson por cada entrada de `capas`
+        (nombre -> {'clases': clase de color de cada geometría, -1 sin dato, 'colores': color de cada clase}). Las
+        capas se eligen con un control de capas; la primera es la que se ve al abrir el mapa.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var topologia = {{ this.topologia }};
+            var capas = {{ this.capas }};
+            var estilo = {{ this.estilo }};
+            var geometrias = topojson.feature(topologia, topologia.objects[Object.keys(topologia.objects)[0]]);
+            var control = {};
+            Object.keys(capas).forEach(function(nombre, i) {
+                var capa = capas[nombre];
+                control[nombre] = L.geoJson(geometrias, {style: function(feature) {
+                    var clase = capa.clases[feature.id];
+                    return Object.assign({fillColor: clase < 0 ? estilo.sin_dato : capa.colores[clase]}, estilo.base);
+                }});
+                if (i == 0) { control[nombre].addTo({{ this._parent.get_name() }}); }
+            });
+            L.control.layers(control, null, {collapsed: false}).addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+        """)
+    default_js = [('topojson-client', 'https://cdn.jsdelivr.net/npm/topojson-client@3/dist/topojson-client.min.js')]
+
+    def __init__(self, topologia, capas, estilo):
+        super().__init__()
+        self._name = 'CapasCoropletas'
+        # JSON compacto; '<' se escapa para que ningún texto pueda cerrar la etiqueta <script>
+        compacto = lambda objeto: json.dumps(objeto, separators=(',', ':')).replace('<', '\\u003c')
+        self.topologia = compacto(topologia)
+        self.capas = compacto(capas)
+        self.estilo = compacto(estilo)
+
+def _clases_color(valores, bins, fill_color):
+    # Como en folium.Choropleth: `bins` intervalos iguales entre el mínimo y el máximo, -1 para los valores sin dato
+    _, bordes = np.histogram(valores[~np.isnan(valores)], bins=bins)
+    colores = color_brewer(fill_color, n=len(bordes) - 1)
+    # El último intervalo incluye su extremo derecho
+    extremos = np.append(bordes[:-1], np.nextafter(bordes[-1], np.inf))
+    clases = np.where(np.isnan(valores), -1, np.digitize(valores, extremos) - 1)
+    return clases, colores, bordes
+
+@mide('mapa_capas')
+def mapa_capas(gdf, metricas, clave='municipio_cvegeo', bins=6, fill_color='OrRd', fill_opacity=0.7,
+               line_opacity=0.2, nan_fill_color='white', cuantizacion=10_000):
+    """
+        Mapa de folium con una capa de coropletas por cada columna de `metricas` (lista de columnas o diccionario
+        columna -> nombre de la capa) de `gdf`, centrado en sus límites. Como en folium.Choropleth, cada capa se
+        clasifica en `bins` intervalos iguales, con los colores de `fill_color` y su leyenda.
+
+        La geometría (y la columna `clave`) se guarda una sola vez con `topojson_cuantizado`; cada capa sólo agrega la
+        clase de color de cada renglón.
+    """
+    if not isinstance(metricas, dict):
+        metricas = {columna: columna for columna in metricas}
+    m = folium.Map(**vista_mapa(gdf))
+    capas = {}
+    for columna, nombre in metricas.items():
+        clases, colores, bordes = _clases_color(gdf[columna].to_numpy(dtype=float), bins, fill_color)
+        StepColormap(colores, index=list(bordes), vmin=bordes[0], vmax=bordes[-1], caption=nombre).add_to(m)
+        capas[nombre] = {'clases': clases.tolist(), 'colores': colores}
+    estilo = {'sin_dato': nan_fill_color,
+              'base': {'fillOpacity': fill_opacity, 'opacity': line_opacity, 'color': 'black', 'weight': 1}}
+    topologia = topojson_cuantizado(gdf.geometry.reset_index(drop=True), gdf[[clave]], cuantizacion)
+    CapasCoropletas(topologia, capas, estilo).add_to(m)
+    return m
+
+class CoropletasAnimadas(CapasCoropletas):
+    """
+        Como CapasCoropletas, pero la clase de color de cada capa cambia por día. `capas[nombre]['clases']` es un
+        arreglo días × geometrías de bytes (255 sin dato) en base64 y `animacion` tiene el primer día (`inicio`), el
+        número de días (`dias`) y los milisegundos entre días al reproducir (`intervalo`).
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var mapa = {{ this._parent.get_name() }};
+            var topologia = {{ this.topologia }};
+            var capas = {{ this.capas }};
+            var estilo = {{ this.estilo }};
+            var animacion = {{ this.animacion }};
+            var geometrias = topojson.feature(topologia, topologia.objects[Object.keys(topologia.objects)[0]]);
+            var n = geometrias.features.length;
+            var dia = animacion.dias - 1;
+            var control = {};
+            Object.keys(capas).forEach(function(nombre, i) {
+                var capa = capas[nombre];
+                var binario = atob(capa.clases);
+                var clases = new Uint8Array(binario.length);
+                for (var j = 0; j < binario.length; j++) { clases[j] = binario.charCodeAt(j); }
+                capa.estilo = function(feature) {
+                    var clase = clases[dia * n + feature.id];
+                    return Object.assign({fillColor: clase == 255 ? estilo.sin_dato : capa.colores[clase]}, estilo.base);
+                };
+                control[nombre] = L.geoJson(geometrias, {style: capa.estilo});
+                if (i == 0) { control[nombre].addTo(mapa); }
+            });
+            L.control.layers(control, null, {collapsed: false}).addTo(mapa);
+            // Sólo se pinta la capa visible; la que se elige en el control se pinta con el día actual al mostrarse
+            mapa.on('baselayerchange', function(e) { e.layer.setStyle(capas[e.name].estilo); });
+
+            var inicio = Date.parse(animacion.inicio);
+            var deslizador = L.control({position: 'bottomleft'});
+            deslizador.onAdd = function() {
+                var div = L.DomUtil.create('div', 'leaflet-bar');
+                div.style.cssText = 'background: white; padding: 4px 8px;';
+                var boton = L.DomUtil.create('button', '', div);
+                var rango = L.DomUtil.create('input', '', div);
+                var etiqueta = L.DomUtil.create('span', '', div);
+                rango.type = 'range';
+                rango.min = 0;
+                rango.max = animacion.dias - 1;
+                rango.style.cssText = 'width: 300px; vertical-align: middle;';
+                var reproduccion = null;
+                function muestra(nuevo) {
+                    dia = nuevo;
+                    rango.value = dia;
+                    etiqueta.innerHTML = new Date(inicio + dia * 86400000).toISOString().slice(0, 10);
+                    Object.keys(control).forEach(function(nombre) {
+                        if (mapa.hasLayer(control[nombre])) { control[nombre].setStyle(capas[nombre].estilo); }
+                    });
+                }
+                function detiene() {
+                    clearInterval(reproduccion);
+                    reproduccion = null;
+                    boton.innerHTML = '&#9654;';
+                }
+                boton.onclick = function() {
+                    if (reproduccion) { detiene(); return; }
+                    if (dia == animacion.dias - 1) { muestra(0); }
+                    boton.innerHTML = '&#10074;&#10074;';
+                    reproduccion = setInterval(function() {
+                        if (dia == animacion.dias - 1) { detiene(); } else { muestra(dia + 1); }
+                    }, animacion.intervalo);
+                };
+                rango.oninput = function() { muestra(parseInt(rango.value)); };
+                L.DomEvent.disableClickPropagation(div);
+                detiene();
+                muestra(dia);
+                return div;
+            };
+            deslizador.addTo(mapa);
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, topologia, capas, estilo, animacion):
+        super().__init__(topologia, capas, estilo)
+        self._name = 'CoropletasAnimadas'
+        self.animacion = json.dumps(animacion, separators=(',', ':'))
+
+@mide('mapa_animado')
+def mapa_animado(gdf, valores, fechas, clave='municipio_cvegeo', bins=6, fill_color='OrRd', fill_opacity=0.7,
+                 line_opacity=0.2, nan_fill_color='white', cuantizacion=10_000, intervalo=200):
+    """
+        Mapa de folium con una capa de coropletas animada por día por cada entrada de `valores` (nombre de la capa ->
+        arreglo días × renglones de `gdf`, como los de `valores_diarios`); `fechas` son los días consecutivos del primer
+        eje. Cada capa se clasifica en `bins` intervalos iguales con los valores de todos los días.
+
+        La geometría se guarda una sola vez con `topojson_cuantizado` y cada capa agrega un byte por día × municipio.
+    """
+    fechas = pd.DatetimeIndex(fechas)
+    m = folium.Map(**vista_mapa(gdf))
+    capas = {}
+    for nombre, arreglo in valores.items():
+        if np.shape(arreglo) != (len(fechas), len(gdf)):
+            raise ValueError(f'{nombre}: se esperaba un arreglo de {len(fechas)} días × {len(gdf)} renglones, '
+                             f'no {np.shape(arreglo)}')
+        clases, colores, bordes = _clases_color(np.asarray(arreglo, dtype=float), bins, fill_color)
+        StepColormap(colores, index=list(bordes), vmin=bordes[0], vmax=bordes[-1], caption=nombre).add_to(m)
+        clases = np.where(clases < 0, 255, clases).astype(np.uint8)
+        capas[nombre] = {'clases': base64.b64encode(clases.tobytes()).decode('ascii'), 'colores': colores}
+    estilo = {'sin_dato': nan_fill_color,
+              'base': {'fillOpacity': fill_opacity, 'opacity': line_opacity, 'color': 'black', 'weight': 1}}
+    animacion = {'inicio': str(fechas[0].date()), 'dias': len(fechas), 'intervalo': intervalo}
+    topologia = topojson_cuantizado(gdf.geometry.reset_index(drop=True), gdf[[clave]], cuantizacion)
+    CoropletasAnimadas(topologia, capas, estilo, animacion).add_to(m)
+    return m
@@ -0,0 +1,218 @@
+"""
+    Base aplanada de todo el país guardada en disco partida por entidad, para calcular curvas y cubos fuera de memoria.
+"""
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .carga import (VERSION_CACHE, ResolutorCatalogos, carga_catalogos, concatena_bloques, firma_archivo,
+                    lee_bloques_covid19_MX, procesa_fechas, rutas_diccionario, _columnas_cache, _mismo_archivo,
+                    _nombre_cache)
+from .agregados import SERIES_EPIDEMICAS, CuboMunicipal, conteos_diarios, curvas_de_conteos, suma_conteos
+from .instrumentacion import mide
+
+class BaseParticionada:
+    """
+        Base aplanada de una publicación guardada en `directorio` como un dataset de parquet partido por entidad de
+        residencia (CLAVE_ENTIDAD_RES=27/00003.parquet). Cada archivo sale de un solo bloque del CSV y tiene los
+        registros ordenados por FECHA_INGRESO. Los archivos se leen en bloques de a lo más `chunksize` renglones, así
+        que los cálculos que recorren la base bloque por bloque ocupan memoria acotada sin importar el tamaño de la
+        publicación.
+    """
+
+    # La columna de partición se guarda en los nombres de los directorios
+    PARTICION = ds.partitioning(pa.schema([('CLAVE_ENTIDAD_RES', pa.dictionary(pa.int32(), pa.string()))]),
+                                flavor='hive', dictionaries='infer')
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        # El nombre empieza con _ para que el dataset no lo confunda con un archivo de datos
+        with open(os.path.join(directorio, '_meta.json')) as f:
+            self.meta = json.load(f)
+        self.dataset = ds.dataset(directorio, format='parquet', partitioning=self.PARTICION)
+
+    @classmethod
+    @mide('particiona')
+    def particiona(cls, fecha, resolver_claves='si_no_binarias', chunksize=500_000, directorio_datos='/content/',
+                   directorio_particiones=None):
+        """
+            Parte la publicación `fecha` en `directorio_particiones` (por omisión `directorio_datos`/particiones),
+            aplanando el CSV bloque por bloque. Si ya se partió a partir de los mismos archivos sólo la abre. Un CSV sin
+            registros es un ValueError.
+        """
+        if directorio_particiones is None:
+            directorio_particiones = os.path.join(directorio_datos, 'particiones')
+        catalogos, descriptores = rutas_diccionario(directorio_datos)
+        data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+        fuentes = [data_file, catalogos, descriptores]
+        directorio = os.path.join(directorio_particiones, _nombre_cache(fecha, None, resolver_claves))
+
+        if os.path.exists(os.path.join(directorio, '_meta.json')):
+            base = cls(directorio)
+            if (base.meta['version'] == VERSION_CACHE and sorted(base.meta['fuentes']) == sorted(fuentes)
+                    and all(_mismo_archivo(fuente, base.meta['fuentes'][fuente]) for fuente in fuentes)):
+                return base
+
+        # Se escribe en un directorio temporal que sólo se renombra al terminar
+        temporal = directorio + '.tmp'
+        shutil.rmtree(temporal, ignore_errors=True)
+        resolutor = ResolutorCatalogos(carga_catalogos(catalogos, descriptores, True,
+                                                       os.path.join(directorio_datos, 'cache')))
+        registros = 0
+        esquema = None
+        for num_bloque, bloque in enumerate(lee_bloques_covid19_MX(data_file, chunksize=chunksize)):
+            # Un CSV sin registros llega como un solo bloque vacío
+            if bloque.empty:
+                continue
+            bloque = procesa_fechas(resolutor.resuelve(bloque, resolver_claves))
+            registros += len(bloque)
+            columnas = list(bloque.columns)
+            entidad = bloque['CLAVE_ENTIDAD_RES']
+            tabla = pa.Table.from_pandas(bloque.drop(columns='CLAVE_ENTIDAD_RES'), preserve_index=False)
+            if esquema is None:
+                # Todos los bloques se guardan con el esquema del primero, con índices de diccionario de 32 bits para
+                # que quepan las categorías de cualquier bloque
+                esquema = pa.schema([pa.field(campo.name, pa.dictionary(pa.int32(), campo.type.value_type))
+                                     if pa.types.is_dictionary(campo.type) else campo for campo in tabla.schema],
+                                    metadata=tabla.schema.metadata)
+
+            # Ordenamos por entidad y fecha de ingreso y cada entidad va a un archivo
+            codigo_entidad = entidad.cat.codes.to_numpy()
+            orden = np.lexsort((bloque['FECHA_INGRESO'].to_numpy(), codigo_entidad))
+            tabla = tabla.take(orden).cast(esquema)
+            codigo_entidad = codigo_entidad[orden]
+            cortes = np.flatnonzero(codigo_entidad[1:] != codigo_entidad[:-1]) + 1
+            for inicio, fin in zip([0, *cortes], [*cortes, len(tabla)]):
+                clave = (entidad.cat.categories[codigo_entidad[inicio]] if codigo_entidad[inicio] >= 0
+                         else '__HIVE_DEFAULT_PARTITION__')
+                ruta = os.path.join(temporal, f'CLAVE_ENTIDAD_RES={clave}')
+                os.makedirs(ruta, exist_ok=True)
+                pq.write_table(tabla.slice(inicio, fin - inicio), os.path.join(ruta, f'{num_bloque:05d}.parquet'))
+            logging.debug(f'Bloque {num_bloque} de {fecha}: {len(bloque)} registros')
+        if registros == 0:
+            raise ValueError(f'{data_file} no tiene registros')
+
+        meta = {'version': VERSION_CACHE,
+                'fuentes': {fuente: firma_archivo(fuente, con_hash=True) for fuente in fuentes},
+                'resolver_claves': resolver_claves,
+                'chunksize': chunksize,
+                'columnas': columnas,
+                'registros': registros}
+        with open(os.path.join(temporal, '_meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(directorio, ignore_errors=True)
+        os.replace(temporal, directorio)
+        return cls(directorio)
+
+    @staticmethod
+    def _filtro(entidades):
+        if entidades is None:
+            return None
+        entidades = [entidades] if isinstance(entidades, str) else list(entidades)
+        return pc.field('CLAVE_ENTIDAD_RES').isin(entidades)
+
+    def bloques(self, entidades=None, columnas=None):
+        """
+            Generador de DataFrames de a lo más `chunksize` renglones con los registros de las `entidades` (claves),
+            por omisión de todo el país, leyendo sólo las `columnas` dadas (tal como se llaman en la base aplanada).
+        """
+        chunksize = self.meta['chunksize']
+        pendientes = []
+        renglones = 0
+        # Cada archivo es un pedazo chico de un bloque del CSV, los juntamos hasta tener un bloque completo
+        for lote in self.dataset.to_batches(columns=columnas, filter=self._filtro(entidades), batch_size=chunksize):
+            if renglones + lote.num_rows > chunksize and pendientes:
+                yield pa.Table.from_batches(pendientes).to_pandas()
+                pendientes, renglones = [], 0
+            pendientes.append(lote)
+            renglones += lote.num_rows
+        if pendientes:
+            yield pa.Table.from_batches(pendientes).to_pandas()
+
+    def aplanados(self, entidades=None, columnas=None):
+        """
+            La base aplanada de las `entidades` en un DataFrame, como la regresaría `carga_datos_covid19_MX` (aunque con
+            los registros en otro orden). `columnas` se interpreta igual que en `carga_datos_covid19_MX`.
+        """
+        leer = self.meta['columnas'] if columnas is None else _columnas_cache(columnas, self.meta['columnas'])
+        df = concatena_bloques(list(self.bloques(entidades, leer)))
+        df.set_index('FECHA_INGRESO', drop=False, inplace=True)
+        return df
+
+    def _grupos(self, nivel, entidades):
+        """
+            Los valores de `nivel` que aparecen en los registros, en el orden que les daría `curvas_epidemicas`: el de
+            las categorías si todos los archivos tienen las mismas (p. ej. los nombres de entidad) y si no ordenados.
+        """
+        observados = set()
+        ordenes = set()
+        # Se revisa cada archivo por separado: al juntar varios en un bloque pyarrow une sus categorías en el orden en
+        # que aparecen, que no es el de la base completa
+        for lote in self.dataset.to_batches(columns=[nivel], filter=self._filtro(entidades)):
+            serie = lote.column(0).to_pandas()
+            observados.update(serie.dropna().unique())
+            ordenes.add(tuple(serie.cat.categories) if isinstance(serie.dtype, pd.CategoricalDtype) else None)
+        if len(ordenes) == 1 and None not in ordenes:
+            return pd.Index([valor for valor in ordenes.pop() if valor in observados])
+        return pd.Index(sorted(observados))
+
+    @mide('curvas_particionada')
+    def curvas_epidemicas(self, series=None, nivel=None, ventana=7, entidades=None):
+        """
+            Lo mismo que `curvas_epidemicas` sobre la base aplanada completa, pero recorriéndola bloque por bloque.
+        """
+        series = SERIES_EPIDEMICAS if series is None else series
+        columnas = {serie['fecha'] for serie in series.values()}
+        columnas.update(columna for serie in series.values() for columna in serie['filtros'])
+        grupos = None
+        if nivel is not None:
+            columnas.add(nivel)
+            grupos = self._grupos(nivel, entidades)
+        conteos = {}
+        for df in self.bloques(entidades, sorted(columnas)):
+            conteos = suma_conteos(conteos, conteos_diarios(df, series, nivel, grupos))
+        return curvas_de_conteos(conteos, series, nivel, grupos, ventana)
+
+    @mide('cubo_particionada')
+    def cubo(self, columna_fecha='FECHA_INGRESO', entidades=None):
+        """
+            El `CuboMunicipal` de la base completa. Una primera pasada sólo junta los ejes (días, municipios,
+            clasificaciones y tipos de paciente) y la segunda suma los conteos de cada bloque. Igual que
+            `CuboMunicipal.construye`, es un ValueError si ningún registro de las `entidades` tiene `columna_fecha`.
+        """
+        columnas = ['CLAVE_MUNICIPIO_RES', 'CLASIFICACION_FINAL', 'TIPO_PACIENTE', 'DEFUNCION', columna_fecha]
+        inicio = fin = None
+        ejes = {'municipios': set(), 'clasificaciones': set(), 'tipos_paciente': set()}
+        for df in self.bloques(entidades, columnas):
+            dias = df[columna_fecha].dropna().to_numpy().astype('datetime64[D]').astype(np.int64)
+            if len(dias):
+                inicio = dias.min() if inicio is None else min(inicio, dias.min())
+                fin = dias.max() if fin is None else max(fin, dias.max())
+            for columna, nombre in (('CLAVE_MUNICIPIO_RES', 'municipios'), ('CLASIFICACION_FINAL', 'clasificaciones'),
+                                    ('TIPO_PACIENTE', 'tipos_paciente')):
+                ejes[nombre].update(df[columna].dropna().unique())
+        ejes = {'municipios': sorted(ejes['municipios']),
+                'clasificaciones': sorted(ejes['clasificaciones']) + [None],
+                'tipos_paciente': sorted(ejes['tipos_paciente']) + [None]}
+
+        if inicio is None:
+            raise ValueError(f'No hay registros con {columna_fecha} para construir el cubo')
+        num_dias = int(fin - inicio + 1)
+        conteo = None
+        for df in self.bloques(entidades, columnas):
+            parcial = CuboMunicipal.cuenta(df, columna_fecha, inicio, num_dias, ejes)
+            # El cubo se acumula en uint32 igual que el acumulado final, para no tener dos copias en int64
+            if conteo is None:
+                conteo = parcial.astype(np.uint32)
+            else:
+                np.add(conteo, parcial, out=conteo, casting='unsafe')
+            del parcial
+        return CuboMunicipal.de_conteo(conteo, inicio, columna_fecha, ejes, fuentes=self.meta['fuentes'])
@@ -0,0 +1,283 @@
+"""
+    Triángulos de retraso en el reporte: para un rango de publicaciones de la DGE, los conteos por fecha del evento
+    (FECHA_SINTOMAS para los casos, FECHA_DEF para las defunciones) × fecha de publicación × entidad de residencia.
+
+    Cada publicación es una foto de la misma epidemia tal como se conocía ese día; los últimos días de cualquier curva
+    siempre se ven bajos porque todavía no se reportan todos sus casos. Con el triángulo se ve cuánto crece cada día
+    con las publicaciones siguientes y se puede estimar cuánto falta por reportar de los días recientes (`nowcast`).
+
+    De cada publicación sólo se leen las columnas de entidad, fechas y filtros de las series, con las fechas como
+    categóricas (hay unos cientos de fechas distintas en millones de renglones, así que sólo se convierten esas). Los
+    conteos de cada publicación se guardan en un cache chico, así que agregar una publicación nueva sólo lee esa.
+"""
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .carga import (ESQUEMA_DGE, CLAVES_ENTIDAD, FORMATO_FECHA, ResolutorCatalogos, carga_catalogos,
+                    rutas_diccionario, firma_archivo, _mismas_fuentes)
+from .agregados import SERIES_EPIDEMICAS, conteos_diarios, suma_conteos
+from .instrumentacion import mide
+
+# Series del triángulo por omisión: casos confirmados por fecha de síntomas y defunciones por fecha de defunción
+SERIES_TRIANGULO = {tipo: SERIES_EPIDEMICAS[tipo] for tipo in ['Casos Confirmados', 'Defunciones']}
+
+# Columnas que `ResolutorCatalogos.decodifica` sabe decodificar, las únicas que pueden usarse en los filtros
+COLUMNAS_FILTRO = ['CLASIFICACION_FINAL', 'TIPO_PACIENTE', 'RESULTADO']
+
+# Cambiar este número cuando cambie la forma de contar o de guardar los conteos y los triángulos
+VERSION_TRIANGULO = 2
+
+def _llave_series(series):
+    texto = json.dumps(series, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()[:12]
+
+def _fechas_categoricas(serie):
+    # Sólo se convierten las categorías; '9999-99-99' y los códigos -1 quedan como NaT
+    categorias = pd.to_datetime(serie.cat.categories, format=FORMATO_FECHA, errors='coerce').to_numpy()
+    codigos = serie.cat.codes.to_numpy()
+    return np.where(codigos >= 0, categorias[codigos], np.datetime64('NaT'))
+
+def cuenta_publicacion(data_file, resolutor, series=None, chunksize=None):
+    """
+        Conteos diarios por entidad de residencia (CLAVES_ENTIDAD) de cada serie de `series` (por omisión
+        SERIES_TRIANGULO) en el CSV `data_file`, como los de `conteos_diarios`. Sólo se leen ENTIDAD_RES, las fechas y
+        las columnas de los filtros.
+    """
+    series = SERIES_TRIANGULO if series is None else series
+    fechas = sorted({serie['fecha'] for serie in series.values()})
+    filtros = sorted({columna for serie in series.values() for columna in serie['filtros']})
+    otras = sorted(set(filtros) - set(COLUMNAS_FILTRO))
+    if otras:
+        raise ValueError(f'Sólo se puede filtrar por {COLUMNAS_FILTRO}, no por {otras}')
+    # En el CSV la columna RESULTADO se llama RESULTADO_LAB
+    en_csv = {columna: 'RESULTADO_LAB' if columna == 'RESULTADO' else columna for columna in filtros}
+    tipos = {'ENTIDAD_RES': ESQUEMA_DGE['ENTIDAD_RES'], **{columna: 'category' for columna in fechas},
+             **{columna: 'int8' for columna in en_csv.values()}}
+    lector = pd.read_csv(data_file, usecols=list(tipos), dtype=tipos, encoding='latin-1', chunksize=chunksize)
+    if chunksize is None:
+        lector = [lector]
+    conteos = {}
+    for bloque in lector:
+        compacto = pd.DataFrame({'ENTIDAD_RES': bloque['ENTIDAD_RES'],
+                                 **{columna: _fechas_categoricas(bloque[columna]) for columna in fechas},
+                                 **{columna: resolutor.decodifica(bloque[en_csv[columna]], columna)
+                                    for columna in filtros}})
+        conteos = suma_conteos(conteos, conteos_diarios(compacto, series, 'ENTIDAD_RES', CLAVES_ENTIDAD))
+    return conteos
+
+def _ruta_conteos(directorio_cache, fecha, series):
+    return os.path.join(directorio_cache, 'retrasos', f'{fecha}_{_llave_series(series)}.npz')
+
+def conteos_publicacion(fecha, directorio_datos='/content/', series=None, directorio_cache=None, chunksize=None):
+    """
+        `cuenta_publicacion` de la publicación `fecha` ('%y%m%d'), guardada en `directorio_cache` (por omisión
+        `directorio_datos`/cache) mientras no cambien el zip de datos, los catálogos (con ellos se decodifican los
+        filtros) ni las series.
+    """
+    series = SERIES_TRIANGULO if series is None else series
+    if directorio_cache is None:
+        directorio_cache = os.path.join(directorio_datos, 'cache')
+    data_file = os.path.join(directorio_datos, f'{fecha}COVID19MEXICO.csv.zip')
+    catalogos, descriptores = rutas_diccionario(directorio_datos)
+    fuentes = [data_file, catalogos, descriptores]
+    ruta = _ruta_conteos(directorio_cache, fecha, series)
+    if os.path.exists(ruta):
+        with np.load(ruta, allow_pickle=False) as guardado:
+            meta = json.loads(str(guardado['meta']))
+            if meta['version'] == VERSION_TRIANGULO and _mismas_fuentes(fuentes, meta.get('fuentes')):
+                return {tipo: (int(guardado[f'inicio_{i}']), guardado[f'conteo_{i}'])
+                        for i, tipo in enumerate(meta['tipos'])}
+
+    resolutor = ResolutorCatalogos(carga_catalogos(catalogos, descriptores, directorio_cache=directorio_cache))
+    conteos = cuenta_publicacion(data_file, resolutor, series, chunksize)
+    conteos = {tipo: (inicio, conteo.astype(np.int32)) for tipo, (inicio, conteo) in conteos.items()}
+    firmas = {fuente: firma_archivo(fuente, con_hash=True) for fuente in fuentes}
+    meta = {'version': VERSION_TRIANGULO, 'fuentes': firmas, 'tipos': list(conteos)}
+    arreglos = {'meta': np.array(json.dumps(meta))}
+    for i, (inicio, conteo) in enumerate(conteos.values()):
+        arreglos[f'inicio_{i}'] = np.array(inicio)
+        arreglos[f'conteo_{i}'] = conteo
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + '.tmp', 'wb') as f:
+        np.savez_compressed(f, **arreglos)
+    os.replace(ruta + '.tmp', ruta)
+    return conteos
+
+def _conteos_o_error(fecha, directorio_datos, series, directorio_cache, chunksize):
+    # En el pool: una publicación que falta o no se puede leer no detiene a las demás
+    try:
+        return conteos_publicacion(fecha, directorio_datos, series, directorio_cache, chunksize)
+    except Exception as error:
+        return error
+
+class TrianguloRetrasos:
+    """
+        Conteos por publicación × entidad × día del evento de cada serie: `conteos[tipo][p, e, d]` es el número de
+        registros de la entidad e (en el orden de CLAVES_ENTIDAD) cuyo evento fue el día `inicios[tipo]` + d según la
+        publicación p (en el orden de `publicaciones`).
+    """
+
+    def __init__(self, conteos, etiquetas):
+        self.conteos = conteos
+        self.etiquetas = etiquetas
+        self.publicaciones = pd.to_datetime(etiquetas['publicaciones'], format='%y%m%d')
+        self.entidades = pd.Index(etiquetas['entidades'], name='ENTIDAD_RES')
+        self.inicios = {tipo: pd.Timestamp(inicio) for tipo, inicio in etiquetas['inicios'].items()}
+
+    @classmethod
+    @mide('triangulo')
+    def construye(cls, fechas, directorio_datos='/content/', series=None, directorio_cache=None, max_procesos=None,
+                  chunksize=None):
+        """
+            El triángulo de las publicaciones `fechas` (lista de '%y%m%d' o de fechas, p. ej. un pd.date_range). Cada
+            publicación se cuenta (o se lee del cache, ver `conteos_publicacion`) en un pool de `max_procesos` procesos
+            (por omisión uno por núcleo); con max_procesos=1 todo corre en el proceso actual. Las publicaciones que no
+            están o no se pueden leer se omiten con una advertencia.
+        """
+        series = SERIES_TRIANGULO if series is None else series
+        fechas = sorted({fecha if isinstance(fecha, str) else pd.Timestamp(fecha).strftime('%y%m%d')
+                         for fecha in fechas})
+        argumentos = (directorio_datos, series, directorio_cache, chunksize)
+        if max_procesos == 1:
+            resultados = {fecha: _conteos_o_error(fecha, *argumentos) for fecha in fechas}
+        else:
+            resultados = {}
+            with ProcessPoolExecutor(max_workers=max_procesos) as pool:
+                futuros = {pool.submit(_conteos_o_error, fecha, *argumentos): fecha for fecha in fechas}
+                for futuro in as_completed(futuros):
+                    resultados[futuros[futuro]] = futuro.result()
+        publicaciones = []
+        for fecha in fechas:
+            if isinstance(resultados[fecha], Exception):
+                logging.warning(f'Se omite la publicación {fecha}: {resultados[fecha]}')
+            else:
+                publicaciones.append(fecha)
+        if not publicaciones:
+            raise ValueError('No se pudo leer ninguna publicación')
+        return cls.de_conteos({fecha: resultados[fecha] for fecha in publicaciones}, series)
+
+    @classmethod
+    def de_conteos(cls, conteos_por_publicacion, series):
+        """
+            El triángulo a partir de un diccionario publicación ('%y%m%d') -> conteos de `conteos_publicacion`.
+        """
+        publicaciones = sorted(conteos_por_publicacion)
+        conteos, inicios = {}, {}
+        for tipo in series:
+            partes = [conteos_por_publicacion[fecha][tipo] for fecha in publicaciones
+                      if tipo in conteos_por_publicacion[fecha]]
+            if not partes:
+                continue
+            inicio = min(parte_inicio for parte_inicio, _ in partes)
+            fin = max(parte_inicio + conteo.shape[1] for parte_inicio, conteo in partes)
+            arreglo = np.zeros((len(publicaciones), len(CLAVES_ENTIDAD), fin - inicio), dtype=np.int32)
+            for p, fecha in enumerate(publicaciones):
+                if tipo in conteos_por_publicacion[fecha]:
+                    parte_inicio, conteo = conteos_por_publicacion[fecha][tipo]
+                    arreglo[p, :, parte_inicio - inicio:parte_inicio - inicio + conteo.shape[1]] = conteo
+            conteos[tipo] = arreglo
+            inicios[tipo] = str(pd.Timestamp(inicio, unit='D').date())
+        etiquetas = {'version': VERSION_TRIANGULO,
+                     'series': series,
+                     'publicaciones': publicaciones,
+                     'entidades': CLAVES_ENTIDAD,
+                     'inicios': inicios}
+        return cls(conteos, etiquetas)
+
+    def guarda(self, directorio):
+        """
+            Guarda los conteos en un solo npz comprimido (casi todo el triángulo son ceros y diferencias chicas entre
+            publicaciones consecutivas) y las etiquetas en JSON.
+        """
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, 'triangulo.npz')
+        with open(ruta + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **{f'conteo_{i}': self.conteos[tipo] for i, tipo in enumerate(self.conteos)})
+        os.replace(ruta + '.tmp', ruta)
+        etiquetas = {**self.etiquetas, 'tipos': list(self.conteos)}
+        with open(os.path.join(directorio, 'etiquetas.json.tmp'), 'w') as f:
+            json.dump(etiquetas, f, ensure_ascii=False)
+        os.replace(os.path.join(directorio, 'etiquetas.json.tmp'), os.path.join(directorio, 'etiquetas.json'))
+
+    @classmethod
+    def abre(cls, directorio):
+        with open(os.path.join(directorio, 'etiquetas.json')) as f:
+            etiquetas = json.load(f)
+        with np.load(os.path.join(directorio, 'triangulo.npz'), allow_pickle=False) as guardado:
+            conteos = {tipo: guardado[f'conteo_{i}'] for i, tipo in enumerate(etiquetas['tipos'])}
+        return cls(conteos, etiquetas)
+
+    def _matriz(self, tipo, entidad):
+        # Publicaciones × días del evento de una entidad (clave o lista de claves), None suma todo el país
+        conteos = self.conteos[tipo]
+        if entidad is None:
+            return conteos.sum(axis=1)
+        if isinstance(entidad, str):
+            entidad = [entidad]
+        return conteos[:, self.entidades.get_indexer(entidad)].sum(axis=1)
+
+    def fechas_evento(self, tipo):
+        return pd.date_range(self.inicios[tipo], periods=self.conteos[tipo].shape[2], name='Fecha')
+
+    def triangulo(self, tipo='Casos Confirmados', entidad=None):
+        """
+            DataFrame fecha del evento × fecha de publicación con los registros conocidos en cada publicación (NaN para
+            los eventos posteriores a la publicación).
+        """
+        matriz = self._matriz(tipo, entidad).T.astype(float)
+        fechas = self.fechas_evento(tipo)
+        matriz[fechas.to_numpy()[:, None] > self.publicaciones.to_numpy()[None, :]] = np.nan
+        return pd.DataFrame(matriz, index=fechas, columns=self.publicaciones.rename('Publicacion'))
+
+    def por_retraso(self, tipo='Casos Confirmados', entidad=None, max_retraso=60):
+        """
+            DataFrame fecha del evento × retraso (0 a `max_retraso` días) con los registros conocidos en la publicación
+            de `retraso` días después del evento (NaN si esa publicación no está en el triángulo).
+        """
+        matriz = self._matriz(tipo, entidad)
+        fechas = self.fechas_evento(tipo)
+        dias_evento = fechas.to_numpy().astype('datetime64[D]').astype(np.int64)
+        dias_publicacion = self.publicaciones.to_numpy().astype('datetime64[D]').astype(np.int64)
+        # Posición de la publicación de cada día (-1 si no hay), para buscar todos los (evento, retraso) de una vez. Con
+        # fechas del evento erróneas puede haber eventos después de la última publicación
+        inicio = min(dias_evento.min(), dias_publicacion.min())
+        fin = max(dias_evento.max(), dias_publicacion.max())
+        posicion = np.full(fin - inicio + max_retraso + 1, -1)
+        posicion[dias_publicacion - inicio] = np.arange(len(dias_publicacion))
+        publicacion = posicion[(dias_evento - inicio)[:, None] + np.arange(max_retraso + 1)]
+        valores = np.where(publicacion >= 0, matriz[np.maximum(publicacion, 0), np.arange(len(fechas))[:, None]],
+                           np.nan)
+        return pd.DataFrame(valores, index=fechas, columns=pd.RangeIndex(max_retraso + 1, name='Retraso'))
+
+    def nowcast(self, tipo='Casos Confirmados', entidad=None, max_retraso=42, referencia=60):
+        """
+            Estimación de los registros que tendrá cada día del evento cuando se complete su reporte, a partir de la
+            última publicación (método *chain ladder*): el factor de crecimiento de cada retraso d a d + 1 es la suma
+            de los registros con retraso d + 1 entre la suma con retraso d, con los `referencia` días más recientes que
+            tienen los dos, y cada día se multiplica por los factores de los retrasos que le faltan hasta `max_retraso`.
+
+            Regresa un DataFrame indexado por fecha del evento con las columnas Observado (última publicación),
+            Estimado y Retraso (días entre el evento y la última publicación).
+        """
+        tabla = self.por_retraso(tipo, entidad, max_retraso).to_numpy()
+        factores = np.ones(max_retraso)
+        for retraso in range(max_retraso):
+            ambos = ~np.isnan(tabla[:, retraso]) & ~np.isnan(tabla[:, retraso + 1])
+            filas = np.flatnonzero(ambos)[-referencia:]
+            base = tabla[filas, retraso].sum()
+            if base > 0:
+                factores[retraso] = tabla[filas, retraso + 1].sum() / base
+        # Producto de los factores desde cada retraso hasta max_retraso
+        restante = np.append(np.cumprod(factores[::-1])[::-1], 1.0)
+
+        fechas = self.fechas_evento(tipo)
+        observado = self._matriz(tipo, entidad)[-1].astype(float)
+        retraso = (self.publicaciones[-1] - fechas).days.to_numpy()
+        estimado = np.where(retraso >= 0, observado * restante[np.clip(retraso, 0, max_retraso)], np.nan)
+        return pd.DataFrame({'Observado': observado, 'Estimado': estimado, 'Retraso': retraso}, index=fechas)
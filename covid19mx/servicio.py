@@ -0,0 +1,433 @@
+"""
+    Servicio local de consultas HTTP/JSON sobre la última publicación: la base aplanada y su cubo por municipio se
+    quedan en memoria y cada consulta sólo filtra y agrega. Las respuestas se guardan en un cache LRU que se vacía al
+    ingerir una publicación nueva.
+
+        python -m covid19mx servicio 210505 --puerto 8050 --geojson /content/municipios_pob_2020_simple.json
+
+    Rutas:
+
+        GET  /estado
+        GET  /curvas?entidad=27&municipio=27004&tipo=Defunciones&desde=2021-01-01&hasta=2021-03-31&ventana=7
+                    &metrica=Media Móvil&fecha_columna=FECHA_INGRESO&clasificacion=CASO SOSPECHOSO&nivel=CLAVE_MUNICIPIO_RES
+        GET  /municipios?entidad=27&metrica=ultimos_dias&fecha=2021-04-30&dias=14&clasificacion=...&tipo_paciente=...
+                        &defuncion=1
+        POST /ingiere?fecha=210506
+
+    Los parámetros con varios valores (municipio, tipo, clasificacion, tipo_paciente) se separan con '|', porque los
+    nombres de las clasificaciones llevan comas. Sin `clasificacion` se usan los filtros de SERIES_EPIDEMICAS (casos
+    confirmados) en /curvas y todos los registros en /municipios.
+
+    El servidor es de asyncio y los cálculos corren en un pool de hilos, así que mientras una consulta nueva se calcula
+    las que ya están en el cache (y /estado) se siguen contestando. Dos consultas iguales simultáneas se calculan una
+    sola vez.
+"""
+import json
+import asyncio
+import logging
+from http import HTTPStatus
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from .carga import COLUMNAS_FECHA, carga_datos_covid19_MX
+from .agregados import SERIES_EPIDEMICAS, curvas_epidemicas, CuboMunicipal
+
+# Columnas de la base aplanada que necesitan las consultas
+COLUMNAS_SERVICIO = ['CLASIFICACION_FINAL', 'TIPO_PACIENTE', 'FECHA_SINTOMAS', 'FECHA_DEF']
+
+METRICAS_MUNICIPIO = ['acumulados', 'nuevos', 'ultimos_dias', 'tasa']
+
+# Límites de una petición: bytes de la línea de petición y de cada encabezado, número de encabezados y bytes del
+# cuerpo (que no se usa)
+MAX_LINEA = 8 * 1024
+MAX_ENCABEZADOS = 100
+MAX_CUERPO = 64 * 1024
+
+class SinPublicacion(Exception):
+    """
+        El servicio todavía no tiene ninguna publicación ingerida; se contesta con 503.
+    """
+
+class PeticionInvalida(Exception):
+    """
+        Una petición HTTP mal formada o más grande que los límites; se contesta con `estado` y se cierra la conexión.
+    """
+
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+async def _lee_linea(lector, estado, mensaje):
+    # El lector se crea con limit=MAX_LINEA, así que una línea más larga llega como ValueError
+    try:
+        return await lector.readline()
+    except ValueError:
+        raise PeticionInvalida(estado, mensaje)
+
+async def _lee_peticion(lector):
+    """
+        (método, objetivo, versión, encabezados) de la siguiente petición de la conexión, ya con el cuerpo leído, o None
+        si el cliente cerró la conexión.
+    """
+    linea = await _lee_linea(lector, HTTPStatus.REQUEST_URI_TOO_LONG, f'La petición pasa de {MAX_LINEA} bytes')
+    if not linea:
+        return None
+    try:
+        metodo, objetivo, version = linea.decode('latin-1').split()
+    except ValueError:
+        raise PeticionInvalida(HTTPStatus.BAD_REQUEST, 'Petición inválida')
+    encabezados = {}
+    for num_encabezados in range(MAX_ENCABEZADOS + 1):
+        linea = await _lee_linea(lector, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                 f'Un encabezado pasa de {MAX_LINEA} bytes')
+        if linea in (b'\r\n', b'\n', b''):
+            break
+        if num_encabezados == MAX_ENCABEZADOS:
+            raise PeticionInvalida(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                   f'La petición tiene más de {MAX_ENCABEZADOS} encabezados')
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        encabezados[nombre.strip().lower()] = valor.strip()
+    largo = encabezados.get('content-length', '0').strip() or '0'
+    if not largo.isdigit():
+        raise PeticionInvalida(HTTPStatus.BAD_REQUEST, f'Content-Length inválido: {largo!r}')
+    if int(largo) > MAX_CUERPO:
+        raise PeticionInvalida(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'El cuerpo pasa de {MAX_CUERPO} bytes')
+    # El cuerpo no se usa, pero hay que leerlo para llegar a la siguiente petición
+    if int(largo):
+        await lector.readexactly(int(largo))
+    return metodo, objetivo, version, encabezados
+
+class CacheLRU:
+    """
+        Diccionario con a lo más `maximo` entradas; al llenarse se borra la que se usó hace más tiempo.
+    """
+
+    def __init__(self, maximo=256):
+        self.maximo = maximo
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def obten(self, clave):
+        if clave not in self.entradas:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        self.entradas.move_to_end(clave)
+        return self.entradas[clave]
+
+    def guarda(self, clave, valor):
+        self.entradas[clave] = valor
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.maximo:
+            self.entradas.popitem(last=False)
+
+    def borra(self, clave):
+        self.entradas.pop(clave, None)
+
+    def limpia(self):
+        self.entradas.clear()
+
+class Instantanea:
+    """
+        Lo que el servicio tiene en memoria de una publicación: la base aplanada (sólo COLUMNAS_SERVICIO y las
+        derivadas), su `CuboMunicipal`, las posiciones de los renglones de cada entidad y el nombre de cada municipio.
+    """
+
+    def __init__(self, fecha, df, version):
+        self.fecha = fecha
+        self.df = df
+        self.version = version
+        self.cubo = CuboMunicipal.construye(df)
+        self.posiciones = df.groupby(df['CLAVE_ENTIDAD_RES'].astype(str), observed=True).indices
+        nombres = df[['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES']].drop_duplicates('CLAVE_MUNICIPIO_RES')
+        self.nombres = pd.Series(nombres['MUNICIPIO_RES'].astype(str).to_numpy(),
+                                 index=nombres['CLAVE_MUNICIPIO_RES'].astype(str).to_numpy())
+
+def _lista(parametros, nombre):
+    valor = parametros.get(nombre)
+    return None if valor is None else [parte.strip() for parte in valor.split('|') if parte.strip()]
+
+def _entero(parametros, nombre, omision):
+    valor = parametros.get(nombre)
+    if valor is None:
+        return omision
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValueError(f'{nombre} debe ser un entero, no {valor!r}')
+
+def _fecha(parametros, nombre):
+    valor = parametros.get(nombre)
+    if valor is None:
+        return None
+    try:
+        return pd.Timestamp(valor)
+    except ValueError:
+        raise ValueError(f'{nombre} debe ser una fecha AAAA-MM-DD, no {valor!r}')
+
+def _json_registros(fecha, df):
+    # El DataFrame se convierte con to_json (vectorizado) y sólo se envuelve con la publicación
+    return f'{{"publicacion": {json.dumps(fecha)}, "datos": {df.to_json(orient="records", force_ascii=False)}}}'
+
+class ServicioConsultas:
+    """
+        Consultas de curvas y de valores por municipio sobre la publicación más reciente ingerida, con las respuestas
+        en un `CacheLRU` de `tam_cache` entradas.
+
+        entidad: clave o lista de claves de entidad que se cargan, None todo el país.
+        poblacion: serie opcional de población indexada por clave de municipio (p. ej. pob2020 de los municipios
+        indexada por municipio_cvegeo) para la métrica 'tasa' de /municipios.
+    """
+
+    def __init__(self, directorio_datos='/content/', entidad=None, tam_cache=256, chunksize=500_000, poblacion=None):
+        self.directorio_datos = directorio_datos
+        self.entidad = entidad
+        self.chunksize = chunksize
+        self.poblacion = poblacion
+        self.cache = CacheLRU(tam_cache)
+        self.instantanea = None
+        self._versiones = 0
+        self._candado_ingesta = None
+
+    def ingiere(self, fecha):
+        """
+            Carga la publicación `fecha` (con el cache de aplanados) y la pone en lugar de la anterior. Las consultas en
+            curso terminan con la instantánea anterior. Las respuestas guardadas ya no se usan porque sus claves llevan
+            la versión de la instantánea; `ingiere_async` además las descarta.
+        """
+        df = carga_datos_covid19_MX(fecha, entidad=self.entidad, columnas=COLUMNAS_SERVICIO,
+                                    chunksize=self.chunksize, directorio_datos=self.directorio_datos, cache=True)
+        self._versiones += 1
+        self.instantanea = Instantanea(fecha, df.reset_index(drop=True), self._versiones)
+        logging.debug(f'Publicación {fecha} ingerida: {len(df)} registros')
+        return self.instantanea
+
+    def _renglones(self, instantanea, parametros):
+        df = instantanea.df
+        entidades = _lista(parametros, 'entidad')
+        if entidades is not None:
+            posiciones = [instantanea.posiciones[entidad] for entidad in entidades if entidad in instantanea.posiciones]
+            df = df.iloc[np.sort(np.concatenate(posiciones)) if posiciones else []]
+        municipios = _lista(parametros, 'municipio')
+        if municipios is not None:
+            df = df[df['CLAVE_MUNICIPIO_RES'].isin(municipios)]
+        return df
+
+    def curvas(self, instantanea, parametros):
+        """
+            Curvas epidémicas (ver `curvas_epidemicas`) de los registros que cumplen `parametros`.
+        """
+        series = SERIES_EPIDEMICAS
+        tipos = _lista(parametros, 'tipo')
+        if tipos is not None:
+            desconocidos = [tipo for tipo in tipos if tipo not in SERIES_EPIDEMICAS]
+            if desconocidos:
+                raise ValueError(f'Tipos desconocidos {desconocidos}, los tipos son {list(SERIES_EPIDEMICAS)}')
+            series = {tipo: SERIES_EPIDEMICAS[tipo] for tipo in tipos}
+        fecha_columna = parametros.get('fecha_columna')
+        if fecha_columna is not None and fecha_columna not in COLUMNAS_FECHA[1:]:
+            raise ValueError(f'fecha_columna debe ser una de {COLUMNAS_FECHA[1:]}')
+        clasificacion = _lista(parametros, 'clasificacion')
+        series = {tipo: {'fecha': fecha_columna or serie['fecha'],
+                         'filtros': {**serie['filtros'], **({} if clasificacion is None
+                                                            else {'CLASIFICACION_FINAL': clasificacion})}}
+                  for tipo, serie in series.items()}
+        nivel = parametros.get('nivel')
+        if nivel is not None and nivel not in ('CLAVE_MUNICIPIO_RES', 'CLAVE_ENTIDAD_RES'):
+            raise ValueError('nivel debe ser CLAVE_MUNICIPIO_RES o CLAVE_ENTIDAD_RES')
+        ventana = _entero(parametros, 'ventana', 7)
+        if ventana < 1:
+            raise ValueError('ventana debe ser al menos 1')
+
+        curvas = curvas_epidemicas(self._renglones(instantanea, parametros), series, nivel, ventana)
+        desde, hasta = _fecha(parametros, 'desde'), _fecha(parametros, 'hasta')
+        mascara = np.ones(len(curvas), dtype=bool)
+        if desde is not None:
+            mascara &= (curvas['Fecha'] >= desde).to_numpy()
+        if hasta is not None:
+            mascara &= (curvas['Fecha'] <= hasta).to_numpy()
+        metrica = parametros.get('metrica')
+        if metrica is not None:
+            if metrica not in ('Conteo', 'Media Móvil'):
+                raise ValueError("metrica debe ser 'Conteo' o 'Media Móvil'")
+            mascara &= (curvas['variable'] == metrica).to_numpy()
+        curvas = curvas[mascara]
+        return curvas.assign(Fecha=curvas['Fecha'].dt.strftime('%Y-%m-%d'))
+
+    def municipios(self, instantanea, parametros):
+        """
+            Valor por municipio del `CuboMunicipal` (casos acumulados, nuevos, de los últimos `dias` días o tasa por
+            100,000 habitantes) al día `fecha`, para los municipios de `entidad` o de `municipio`.
+        """
+        metrica = parametros.get('metrica', 'acumulados')
+        if metrica not in METRICAS_MUNICIPIO:
+            raise ValueError(f'metrica debe ser una de {METRICAS_MUNICIPIO}')
+        cubo = instantanea.cubo
+        filtros = {'fecha': _fecha(parametros, 'fecha'),
+                   'clasificacion': _lista(parametros, 'clasificacion'),
+                   'tipo_paciente': _lista(parametros, 'tipo_paciente'),
+                   'defuncion': _entero(parametros, 'defuncion', None)}
+        dias = _entero(parametros, 'dias', None)
+        if metrica == 'acumulados':
+            valores = cubo.acumulados(**filtros)
+        elif metrica == 'nuevos':
+            valores = cubo.nuevos(**filtros)
+        elif metrica == 'ultimos_dias':
+            valores = cubo.ultimos_dias(dias=14 if dias is None else dias, **filtros)
+        else:
+            if self.poblacion is None:
+                raise ValueError('El servicio no tiene población por municipio para calcular tasas')
+            valores = cubo.tasa(self.poblacion, dias=dias, **filtros)
+
+        claves = valores.index.astype(str)
+        mascara = np.ones(len(valores), dtype=bool)
+        entidades = _lista(parametros, 'entidad')
+        if entidades is not None:
+            mascara &= claves.str[:2].isin(entidades)
+        municipios = _lista(parametros, 'municipio')
+        if municipios is not None:
+            mascara &= claves.isin(municipios)
+        return pd.DataFrame({'CLAVE_MUNICIPIO_RES': claves[mascara],
+                             'MUNICIPIO_RES': instantanea.nombres.reindex(claves[mascara]).to_numpy(),
+                             'valor': valores.to_numpy()[mascara]})
+
+    def estado(self):
+        instantanea = self.instantanea
+        return {'publicacion': None if instantanea is None else instantanea.fecha,
+                'registros': None if instantanea is None else len(instantanea.df),
+                'cache': {'entradas': len(self.cache), 'maximo': self.cache.maximo,
+                          'aciertos': self.cache.aciertos, 'fallos': self.cache.fallos}}
+
+    def _calcula(self, instantanea, ruta, parametros):
+        consulta = self.curvas if ruta == '/curvas' else self.municipios
+        return _json_registros(instantanea.fecha, consulta(instantanea, parametros)).encode('utf-8')
+
+    async def consulta(self, ruta, parametros):
+        """
+            Respuesta JSON (bytes) de /curvas o /municipios, del cache si ya se calculó para la instantánea actual.
+        """
+        instantanea = self.instantanea
+        if instantanea is None:
+            raise SinPublicacion('Todavía no se ha ingerido ninguna publicación')
+        clave = (instantanea.version, ruta, tuple(sorted(parametros.items())))
+        # En el cache se guarda el futuro del cálculo, así una consulta igual que llega mientras se calcula lo espera
+        futuro = self.cache.obten(clave)
+        if futuro is None:
+            futuro = asyncio.get_running_loop().run_in_executor(None, self._calcula, instantanea, ruta, parametros)
+            self.cache.guarda(clave, futuro)
+        try:
+            return await asyncio.shield(futuro)
+        except Exception:
+            # Los errores no se guardan
+            if self.cache.entradas.get(clave) is futuro:
+                self.cache.borra(clave)
+            raise
+
+    async def ingiere_async(self, fecha):
+        if self._candado_ingesta is None:
+            self._candado_ingesta = asyncio.Lock()
+        async with self._candado_ingesta:
+            await asyncio.get_running_loop().run_in_executor(None, self.ingiere, fecha)
+            # El cache sólo se toca desde el loop: vaciarlo desde el hilo de la ingesta podría hacerlo a la mitad de
+            # un `obten`
+            self.cache.limpia()
+
+    async def responde(self, metodo, objetivo):
+        """
+            (código HTTP, cuerpo JSON en bytes) para una petición.
+        """
+        partes = urlsplit(objetivo)
+        parametros = {nombre: valores[-1] for nombre, valores in parse_qs(partes.query).items()}
+        rutas = {'/estado': 'GET', '/curvas': 'GET', '/municipios': 'GET', '/ingiere': 'POST'}
+        try:
+            if partes.path not in rutas:
+                return HTTPStatus.NOT_FOUND, _error(f'No existe {partes.path}, las rutas son {list(rutas)}')
+            if metodo != rutas[partes.path]:
+                return HTTPStatus.METHOD_NOT_ALLOWED, _error(f'{partes.path} se pide con {rutas[partes.path]}')
+            if partes.path == '/estado':
+                return HTTPStatus.OK, json.dumps(self.estado()).encode('utf-8')
+            if partes.path == '/ingiere':
+                if 'fecha' not in parametros:
+                    return HTTPStatus.BAD_REQUEST, _error("Falta el parámetro 'fecha' ('%y%m%d')")
+                await self.ingiere_async(parametros['fecha'])
+                return HTTPStatus.OK, json.dumps(self.estado()).encode('utf-8')
+            return HTTPStatus.OK, await self.consulta(partes.path, parametros)
+        except ValueError as error:
+            return HTTPStatus.BAD_REQUEST, _error(str(error))
+        except SinPublicacion as error:
+            return HTTPStatus.SERVICE_UNAVAILABLE, _error(str(error))
+        except Exception as error:
+            logging.exception(f'Error en {objetivo}')
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _error(f'{type(error).__name__}: {error}')
+
+    async def atiende(self, lector, escritor):
+        """
+            Atiende una conexión HTTP/1.1, con varias peticiones si el cliente la mantiene abierta.
+        """
+        try:
+            while True:
+                try:
+                    peticion = await _lee_peticion(lector)
+                except PeticionInvalida as error:
+                    escritor.write(_respuesta(error.estado, _error(str(error)), False))
+                    await escritor.drain()
+                    break
+                if peticion is None:
+                    break
+                metodo, objetivo, version, encabezados = peticion
+                estado, cuerpo = await self.responde(metodo, objetivo)
+                mantener = version == 'HTTP/1.1' and encabezados.get('connection', '').lower() != 'close'
+                escritor.write(_respuesta(estado, cuerpo, mantener))
+                await escritor.drain()
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+    async def inicia(self, host='127.0.0.1', puerto=8050):
+        return await asyncio.start_server(self.atiende, host, puerto, limit=MAX_LINEA)
+
+def _error(mensaje):
+    return json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8')
+
+def _respuesta(estado, cuerpo, mantener):
+    encabezado = (f'HTTP/1.1 {estado.value} {estado.phrase}\r\n'
+                  'Content-Type: application/json; charset=utf-8\r\n'
+                  f'Content-Length: {len(cuerpo)}\r\n'
+                  f'Connection: {"keep-alive" if mantener else "close"}\r\n\r\n')
+    return encabezado.encode('latin-1') + cuerpo
+
+def poblacion_municipios(ruta):
+    """
+        La serie pob2020 indexada por municipio_cvegeo del GeoJson de municipios en `ruta` (p. ej.
+        municipios_pob_2020_simple.json). Se lee con json, sin geopandas, porque el servicio no necesita las geometrías.
+    """
+    with open(ruta, encoding='utf-8') as f:
+        propiedades = [municipio['properties'] for municipio in json.load(f)['features']]
+    return pd.Series([propiedad['pob2020'] for propiedad in propiedades],
+                     index=[propiedad['municipio_cvegeo'] for propiedad in propiedades], name='pob2020')
+
+def sirve(fecha, directorio_datos='/content/', entidad=None, host='127.0.0.1', puerto=8050, tam_cache=256,
+          poblacion=None):
+    """
+        Ingiere la publicación `fecha` y atiende consultas en `host`:`puerto` hasta que se interrumpa el proceso.
+    """
+    servicio = ServicioConsultas(directorio_datos, entidad, tam_cache, poblacion=poblacion)
+    servicio.ingiere(fecha)
+
+    async def principal():
+        servidor = await servicio.inicia(host, puerto)
+        logging.info(f'Sirviendo {fecha} en http://{host}:{puerto}')
+        async with servidor:
+            await servidor.serve_forever()
+
+    asyncio.run(principal())
@@ -0,0 +1,296 @@
+"""
+    Datos sintéticos con el formato de la DGE, para medir el rendimiento sin bajar nada: el CSV comprimido de una
+    publicación, los excel de catálogos y descriptores y el GeoJson de municipios con su población.
+"""
+import os
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from .carga import rutas_diccionario
+
+# Columnas del CSV de la DGE, en el orden del archivo
+COLUMNAS_CSV = ['FECHA_ACTUALIZACION', 'ID_REGISTRO', 'ORIGEN', 'SECTOR', 'ENTIDAD_UM', 'SEXO', 'ENTIDAD_NAC',
+                'ENTIDAD_RES', 'MUNICIPIO_RES', 'TIPO_PACIENTE', 'FECHA_INGRESO', 'FECHA_SINTOMAS', 'FECHA_DEF',
+                'INTUBADO', 'NEUMONIA', 'EDAD', 'NACIONALIDAD', 'EMBARAZO', 'HABLA_LENGUA_INDIG', 'INDIGENA',
+                'DIABETES', 'EPOC', 'ASMA', 'INMUSUPR', 'HIPERTENSION', 'OTRA_COM', 'CARDIOVASCULAR', 'OBESIDAD',
+                'RENAL_CRONICA', 'TABAQUISMO', 'OTRO_CASO', 'TOMA_MUESTRA_LAB', 'RESULTADO_LAB',
+                'TOMA_MUESTRA_ANTIGENO', 'RESULTADO_ANTIGENO', 'CLASIFICACION_FINAL', 'MIGRANTE',
+                'PAIS_NACIONALIDAD', 'PAIS_ORIGEN', 'UCI']
+# Campos que los descriptores marcan con el catálogo SI_NO (con el nombre de los descriptores)
+CAMPOS_SI_NO = ['INTUBADO', 'NEUMONIA', 'EMBARAZO', 'HABLA_LENGUA_INDIG', 'INDIGENA', 'DIABETES', 'EPOC', 'ASMA',
+                'INMUSUPR', 'HIPERTENSION', 'OTRAS_COM', 'CARDIOVASCULAR', 'OBESIDAD', 'RENAL_CRONICA', 'TABAQUISMO',
+                'OTRO_CASO', 'TOMA_MUESTRA_LAB', 'TOMA_MUESTRA_ANTIGENO', 'MIGRANTE', 'UCI']
+NOMBRES_ENTIDAD = ['AGUASCALIENTES', 'BAJA CALIFORNIA', 'BAJA CALIFORNIA SUR', 'CAMPECHE', 'COAHUILA DE ZARAGOZA',
+                   'COLIMA', 'CHIAPAS', 'CHIHUAHUA', 'CIUDAD DE MÉXICO', 'DURANGO', 'GUANAJUATO', 'GUERRERO',
+                   'HIDALGO', 'JALISCO', 'MÉXICO', 'MICHOACÁN DE OCAMPO', 'MORELOS', 'NAYARIT', 'NUEVO LEÓN', 'OAXACA',
+                   'PUEBLA', 'QUERÉTARO', 'QUINTANA ROO', 'SAN LUIS POTOSÍ', 'SINALOA', 'SONORA', 'TABASCO',
+                   'TAMAULIPAS', 'TLAXCALA', 'VERACRUZ DE IGNACIO DE LA LLAVE', 'YUCATÁN', 'ZACATECAS']
+# Número de municipios y población en millones (2020) de cada entidad, en el orden de las claves 01 a 32
+MUNICIPIOS_POR_ENTIDAD = [11, 5, 5, 11, 38, 10, 124, 67, 16, 39, 46, 81, 84, 125, 125, 113, 36, 20, 51, 570, 217, 18,
+                          11, 58, 18, 72, 17, 43, 60, 212, 106, 58]
+POBLACION_ENTIDAD = [1.43, 3.77, 0.80, 0.93, 3.15, 0.73, 5.54, 3.74, 9.21, 1.83, 6.17, 3.54, 3.08, 8.35, 16.99, 4.75,
+                     1.97, 1.24, 5.78, 4.13, 6.58, 2.37, 1.86, 2.82, 3.03, 2.94, 2.40, 3.53, 1.34, 8.06, 2.32, 1.62]
+CLASIFICACIONES = {1: 'CASO DE COVID-19 CONFIRMADO POR ASOCIACIÓN CLÍNICA EPIDEMIOLÓGICA',
+                   2: 'CASO DE COVID-19 CONFIRMADO POR COMITÉ DE  DICTAMINACIÓN',
+                   3: 'CASO DE SARS-COV-2  CONFIRMADO',
+                   4: 'INVÁLIDO POR LABORATORIO',
+                   5: 'NO REALIZADO POR LABORATORIO',
+                   6: 'CASO SOSPECHOSO',
+                   7: 'NEGATIVO A SARS-COV-2'}
+# Prevalencia (proporción de claves 1 = SI) de cada comorbilidad
+COMORBILIDADES = {'DIABETES': 0.12, 'EPOC': 0.015, 'ASMA': 0.025, 'INMUSUPR': 0.01, 'HIPERTENSION': 0.16,
+                  'OTRA_COM': 0.02, 'CARDIOVASCULAR': 0.02, 'OBESIDAD': 0.14, 'RENAL_CRONICA': 0.02,
+                  'TABAQUISMO': 0.07}
+# Olas de la epidemia: (centro, ancho, altura) con la fecha como fracción del periodo de la publicación
+OLAS = [(0.30, 0.06, 1.0), (0.58, 0.05, 1.6), (0.85, 0.05, 1.2)]
+FECHA_SIN_DATO = '9999-99-99'
+
+def universo_municipios(semilla=0):
+    """
+        Los municipios sintéticos: claves de entidad y municipio y población, repartida dentro de cada entidad con
+        una ley de Zipf (unos cuantos municipios grandes y muchos chicos).
+    """
+    rng = np.random.default_rng(semilla)
+    partes = []
+    for i, (num, poblacion) in enumerate(zip(MUNICIPIOS_POR_ENTIDAD, POBLACION_ENTIDAD)):
+        pesos = rng.permutation(1 / np.arange(1, num + 1) ** 1.1)
+        partes.append(pd.DataFrame({'entidad': f'{i + 1:02d}',
+                                    'municipio': [f'{m:03d}' for m in range(1, num + 1)],
+                                    'pob2020': np.maximum(np.round(poblacion * 1e6 * pesos / pesos.sum()), 100)}))
+    municipios = pd.concat(partes, ignore_index=True)
+    municipios['pob2020'] = municipios['pob2020'].astype(np.int64)
+    return municipios
+
+def _probabilidad_dias(num_dias, dia_semana_inicio):
+    t = np.linspace(0, 1, num_dias)
+    densidad = 0.1 + sum(altura * np.exp(-0.5 * ((t - centro) / ancho) ** 2) for centro, ancho, altura in OLAS)
+    # Los fines de semana ingresan menos pacientes
+    dia_semana = (np.arange(num_dias) + dia_semana_inicio) % 7
+    densidad = densidad * np.where(dia_semana >= 5, 0.7, 1.0)
+    return densidad / densidad.sum()
+
+def _elige(rng, claves, probabilidades, n):
+    return rng.choice(np.asarray(claves, dtype=np.int8), n, p=probabilidades)
+
+def genera_bloque(rng, n, primer_registro, municipios, inicio, publicacion):
+    """
+        DataFrame con `n` registros sintéticos con las columnas y claves del CSV de la DGE (todo como lo escribiría el
+        CSV: claves numéricas, claves de entidad y municipio con ceros a la izquierda y fechas 'AAAA-MM-DD' o
+        '9999-99-99'). Los registros ingresan entre `inicio` y `publicacion` con varias olas, y el tipo de paciente, la
+        clasificación y la defunción dependen de la edad y entre sí.
+    """
+    inicio = np.datetime64(pd.Timestamp(inicio).date(), 'D')
+    num_dias = int((np.datetime64(pd.Timestamp(publicacion).date(), 'D') - inicio).astype(np.int64)) + 1
+    fechas = np.datetime_as_string(inicio + np.arange(num_dias)).astype(object)
+    ultimo = num_dias - 1
+
+    posicion = rng.choice(len(municipios), n, p=(municipios['pob2020'] / municipios['pob2020'].sum()).to_numpy())
+    entidad = municipios['entidad'].to_numpy()[posicion]
+    municipio = np.where(rng.random(n) < 0.003, '999', municipios['municipio'].to_numpy()[posicion])
+    claves_entidad = np.array([f'{i:02d}' for i in range(1, 33)], dtype=object)
+
+    edad = np.clip(np.round(rng.normal(42, 18, n)), 0, 105).astype(np.int16)
+    sexo = _elige(rng, [1, 2], [0.51, 0.49], n)
+    hospitalizado = rng.random(n) < np.clip(0.02 + 0.005 * np.maximum(edad - 25, 0), 0.01, 0.6)
+    tipo_paciente = np.where(hospitalizado, 2, 1).astype(np.int8)
+
+    dia_semana_inicio = int((inicio.astype(np.int64) + 3) % 7)
+    ingreso = rng.choice(num_dias, n, p=_probabilidad_dias(num_dias, dia_semana_inicio))
+    sintomas = np.maximum(ingreso - np.minimum(rng.geometric(0.35, n) - 1, 14), 0)
+
+    muestra_lab = np.where(rng.random(n) < 0.75, 1, 2).astype(np.int8)
+    resultado_lab = np.where(muestra_lab == 1, _elige(rng, [1, 2, 3, 4], [0.35, 0.55, 0.07, 0.03], n), 97)
+    muestra_antigeno = np.where(rng.random(n) < 0.3, 1, 2).astype(np.int8)
+    resultado_antigeno = np.where(muestra_antigeno == 1, _elige(rng, [1, 2], [0.3, 0.7], n), 97)
+    clasificacion = np.select([(resultado_lab == 1) | (resultado_antigeno == 1), resultado_lab == 2, resultado_lab == 4],
+                              [3, 7, 4], _elige(rng, [1, 2, 5, 6], [0.25, 0.02, 0.28, 0.45], n)).astype(np.int8)
+
+    confirmado = clasificacion <= 3
+    riesgo = np.where(hospitalizado, 0.25, 0.003) * (1 + np.maximum(edad - 50, 0) / 20) * np.where(confirmado, 1.5, 0.5)
+    muere = rng.random(n) < np.clip(riesgo, 0, 0.9)
+    defuncion = np.minimum(ingreso + rng.geometric(0.12, n) - 1, ultimo)
+
+    no_aplica_ambulatorio = lambda claves, probabilidades: np.where(
+        hospitalizado, _elige(rng, claves, probabilidades, n), 97).astype(np.int8)
+    nacionalidad = _elige(rng, [1, 2], [0.995, 0.005], n)
+    df = {'FECHA_ACTUALIZACION': fechas[ultimo],
+          # Multiplicar por un impar es una biyección módulo 2**32: claves únicas que no son consecutivas
+          'ID_REGISTRO': [format(clave, '08x') for clave in
+                          (np.arange(primer_registro, primer_registro + n, dtype=np.uint64) * 2654435761) % 2**32],
+          'ORIGEN': _elige(rng, [1, 2], [0.08, 0.92], n),
+          'SECTOR': _elige(rng, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13],
+                           [0.01, 0.01, 0.01, 0.42, 0.01, 0.05, 0.01, 0.01, 0.02, 0.02, 0.01, 0.41, 0.01], n),
+          'ENTIDAD_UM': np.where(rng.random(n) < 0.95, entidad, rng.choice(claves_entidad, n)),
+          'SEXO': sexo,
+          'ENTIDAD_NAC': np.where(rng.random(n) < 0.85, entidad,
+                                  rng.choice(np.append(claves_entidad, '99'), n)),
+          'ENTIDAD_RES': entidad,
+          'MUNICIPIO_RES': municipio,
+          'TIPO_PACIENTE': tipo_paciente,
+          'FECHA_INGRESO': fechas[ingreso],
+          'FECHA_SINTOMAS': fechas[sintomas],
+          'FECHA_DEF': np.where(muere, fechas[defuncion], FECHA_SIN_DATO),
+          'INTUBADO': no_aplica_ambulatorio([1, 2, 99], [0.12, 0.87, 0.01]),
+          'NEUMONIA': np.where(hospitalizado, _elige(rng, [1, 2], [0.6, 0.4], n),
+                               _elige(rng, [1, 2, 99], [0.04, 0.95, 0.01], n)),
+          'EDAD': edad,
+          'NACIONALIDAD': nacionalidad,
+          'EMBARAZO': np.where(sexo == 1, _elige(rng, [1, 2, 98], [0.02, 0.97, 0.01], n), 97).astype(np.int8),
+          'HABLA_LENGUA_INDIG': _elige(rng, [1, 2, 99], [0.012, 0.978, 0.01], n),
+          'INDIGENA': _elige(rng, [1, 2, 99], [0.015, 0.96, 0.025], n),
+          **{campo: _elige(rng, [1, 2, 98], [prevalencia, 0.995 - prevalencia, 0.005], n)
+             for campo, prevalencia in COMORBILIDADES.items()},
+          'OTRO_CASO': _elige(rng, [1, 2, 99], [0.3, 0.55, 0.15], n),
+          'TOMA_MUESTRA_LAB': muestra_lab,
+          'RESULTADO_LAB': resultado_lab.astype(np.int8),
+          'TOMA_MUESTRA_ANTIGENO': muestra_antigeno,
+          'RESULTADO_ANTIGENO': resultado_antigeno.astype(np.int8),
+          'CLASIFICACION_FINAL': clasificacion,
+          'MIGRANTE': _elige(rng, [1, 2, 99], [0.002, 0.05, 0.948], n),
+          'PAIS_NACIONALIDAD': np.where(nacionalidad == 1, 'México', 'Estados Unidos de América'),
+          'PAIS_ORIGEN': np.where(nacionalidad == 1, '97', 'Estados Unidos de América'),
+          'UCI': no_aplica_ambulatorio([1, 2, 99], [0.1, 0.89, 0.01])}
+    return pd.DataFrame(df, columns=COLUMNAS_CSV)
+
+def genera_publicacion(directorio_datos, fecha='210505', registros=100_000, inicio='2020-02-27', semilla=0,
+                       tam_bloque=500_000):
+    """
+        Escribe en `directorio_datos` el `{fecha}COVID19MEXICO.csv.zip` de una publicación sintética con `registros`
+        renglones (ver `genera_bloque`), en latin-1 como el de la DGE. Los renglones se generan y se comprimen en
+        bloques de `tam_bloque`, así que se pueden generar decenas de millones sin tenerlos en memoria.
+    """
+    os.makedirs(directorio_datos, exist_ok=True)
+    publicacion = pd.to_datetime(fecha, format='%y%m%d')
+    municipios = universo_municipios(semilla)
+    rng = np.random.default_rng([semilla, int(fecha)])
+    nombre = f'{fecha}COVID19MEXICO.csv'
+    ruta = os.path.join(directorio_datos, nombre + '.zip')
+    with zipfile.ZipFile(ruta + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        with zip_ref.open(nombre, 'w', force_zip64=True) as f:
+            for primero in range(0, registros, tam_bloque):
+                bloque = genera_bloque(rng, min(tam_bloque, registros - primero), primero, municipios, inicio,
+                                       publicacion)
+                f.write(bloque.to_csv(index=False, header=primero == 0).encode('latin-1'))
+            if registros == 0:
+                f.write((','.join(COLUMNAS_CSV) + '\n').encode('latin-1'))
+    os.replace(ruta + '.tmp', ruta)
+    return ruta
+
+def _temporal(ruta):
+    # ExcelWriter elige el formato por la extensión, así que el temporal la conserva
+    base, extension = os.path.splitext(ruta)
+    return base + '.tmp' + extension
+
+def _hoja_con_titulo(titulo, df):
+    # Como en el excel de la DGE: un renglón con el título del catálogo antes de los encabezados
+    return pd.concat([pd.DataFrame([[titulo] + [None] * (df.shape[1] - 1), list(df.columns)], columns=df.columns),
+                      df], ignore_index=True)
+
+def genera_diccionario(directorio_datos, semilla=0):
+    """
+        Escribe en `directorio_datos` los excel de catálogos y descriptores (con los nombres de `rutas_diccionario`)
+        con las hojas y la estructura que lee `lee_catalogos`, incluidos los municipios de `universo_municipios`.
+    """
+    os.makedirs(directorio_datos, exist_ok=True)
+    catalogos, descriptores = rutas_diccionario(directorio_datos)
+    municipios = universo_municipios(semilla)
+    entidades = pd.DataFrame({'CLAVE_ENTIDAD': [f'{i:02d}' for i in range(1, 33)] + ['36', '97', '98', '99'],
+                              'ENTIDAD_FEDERATIVA': NOMBRES_ENTIDAD + ['ESTADOS UNIDOS MEXICANOS', 'NO APLICA',
+                                                                       'SE IGNORA', 'NO ESPECIFICADO']})
+    entidades['ABREVIATURA'] = entidades['ENTIDAD_FEDERATIVA'].str[:2]
+    no_especificados = pd.DataFrame({'entidad': [f'{i:02d}' for i in range(1, 33)], 'municipio': '999'})
+    catalogo_municipios = pd.concat([municipios[['entidad', 'municipio']], no_especificados], ignore_index=True)
+    catalogo_municipios = pd.DataFrame({
+        'CLAVE_MUNICIPIO': catalogo_municipios['municipio'],
+        'MUNICIPIO': np.where(catalogo_municipios['municipio'] == '999', 'NO ESPECIFICADO',
+                              'MUNICIPIO ' + catalogo_municipios['entidad'] + catalogo_municipios['municipio']),
+        'CLAVE_ENTIDAD': catalogo_municipios['entidad']})
+    hojas = {
+        'Catálogo ORIGEN': pd.DataFrame({'CLAVE': ['1', '2', '99'],
+                                         'DESCRIPCIÓN': ['USMER', 'FUERA DE USMER', 'NO ESPECIFICADO']}),
+        'Catálogo SEXO': pd.DataFrame({'CLAVE': ['1', '2', '99'], 'DESCRIPCIÓN': ['MUJER', 'HOMBRE', 'NO ESPECIFICADO']}),
+        'Catálogo de ENTIDADES': entidades,
+        'Catálogo MUNICIPIOS': catalogo_municipios,
+        'Catálogo SI_NO': pd.DataFrame({'CLAVE': ['1', '2', '97', '98', '99'],
+                                        'DESCRIPCIÓN': ['SI', 'NO ', 'NO APLICA', 'SE IGNORA', 'NO ESPECIFICADO']}),
+        'Catálogo TIPO_PACIENTE': pd.DataFrame({'CLAVE': ['1', '2', '99'],
+                                                'DESCRIPCIÓN': ['AMBULATORIO', 'HOSPITALIZADO', 'NO ESPECIFICADO']}),
+        'Catálogo RESULTADO_LAB': _hoja_con_titulo('CATÁLOGO: RESULTADO_LAB', pd.DataFrame({
+            'CLAVE': ['1', '2', '3', '4', '97'],
+            'DESCRIPCIÓN': ['POSITIVO A SARS-COV-2', 'NO POSITIVO A SARS-COV-2', 'RESULTADO PENDIENTE',
+                            'RESULTADO NO ADECUADO', 'NO APLICA (CASO SIN MUESTRA)']})),
+        'Catálogo CLASIFICACION_FINAL': _hoja_con_titulo('CATÁLOGO: CLASIFICACION_FINAL', pd.DataFrame({
+            'CLAVE': [str(clave) for clave in CLASIFICACIONES],
+            'CLASIFICACIÓN': list(CLASIFICACIONES.values()),
+            'DESCRIPCIÓN': [f'Clasificación {clave}' for clave in CLASIFICACIONES]})),
+    }
+    with pd.ExcelWriter(_temporal(catalogos), engine='openpyxl') as excel:
+        for hoja, df in hojas.items():
+            df.to_excel(excel, sheet_name=hoja, index=False, header=not hoja.endswith(('RESULTADO_LAB',
+                                                                                        'CLASIFICACION_FINAL')))
+    os.replace(_temporal(catalogos), catalogos)
+
+    nombres = ['OTRAS_COM' if columna == 'OTRA_COM' else columna for columna in COLUMNAS_CSV]
+    formatos = {'FECHA_ACTUALIZACION': 'AAAA-MM-DD', 'ID_REGISTRO': 'TEXTO', 'EDAD': 'NÚMERICA EN AÑOS',
+                'FECHA_INGRESO': 'AAAA-MM-DD', 'FECHA_SINTOMAS': 'AAAA-MM-DD', 'FECHA_DEF': 'AAAA-MM-DD',
+                'PAIS_NACIONALIDAD': 'TEXTO', 'PAIS_ORIGEN': 'TEXTO'}
+    descripcion = pd.DataFrame({
+        'Nº': range(1, len(nombres) + 1),
+        'NOMBRE DE VARIABLE': nombres,
+        'DESCRIPCIÓN DE VARIABLE': [f'Descripción de {nombre}' for nombre in nombres],
+        'FORMATO O FUENTE': [' CATÁLOGO: SI_ NO ' if nombre in CAMPOS_SI_NO else formatos.get(nombre, f'CATÁLOGO: {nombre}')
+                             for nombre in nombres]})
+    with pd.ExcelWriter(_temporal(descriptores), engine='openpyxl') as excel:
+        descripcion.to_excel(excel, index=False)
+    os.replace(_temporal(descriptores), descriptores)
+    return catalogos, descriptores
+
+def genera_municipios(directorio_datos, vertices=64, semilla=0):
+    """
+        Escribe en `directorio_datos` municipios_pob_2020_simple.json: un GeoJson con un polígono por municipio de
+        `universo_municipios` y las propiedades municipio_cvegeo, entidad_cvegeo, nombre y pob2020. Las entidades son
+        rectángulos en una cuadrícula sobre el territorio del país y cada una se parte en celdas, una por municipio;
+        cada polígono tiene `vertices` vértices a distancias irregulares del centro de su celda.
+    """
+    os.makedirs(directorio_datos, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+    municipios = universo_municipios(semilla)
+    angulos = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    coseno, seno = np.cos(angulos), np.sin(angulos)
+    ancho_entidad, alto_entidad = 30 / 8, 17 / 4
+    features = []
+    for i, (entidad, parte) in enumerate(municipios.groupby('entidad', sort=True)):
+        x0, y0 = -117 + (i % 8) * ancho_entidad, 15 + (i // 8) * alto_entidad
+        columnas = int(np.ceil(np.sqrt(len(parte))))
+        filas = int(np.ceil(len(parte) / columnas))
+        ancho, alto = ancho_entidad / columnas, alto_entidad / filas
+        for j, municipio in enumerate(parte.itertuples()):
+            cx, cy = x0 + (j % columnas + 0.5) * ancho, y0 + (j // columnas + 0.5) * alto
+            # Distancia del centro al borde de la celda en cada dirección, recortada para que no se toquen
+            radio = np.minimum(ancho / 2 / np.maximum(np.abs(coseno), 1e-9), alto / 2 / np.maximum(np.abs(seno), 1e-9))
+            radio *= rng.uniform(0.75, 0.98, vertices)
+            anillo = np.column_stack([cx + radio * coseno, cy + radio * seno]).round(6)
+            features.append({'type': 'Feature',
+                             'properties': {'municipio_cvegeo': entidad + municipio.municipio,
+                                            'entidad_cvegeo': entidad,
+                                            'nombre': f'Municipio {entidad}{municipio.municipio}',
+                                            'pob2020': int(municipio.pob2020)},
+                             'geometry': {'type': 'Polygon', 'coordinates': [anillo.tolist() + [anillo[0].tolist()]]}})
+    ruta = os.path.join(directorio_datos, 'municipios_pob_2020_simple.json')
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+    os.replace(ruta + '.tmp', ruta)
+    return ruta
+
+def genera_datos_sinteticos(directorio_datos, registros=100_000, fecha='210505', semilla=0, tam_bloque=500_000):
+    """
+        Todos los archivos que usa el notebook para una publicación sintética en `directorio_datos`: el zip de datos,
+        los excel del diccionario y el GeoJson de municipios. Regresa las rutas.
+    """
+    rutas = {'datos': genera_publicacion(directorio_datos, fecha, registros, semilla=semilla, tam_bloque=tam_bloque)}
+    rutas['catalogos'], rutas['descriptores'] = genera_diccionario(directorio_datos, semilla)
+    rutas['municipios'] = genera_municipios(directorio_datos, semilla=semilla)
+    return rutas
@@ -0,0 +1,301 @@
+"""
+    Vecindades de los municipios como matriz dispersa (CSR) y lo que se calcula con ellas: promedios y tasas
+    suavizadas con los vecinos, tasas bayesianas empíricas e índices de Moran (global y local).
+
+    La matriz se construye una vez a partir del GeoJson de municipios (con un STRtree de shapely, sin overlays de
+    geopandas) y se guarda en disco; después todo son productos matriz dispersa × vector con numpy, así que los
+    ~2,400 municipios del país se calculan de una vez y geopandas no se importa.
+"""
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from .carga import firma_archivo, _mismo_archivo
+from .instrumentacion import mide
+
+# Distancia máxima (en grados) entre dos municipios para considerarlos vecinos. Las geometrías simplificadas no
+# comparten exactamente sus fronteras, así que "tocarse" no basta; 0.005 grados son unos 500 metros
+DISTANCIA_VECINOS = 0.005
+
+# Cambiar este número cuando cambie la forma de construir o guardar las vecindades
+VERSION_VECINDADES = 1
+
+CUADRANTES_MORAN = np.array(['Bajo-Bajo', 'Bajo-Alto', 'Alto-Bajo', 'Alto-Alto'])
+
+class PesosEspaciales:
+    """
+        Vecinos de cada municipio en formato CSR: los vecinos del municipio i (posiciones en `claves`) son
+        `indices[indptr[i]:indptr[i + 1]]`. La relación es simétrica y nadie es vecino de sí mismo.
+
+        Los métodos reciben una Series o un DataFrame indexados por clave de municipio (p. ej. cualquier métrica de
+        `CuboMunicipal` o cualquier columna que se le pasa a `mapa_capas`) y regresan lo mismo, con el índice `claves`.
+        También aceptan arreglos cuyo último eje son los municipios en el orden de `claves` (p. ej. los días ×
+        municipios de `valores_diarios`).
+    """
+
+    def __init__(self, indptr, indices, etiquetas):
+        self.indptr = indptr
+        self.indices = indices
+        self.etiquetas = etiquetas
+        self.claves = pd.Index(etiquetas['claves'], name='municipio_cvegeo')
+        self.grados = np.diff(indptr)
+        # Renglón de cada entrada de la matriz, para sumar por renglón con np.bincount
+        self._filas = np.repeat(np.arange(len(self.claves)), self.grados)
+
+    @classmethod
+    def construye(cls, gdf, clave='municipio_cvegeo', distancia=DISTANCIA_VECINOS, islas=True, fuente=None):
+        """
+            Vecindades de las geometrías de `gdf`: dos municipios son vecinos si están a menos de `distancia` grados.
+            Con `islas`, cada municipio que se queda sin vecinos (p. ej. una isla) toma como vecino al más cercano.
+        """
+        import shapely
+        geometrias = gdf.geometry.to_numpy()
+        arbol = shapely.STRtree(geometrias)
+        if distancia > 0:
+            origen, destino = arbol.query(geometrias, predicate='dwithin', distance=distancia)
+        else:
+            origen, destino = arbol.query(geometrias, predicate='intersects')
+        if islas:
+            solos = np.setdiff1d(np.arange(len(geometrias)), origen[origen != destino])
+            if len(solos):
+                # query_nearest regresa a la misma geometría (distancia 0), así que se excluye
+                cercanos_origen, cercanos = arbol.query_nearest(geometrias[solos], exclusive=True)
+                origen = np.concatenate([origen, solos[cercanos_origen], cercanos])
+                destino = np.concatenate([destino, cercanos, solos[cercanos_origen]])
+        pares = np.unique(np.column_stack([origen, destino])[origen != destino], axis=0)
+        n = len(geometrias)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(pares[:, 0], minlength=n))
+        etiquetas = {'version': VERSION_VECINDADES,
+                     'distancia': distancia,
+                     'islas': islas,
+                     'fuente': fuente,
+                     'claves': [str(valor) for valor in gdf[clave]]}
+        return cls(indptr, pares[:, 1].astype(np.int32), etiquetas)
+
+    def guarda(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, 'vecinos.npz')
+        with open(ruta + '.tmp', 'wb') as f:
+            np.savez(f, indptr=self.indptr, indices=self.indices)
+        os.replace(ruta + '.tmp', ruta)
+        with open(os.path.join(directorio, 'etiquetas.json.tmp'), 'w') as f:
+            json.dump(self.etiquetas, f)
+        os.replace(os.path.join(directorio, 'etiquetas.json.tmp'), os.path.join(directorio, 'etiquetas.json'))
+
+    @classmethod
+    def abre(cls, directorio):
+        with open(os.path.join(directorio, 'etiquetas.json')) as f:
+            etiquetas = json.load(f)
+        with np.load(os.path.join(directorio, 'vecinos.npz'), allow_pickle=False) as arreglos:
+            return cls(arreglos['indptr'], arreglos['indices'], etiquetas)
+
+    @classmethod
+    @mide('vecindades')
+    def prepara(cls, directorio_datos='/content/', distancia=DISTANCIA_VECINOS, islas=True, directorio_cache=None):
+        """
+            Las vecindades de todos los municipios de municipios_pob_2020_simple.json (que ya debe estar en
+            `directorio_datos`, ver `AlmacenGeometrias.prepara`): las abre de `directorio_cache` si ya se construyeron a
+            partir del mismo archivo y con los mismos parámetros, y si no las construye y las guarda.
+        """
+        if directorio_cache is None:
+            directorio_cache = os.path.join(directorio_datos, 'cache')
+        directorio = os.path.join(directorio_cache, 'vecindades')
+        ruta = os.path.join(directorio_datos, 'municipios_pob_2020_simple.json')
+        if os.path.exists(os.path.join(directorio, 'etiquetas.json')):
+            pesos = cls.abre(directorio)
+            etiquetas = pesos.etiquetas
+            if (etiquetas['version'] == VERSION_VECINDADES and etiquetas['distancia'] == distancia
+                    and etiquetas['islas'] == islas and _mismo_archivo(ruta, etiquetas['fuente'])):
+                return pesos
+        import geopandas as gpd
+        municipios = gpd.read_file(ruta)
+        pesos = cls.construye(municipios, distancia=distancia, islas=islas, fuente=firma_archivo(ruta, con_hash=True))
+        pesos.guarda(directorio)
+        return pesos
+
+    def __len__(self):
+        return len(self.claves)
+
+    def vecinos(self, clave):
+        """
+            Claves de los vecinos del municipio `clave`.
+        """
+        i = self.claves.get_loc(clave)
+        return list(self.claves[self.indices[self.indptr[i]:self.indptr[i + 1]]])
+
+    def subconjunto(self, claves):
+        """
+            Las vecindades sólo entre los municipios `claves` (p. ej. los de una entidad, cuando sólo se tienen sus
+            datos: los municipios vecinos de otras entidades contarían con 0 casos).
+        """
+        posiciones = self.claves.get_indexer(pd.Index(claves).astype(str))
+        if (posiciones < 0).any():
+            raise KeyError(f'{(posiciones < 0).sum()} claves no están en las vecindades')
+        nueva = np.full(len(self), -1)
+        nueva[posiciones] = np.arange(len(posiciones))
+        conserva = (nueva[self._filas] >= 0) & (nueva[self.indices] >= 0)
+        filas, indices = nueva[self._filas[conserva]], nueva[self.indices[conserva]]
+        orden = np.lexsort((indices, filas))
+        indptr = np.zeros(len(posiciones) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(filas, minlength=len(posiciones)))
+        etiquetas = {**self.etiquetas, 'claves': list(self.claves[posiciones])}
+        return type(self)(indptr, indices[orden].astype(np.int32), etiquetas)
+
+    def _matriz(self, valores):
+        # Los valores como arreglo municipios × columnas en el orden de `claves`, y cómo regresarlos a su forma
+        if isinstance(valores, pd.Series):
+            nombre = valores.name
+            return (valores.reindex(self.claves).to_numpy(dtype=float)[:, None],
+                    lambda matriz: pd.Series(matriz[:, 0], index=self.claves, name=nombre))
+        if isinstance(valores, pd.DataFrame):
+            columnas = valores.columns
+            return (valores.reindex(self.claves).to_numpy(dtype=float),
+                    lambda matriz: pd.DataFrame(matriz, index=self.claves, columns=columnas))
+        valores = np.asarray(valores, dtype=float)
+        if valores.shape[-1] != len(self):
+            raise ValueError(f'El último eje tiene {valores.shape[-1]} valores y hay {len(self)} municipios')
+        forma = valores.shape
+        return valores.reshape(-1, len(self)).T, lambda matriz: matriz.T.reshape(forma)
+
+    def _suma_vecinos(self, matriz):
+        # W × matriz, con W la matriz de vecindad binaria: la suma de los valores de los vecinos de cada municipio
+        n, columnas = matriz.shape
+        # Un solo np.bincount para todas las columnas: la llave de cada entrada es renglón × columnas + columna
+        llave = (self._filas[:, None] * columnas + np.arange(columnas)).ravel()
+        return np.bincount(llave, weights=matriz[self.indices].ravel(), minlength=n * columnas).reshape(n, columnas)
+
+    def _suma_vecindad(self, matriz, incluye_propio):
+        suma = self._suma_vecinos(matriz)
+        return suma + matriz if incluye_propio else suma
+
+    def rezago(self, valores):
+        """
+            Rezago espacial: el promedio de los valores de los vecinos de cada municipio (NaN para los que no tienen
+            vecinos con dato).
+        """
+        matriz, regresa = self._matriz(valores)
+        validos = ~np.isnan(matriz)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return regresa(self._suma_vecinos(np.where(validos, matriz, 0)) / self._suma_vecinos(validos))
+
+    def promedio_vecinos(self, valores, incluye_propio=True):
+        """
+            Promedio de cada municipio con sus vecinos (sólo los vecinos con `incluye_propio=False`), ignorando los
+            valores NaN. Sirve para cualquier métrica; para tasas es mejor `tasa_suavizada`, que pondera por población.
+        """
+        matriz, regresa = self._matriz(valores)
+        validos = ~np.isnan(matriz)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return regresa(self._suma_vecindad(np.where(validos, matriz, 0), incluye_propio)
+                           / self._suma_vecindad(validos, incluye_propio))
+
+    def _casos_poblacion(self, casos, poblacion):
+        casos, regresa = self._matriz(casos)
+        poblacion = self._matriz(poblacion)[0]
+        # Los municipios sin casos tienen 0; los que no tienen población no cuentan ni en su tasa ni en las vecinas
+        sin_poblacion = np.isnan(poblacion) | (poblacion <= 0)
+        casos = np.where(sin_poblacion, 0, np.nan_to_num(casos))
+        poblacion = np.broadcast_to(np.where(sin_poblacion, 0, poblacion), casos.shape)
+        return casos, poblacion, sin_poblacion, regresa
+
+    def tasa_suavizada(self, casos, poblacion, por=100000, incluye_propio=True):
+        """
+            Tasa por `por` habitantes de cada municipio juntando sus casos y su población con los de sus vecinos:
+            (casos propios + casos vecinos) / (población propia + población vecina). `casos` puede tener varias
+            columnas (una tasa por columna); `poblacion` es una sola (p. ej. pob2020 indexada por municipio_cvegeo).
+        """
+        casos, poblacion, sin_poblacion, regresa = self._casos_poblacion(casos, poblacion)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tasa = self._suma_vecindad(casos, incluye_propio) / self._suma_vecindad(poblacion, incluye_propio) * por
+        return regresa(np.where(sin_poblacion, np.nan, tasa))
+
+    def tasa_bayes_empirica(self, casos, poblacion, por=100000, local=True):
+        """
+            Tasa bayesiana empírica por `por` habitantes (estimador de momentos de Marshall): la tasa cruda de cada
+            municipio se acerca a una tasa de referencia tanto más cuanto menor es su población, así que las tasas de
+            los municipios chicos dejan de ser tan ruidosas.
+
+            Con `local` la referencia de cada municipio es la de su vecindad (él y sus vecinos); si no, la de todos los
+            municipios.
+        """
+        casos, poblacion, sin_poblacion, regresa = self._casos_poblacion(casos, poblacion)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cruda = np.where(sin_poblacion, 0, casos / poblacion)
+            if local:
+                suma_casos = self._suma_vecindad(casos, True)
+                suma_poblacion = self._suma_vecindad(poblacion, True)
+                miembros = self._suma_vecindad((~sin_poblacion).astype(float), True)
+                # Σ p_j (r_j - b)² = Σ c_j r_j - 2 b Σ c_j + b² Σ p_j, todo con sumas de vecindad
+                suma_cruda2 = self._suma_vecindad(casos * cruda, True)
+            else:
+                suma_casos, suma_poblacion = casos.sum(axis=0), poblacion.sum(axis=0)
+                miembros = (~sin_poblacion).sum()
+                suma_cruda2 = (casos * cruda).sum(axis=0)
+            referencia = suma_casos / suma_poblacion
+            varianza = (suma_cruda2 - 2 * referencia * suma_casos + referencia**2 * suma_poblacion) / suma_poblacion
+            # Varianza de las tasas reales; si sale negativa no hay varianza más allá de la de Poisson
+            a = np.maximum(varianza - referencia / (suma_poblacion / miembros), 0)
+            peso = a / (a + referencia / poblacion)
+            tasa = np.where(a > 0, peso * cruda + (1 - peso) * referencia, referencia) * por
+        return regresa(np.where(sin_poblacion, np.nan, tasa))
+
+    def _estandariza(self, valores):
+        if not isinstance(valores, pd.Series):
+            valores = pd.Series(np.asarray(valores, dtype=float), index=self.claves)
+        x = valores.reindex(self.claves).to_numpy(dtype=float)
+        faltantes = np.isnan(x)
+        z = np.where(faltantes, 0, x - np.nanmean(x))
+        return z, faltantes, (z**2).sum() / (~faltantes).sum()
+
+    def _rezago_estandarizado(self, z):
+        # Promedio de los vecinos con los pesos estandarizados por renglón (0 si no hay vecinos)
+        suma = np.bincount(self._filas, weights=z[self.indices], minlength=len(self))
+        return np.divide(suma, self.grados, out=np.zeros(len(self)), where=self.grados > 0)
+
+    def moran_global(self, valores):
+        """
+            Índice de Moran de una métrica (Series indexada por clave), con pesos estandarizados por renglón. Los
+            municipios sin dato cuentan con el promedio.
+        """
+        z, _, m2 = self._estandariza(valores)
+        return float((z * self._rezago_estandarizado(z)).sum() / len(z) / m2)
+
+    def moran_local(self, valores, permutaciones=999, alfa=0.05, semilla=0):
+        """
+            Índice local de Moran (LISA) de cada municipio para una métrica (Series indexada por clave), con pesos
+            estandarizados por renglón: I_i = z_i × (promedio de z de sus vecinos) / m2. El cuadrante dice si el
+            municipio está alto o bajo y si sus vecinos lo están ('Alto-Alto' es un foco, 'Bajo-Alto' un municipio bajo
+            rodeado de altos).
+
+            El valor p sale de `permutaciones` permutaciones condicionales: a cada municipio se le asignan vecinos al
+            azar entre los demás (con reemplazo). Como en PySAL, p es de una cola: la del lado hacia donde cae el valor
+            observado. `significativo` es p <= `alfa`. Los municipios sin dato quedan en NaN.
+        """
+        z, faltantes, m2 = self._estandariza(valores)
+        n = len(z)
+        rezago = self._rezago_estandarizado(z)
+        local = z * rezago / m2
+        resultado = pd.DataFrame({'I': local, 'z': z, 'rezago': rezago,
+                                  'cuadrante': CUADRANTES_MORAN[2 * (z > 0) + (rezago > 0)]}, index=self.claves)
+        if permutaciones:
+            rng = np.random.default_rng(semilla)
+            mayores = np.zeros(n, dtype=np.int64)
+            # En bloques para no tener permutaciones × entradas en memoria de una vez
+            for inicio in range(0, permutaciones, 100):
+                bloque = min(100, permutaciones - inicio)
+                otros = rng.integers(0, n - 1, size=(bloque, len(self.indices)))
+                # Cualquier municipio menos el propio: los índices desde el propio se recorren uno
+                otros += otros >= self._filas
+                llave = (np.arange(bloque)[:, None] * n + self._filas).ravel()
+                sumas = np.bincount(llave, weights=z[otros].ravel(), minlength=bloque * n).reshape(bloque, n)
+                simulados = z * np.divide(sumas, self.grados, out=np.zeros_like(sumas), where=self.grados > 0) / m2
+                mayores += (simulados >= local).sum(axis=0)
+            mayores = np.minimum(mayores, permutaciones - mayores)
+            resultado['p'] = (mayores + 1) / (permutaciones + 1)
+            resultado['significativo'] = resultado['p'] <= alfa
+        resultado.loc[faltantes, ['I', 'z', 'rezago'] + (['p'] if permutaciones else [])] = np.nan
+        resultado.loc[faltantes, 'cuadrante'] = None
+        return resultado
@@ -0,0 +1,17 @@
+import pytest
+
+from covid19mx.sinteticos import genera_datos_sinteticos
+
+# Publicación sintética chica: alcanza para cubrir todas las entidades y catálogos, y se genera en unos segundos
+FECHA = '210505'
+REGISTROS = 20_000
+
+@pytest.fixture(scope='session')
+def directorio_datos(tmp_path_factory):
+    """
+        Directorio con una publicación sintética (zip de datos, diccionario y municipios), compartido por las pruebas.
+        Las pruebas que escriben caches deben usar su propio directorio de cache.
+    """
+    directorio = tmp_path_factory.mktemp('datos')
+    genera_datos_sinteticos(str(directorio), registros=REGISTROS, fecha=FECHA)
+    return str(directorio) + '/'
@@ -0,0 +1,109 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx.agregados import CuboMunicipal
+from covid19mx.carga import carga_datos_covid19_MX, rutas_diccionario
+from covid19mx.servicio import poblacion_municipios
+from covid19mx.sinteticos import genera_diccionario
+
+from conftest import FECHA
+
+COLUMNAS = ['CLASIFICACION_FINAL', 'TIPO_PACIENTE']
+
+@pytest.fixture(scope='module')
+def aplanados(directorio_datos, tmp_path_factory):
+    return carga_datos_covid19_MX(FECHA, entidad='27', directorio_datos=directorio_datos,
+                                  directorio_cache=str(tmp_path_factory.mktemp('cache')), columnas=COLUMNAS)
+
+@pytest.fixture(scope='module')
+def cubo(aplanados):
+    return CuboMunicipal.construye(aplanados)
+
+def _referencia(df, cubo, desde, hasta, clasificacion=None, tipo_paciente=None, defuncion=None):
+    # Registros por municipio con FECHA_INGRESO en [desde, hasta] contados con pandas
+    filtro = df['FECHA_INGRESO'].between(desde, hasta)
+    if clasificacion is not None:
+        filtro &= df['CLASIFICACION_FINAL'].isin(clasificacion)
+    if tipo_paciente is not None:
+        filtro &= df['TIPO_PACIENTE'].isin(tipo_paciente)
+    if defuncion is not None:
+        filtro &= df['DEFUNCION'] == defuncion
+    conteo = df.loc[filtro, 'CLAVE_MUNICIPIO_RES'].astype(str).value_counts()
+    return conteo.reindex(cubo.municipios, fill_value=0).to_numpy()
+
+@pytest.fixture(scope='module')
+def filtros(aplanados):
+    clasificacion = [aplanados['CLASIFICACION_FINAL'].value_counts().index[0]]
+    return [{}, {'clasificacion': clasificacion}, {'tipo_paciente': ['HOSPITALIZADO'], 'defuncion': 1},
+            {'clasificacion': clasificacion, 'defuncion': 0}]
+
+def test_acumulados_nuevos_y_ultimos_dias(aplanados, cubo, filtros):
+    fecha = aplanados['FECHA_INGRESO'].median().normalize()
+    inicio = aplanados['FECHA_INGRESO'].min()
+    assert cubo.inicio == inicio and cubo.fechas[-1] == aplanados['FECHA_INGRESO'].max()
+    for filtro in filtros:
+        np.testing.assert_array_equal(cubo.acumulados(fecha, **filtro), _referencia(aplanados, cubo, inicio, fecha,
+                                                                                    **filtro))
+        np.testing.assert_array_equal(cubo.nuevos(fecha, **filtro), _referencia(aplanados, cubo, fecha, fecha,
+                                                                                **filtro))
+        np.testing.assert_array_equal(cubo.ultimos_dias(fecha, 14, **filtro),
+                                      _referencia(aplanados, cubo, fecha - pd.Timedelta(days=13), fecha, **filtro))
+    # Por omisión hasta el último día; antes del inicio no hay registros y después se queda en el último día
+    np.testing.assert_array_equal(cubo.acumulados(), _referencia(aplanados, cubo, inicio, cubo.fechas[-1]))
+    assert cubo.acumulados().sum() == len(aplanados)
+    assert cubo.acumulados(inicio - pd.Timedelta(days=1)).sum() == 0
+    assert cubo.ultimos_dias(cubo.fechas[-1] + pd.Timedelta(days=30), 10_000).sum() == len(aplanados)
+
+def test_tasa(directorio_datos, aplanados, cubo):
+    poblacion = poblacion_municipios(os.path.join(directorio_datos, 'municipios_pob_2020_simple.json'))
+    tasa = cubo.tasa(poblacion, dias=14)
+    esperada = cubo.ultimos_dias(dias=14) / poblacion.reindex(cubo.municipios) * 100000
+    pd.testing.assert_series_equal(tasa, esperada, check_names=False)
+    # Sólo los municipios sin población (999, no especificado) quedan sin tasa
+    assert set(tasa.index[tasa.isna()]) == set(cubo.municipios.difference(poblacion.index))
+    np.testing.assert_allclose(cubo.tasa(poblacion), cubo.acumulados() / poblacion.reindex(cubo.municipios) * 100000)
+
+def test_filtros_invalidos(cubo):
+    with pytest.raises(ValueError):
+        cubo.acumulados(defuncion=2)
+    with pytest.raises(ValueError):
+        cubo.ultimos_dias(dias=0)
+
+def test_sin_fechas(aplanados):
+    with pytest.raises(ValueError, match='FECHA_INGRESO'):
+        CuboMunicipal.construye(aplanados.iloc[:0])
+    with pytest.raises(ValueError, match='FECHA_INGRESO'):
+        CuboMunicipal.construye(aplanados.assign(FECHA_INGRESO=pd.NaT))
+
+def test_guarda_y_abre(cubo, tmp_path):
+    cubo.guarda(str(tmp_path))
+    abierto = CuboMunicipal.abre(str(tmp_path))
+    np.testing.assert_array_equal(abierto.acumulado, cubo.acumulado)
+    assert abierto.etiquetas == cubo.etiquetas
+    pd.testing.assert_series_equal(abierto.ultimos_dias(dias=7), cubo.ultimos_dias(dias=7))
+
+def test_cache_de_para_publicacion(directorio_datos, tmp_path, monkeypatch):
+    directorio = str(tmp_path) + '/'
+    for ruta in [f'{FECHA}COVID19MEXICO.csv.zip', *rutas_diccionario(directorio_datos)]:
+        shutil.copy(os.path.join(directorio_datos, os.path.basename(ruta)), directorio)
+    llamadas = []
+    construye = CuboMunicipal.construye
+
+    def cuenta(cls, *args, **kwargs):
+        llamadas.append(args)
+        return construye(*args, **kwargs)
+
+    monkeypatch.setattr(CuboMunicipal, 'construye', classmethod(cuenta))
+    primero = CuboMunicipal.para_publicacion(FECHA, directorio_datos=directorio)
+    segundo = CuboMunicipal.para_publicacion(FECHA, directorio_datos=directorio)
+    assert len(llamadas) == 1
+    np.testing.assert_array_equal(segundo.acumulado, primero.acumulado)
+
+    # Con otros catálogos cambian las etiquetas de los ejes, así que el cubo se vuelve a construir
+    genera_diccionario(directorio, semilla=1)
+    CuboMunicipal.para_publicacion(FECHA, directorio_datos=directorio)
+    assert len(llamadas) == 2
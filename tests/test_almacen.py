@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from covid19mx.carga import AlmacenRegistros, carga_datos_covid19_MX, rutas_diccionario
+
+from conftest import FECHA
+
+ANTERIOR, SIGUIENTE = '210505', '210506'
+
+def _escribe(df, directorio, fecha):
+    df.to_csv(os.path.join(directorio, f'{fecha}COVID19MEXICO.csv.zip'), index=False, encoding='latin-1',
+              compression={'method': 'zip', 'archive_name': f'{fecha}COVID19MEXICO.csv'})
+
+@pytest.fixture
+def publicaciones(directorio_datos, tmp_path):
+    """
+        Dos publicaciones chicas sacadas de la sintética: la segunda quita los primeros 500 registros de la primera,
+        agrega 300 nuevos y cambia la clasificación de 100; todos cambian de FECHA_ACTUALIZACION.
+    """
+    directorio = str(tmp_path) + '/'
+    csv = pd.read_csv(os.path.join(directorio_datos, f'{FECHA}COVID19MEXICO.csv.zip'), dtype=str, encoding='latin-1',
+                      keep_default_na=False, nrows=2300)
+    anterior = csv.iloc[:2000].copy()
+    siguiente = csv.iloc[500:].copy()
+    siguiente['FECHA_ACTUALIZACION'] = '2021-05-06'
+    cambiados = siguiente.index[:100]
+    siguiente.loc[cambiados, 'CLASIFICACION_FINAL'] = [str(int(clave) % 7 + 1)
+                                                        for clave in siguiente.loc[cambiados, 'CLASIFICACION_FINAL']]
+    _escribe(anterior, directorio, ANTERIOR)
+    _escribe(siguiente, directorio, SIGUIENTE)
+    for ruta in rutas_diccionario(directorio_datos):
+        shutil.copy(ruta, directorio)
+    ids = {'bajas': set(csv['ID_REGISTRO'][:500]), 'cambios': set(csv['ID_REGISTRO'][cambiados]),
+           'altas': set(csv['ID_REGISTRO'][2000:])}
+    return directorio, ids
+
+def test_ingiere(publicaciones):
+    directorio, ids = publicaciones
+    almacen = AlmacenRegistros(os.path.join(directorio, 'almacen'))
+    assert almacen.ingiere(ANTERIOR, directorio) == {'altas': 2000, 'cambios': 0, 'bajas': 0}
+    assert almacen.ingiere(SIGUIENTE, directorio) == {'altas': 300, 'cambios': 100, 'bajas': 500}
+    with pytest.raises(ValueError):
+        almacen.ingiere(SIGUIENTE, directorio)
+
+    # El almacén se vuelve a abrir desde disco
+    almacen = AlmacenRegistros(os.path.join(directorio, 'almacen'))
+    assert almacen.publicaciones == [ANTERIOR, SIGUIENTE]
+    assert len(almacen.estado) == 1800
+    bitacora = almacen.bitacora()
+    assert bitacora.groupby(['FECHA_PUBLICACION', 'TIPO_CAMBIO'], observed=True).size().to_dict() == {
+        (pd.Timestamp('2021-05-05'), 'alta'): 2000, (pd.Timestamp('2021-05-06'), 'alta'): 300,
+        (pd.Timestamp('2021-05-06'), 'cambio'): 100, (pd.Timestamp('2021-05-06'), 'baja'): 500}
+    cambios = almacen.bitacora(desde=SIGUIENTE)
+    for tipo, plural in [('alta', 'altas'), ('cambio', 'cambios'), ('baja', 'bajas')]:
+        assert set(cambios.loc[cambios['TIPO_CAMBIO'] == tipo, 'ID_REGISTRO']) == ids[plural]
+    assert almacen.bitacora(hasta='210504').empty
+
+    with pytest.raises(ValueError):
+        AlmacenRegistros(os.path.join(directorio, 'almacen'), entidad='27')
+
+def test_aplanados_igual_a_la_publicacion(publicaciones):
+    directorio, _ = publicaciones
+    almacen = AlmacenRegistros(os.path.join(directorio, 'almacen'))
+    almacen.ingiere(ANTERIOR, directorio)
+    almacen.ingiere(SIGUIENTE, directorio)
+    aplanados = almacen.aplanados(directorio_datos=directorio)
+    esperado = carga_datos_covid19_MX(SIGUIENTE, entidad=None, directorio_datos=directorio,
+                                      directorio_cache=os.path.join(directorio, 'cache'))
+    assert sorted(aplanados.columns) == sorted(esperado.columns)
+    # El almacén guarda los registros en otro orden y con FECHA_ACTUALIZACION de la publicación en que cambiaron
+    columnas = [columna for columna in esperado.columns if columna != 'FECHA_ACTUALIZACION']
+    izquierda = aplanados[columnas].sort_values('ID_REGISTRO').reset_index(drop=True)
+    derecha = esperado[columnas].sort_values('ID_REGISTRO').reset_index(drop=True)
+    pd.testing.assert_frame_equal(izquierda, derecha, check_categorical=False)
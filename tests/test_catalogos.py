@@ -0,0 +1,78 @@
+import os
+
+import pandas as pd
+import pytest
+
+from covid19mx.carga import carga_datos_covid19_MX, rutas_diccionario
+
+from conftest import FECHA
+
+def decodifica_referencia(directorio_datos, resolver_claves, entidad):
+    """
+        El aplanado original del notebook, con `.replace` y `.map` sobre el CSV leído como texto, sin procesar las
+        fechas. Es la referencia de `ResolutorCatalogos`.
+    """
+    catalogos, descriptores = rutas_diccionario(directorio_datos)
+    df = pd.read_csv(os.path.join(directorio_datos, f'{FECHA}COVID19MEXICO.csv.zip'), dtype=object,
+                     encoding='latin-1')
+    if entidad is not None:
+        df = df[df['ENTIDAD_RES'] == entidad]
+    df = df.rename(columns={'OTRA_COM': 'OTRAS_COM'})
+    df['MUNICIPIO_RES'] = df['ENTIDAD_RES'] + df['MUNICIPIO_RES']
+    df['CLAVE_MUNICIPIO_RES'] = df['MUNICIPIO_RES']
+    nombres_catalogos = ['Catálogo de ENTIDADES', 'Catálogo MUNICIPIOS', 'Catálogo RESULTADO_LAB', 'Catálogo SI_NO',
+                         'Catálogo TIPO_PACIENTE', 'Catálogo CLASIFICACION_FINAL']
+    dict_catalogos = pd.read_excel(catalogos, nombres_catalogos, dtype=str, engine='openpyxl')
+    entidades, municipios, tipo_resultado, cat_si_no, cat_tipo_pac, clasificacion_final = (
+        dict_catalogos[nombre] for nombre in nombres_catalogos)
+    tipo_resultado.columns = ['CLAVE', 'DESCRIPCIÓN']
+    clasificacion_final.columns = ['CLAVE', 'CLASIFICACIÓN', 'DESCRIPCIÓN']
+
+    cols_entidad = ['ENTIDAD_RES', 'ENTIDAD_UM', 'ENTIDAD_NAC']
+    df['CLAVE_ENTIDAD_RES'] = df['ENTIDAD_RES']
+    df[cols_entidad] = df[cols_entidad].replace(to_replace=entidades['CLAVE_ENTIDAD'].values,
+                                                value=entidades['ENTIDAD_FEDERATIVA'].values)
+    municipios['CLAVE_MUNICIPIO'] = municipios['CLAVE_ENTIDAD'] + municipios['CLAVE_MUNICIPIO']
+    df['MUNICIPIO_RES'] = df['MUNICIPIO_RES'].map(dict(zip(municipios['CLAVE_MUNICIPIO'], municipios['MUNICIPIO'])).get)
+
+    df = df.rename(columns={'RESULTADO_LAB': 'RESULTADO'})
+    tipo_resultado['DESCRIPCIÓN'] = tipo_resultado['DESCRIPCIÓN'].replace(
+        {'POSITIVO A SARS-COV-2': 'Positivo SARS-CoV-2'})
+    df['RESULTADO'] = df['RESULTADO'].map(dict(zip(tipo_resultado['CLAVE'], tipo_resultado['DESCRIPCIÓN'])).get)
+    df['CLASIFICACION_FINAL'] = df['CLASIFICACION_FINAL'].map(
+        dict(zip(clasificacion_final['CLAVE'], clasificacion_final['CLASIFICACIÓN'])).get)
+
+    descriptores = pd.read_excel(descriptores, index_col='Nº', engine='openpyxl')
+    descriptores.columns = [col.replace(' ', '_') for col in descriptores.columns]
+    descriptores['FORMATO_O_FUENTE'] = descriptores.FORMATO_O_FUENTE.str.strip()
+    campos_si_no = list(descriptores.query('FORMATO_O_FUENTE == "CATÁLOGO: SI_ NO"').NOMBRE_DE_VARIABLE)
+    cat_si_no['DESCRIPCIÓN'] = cat_si_no['DESCRIPCIÓN'].str.strip()
+    nuevos_campos_si_no = campos_si_no
+    if resolver_claves == 'agregar':
+        nuevos_campos_si_no = [nombre_var + '_NOM' for nombre_var in campos_si_no]
+    elif resolver_claves == 'si_no_binarias':
+        nuevos_campos_si_no = [nombre_var + '_BIN' for nombre_var in campos_si_no]
+        cat_si_no['DESCRIPCIÓN'] = [1 if valor == 'SI' else 0 for valor in cat_si_no['DESCRIPCIÓN']]
+    df[nuevos_campos_si_no] = df[campos_si_no].replace(to_replace=cat_si_no['CLAVE'].values,
+                                                       value=cat_si_no['DESCRIPCIÓN'].values)
+    df['TIPO_PACIENTE'] = df['TIPO_PACIENTE'].map(dict(zip(cat_tipo_pac['CLAVE'], cat_tipo_pac['DESCRIPCIÓN'])).get)
+    return df
+
+def _valores(serie):
+    # Sólo se comparan los valores: los tipos cambian (categorías, int8) y los faltantes pueden ser None o NaN
+    return [None if pd.isna(valor) else str(valor) for valor in serie.astype(object)]
+
+# El replace original sobre columnas de texto avisa que pandas va a dejar de convertir el resultado a enteros
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+@pytest.mark.parametrize('entidad', [None, '27'])
+@pytest.mark.parametrize('resolver_claves', ['sustitucion', 'agregar', 'si_no_binarias', 'solo_localidades'])
+def test_decodificacion_igual_a_la_original(directorio_datos, tmp_path, resolver_claves, entidad):
+    referencia = decodifica_referencia(directorio_datos, resolver_claves, entidad)
+    df = carga_datos_covid19_MX(FECHA, resolver_claves, entidad, directorio_datos=directorio_datos,
+                                directorio_cache=str(tmp_path))
+    assert len(df) == len(referencia)
+    # Las fechas (y EDAD) las convierte procesa_fechas, no los catálogos
+    columnas = [columna for columna in referencia.columns if not columna.startswith('FECHA_') and columna != 'EDAD']
+    assert not set(columnas) - set(df.columns)
+    for columna in columnas:
+        assert _valores(df[columna]) == _valores(referencia[columna]), columna
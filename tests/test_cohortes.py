@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx.carga import carga_datos_covid19_MX
+from covid19mx.cohortes import IndiceBanderas
+
+from conftest import FECHA
+
+@pytest.fixture(scope='module')
+def df(directorio_datos, tmp_path_factory):
+    return carga_datos_covid19_MX(FECHA, entidad=None, directorio_datos=directorio_datos,
+                                  directorio_cache=str(tmp_path_factory.mktemp('cache')))
+
+@pytest.fixture(scope='module')
+def indice(df):
+    return IndiceBanderas.construye(df)
+
+def _cohortes(df):
+    """
+        Pares (filtros de `IndiceBanderas.mascara`, la misma cohorte como máscara booleana de pandas).
+    """
+    clasificaciones = list(df['CLASIFICACION_FINAL'].value_counts().index)
+    municipios = list(df['CLAVE_MUNICIPIO_RES'].value_counts().index[:20])
+    return [
+        ({}, np.ones(len(df), dtype=bool)),
+        ({'con': ['DIABETES', 'OBESIDAD'], 'edad_min': 60},
+         (df['DIABETES_BIN'] == 1) & (df['OBESIDAD_BIN'] == 1) & (df['EDAD'] >= 60)),
+        ({'con': ['DEFUNCION'], 'sin': ['NEUMONIA'], 'tipo_paciente': ['HOSPITALIZADO'], 'edad_max': 40},
+         (df['DEFUNCION'] == 1) & (df['NEUMONIA_BIN'] != 1) & (df['TIPO_PACIENTE'] == 'HOSPITALIZADO')
+         & (df['EDAD'] <= 40)),
+        # Con dos clasificaciones se comparan códigos, con más de cuatro se indexa una tabla
+        ({'clasificacion': clasificaciones[:2], 'alguna': ['HIPERTENSION', 'EPOC']},
+         df['CLASIFICACION_FINAL'].isin(clasificaciones[:2])
+         & ((df['HIPERTENSION_BIN'] == 1) | (df['EPOC_BIN'] == 1))),
+        ({'clasificacion': clasificaciones[:5], 'municipios': municipios},
+         df['CLASIFICACION_FINAL'].isin(clasificaciones[:5]) & df['CLAVE_MUNICIPIO_RES'].isin(municipios)),
+        ({'desde': '2020-10-01', 'hasta': '2020-12-31', 'columna_fecha': 'FECHA_DEF'},
+         df['FECHA_DEF'].between('2020-10-01', '2020-12-31')),
+    ]
+
+def test_cuenta(df, indice):
+    for filtros, esperado in _cohortes(df):
+        esperado = np.asarray(esperado)
+        assert indice.cuenta(**filtros) == esperado.sum(), filtros
+        np.testing.assert_array_equal(indice.posiciones(**filtros), np.flatnonzero(esperado))
+
+def test_por_municipio(df, indice):
+    for filtros, esperado in _cohortes(df):
+        conteo = df.loc[np.asarray(esperado), 'CLAVE_MUNICIPIO_RES'].astype(str).value_counts()
+        por_municipio = indice.por_municipio(**filtros)
+        assert por_municipio.sum() == conteo.sum()
+        np.testing.assert_array_equal(por_municipio, conteo.reindex(por_municipio.index, fill_value=0))
+
+def test_por_dia(df, indice):
+    filtros, esperado = _cohortes(df)[1]
+    conteo = df.loc[np.asarray(esperado), 'FECHA_INGRESO'].value_counts()
+    por_dia = indice.por_dia(**filtros)
+    assert por_dia.index[0] == conteo.index.min() and por_dia.index[-1] == conteo.index.max()
+    np.testing.assert_array_equal(por_dia, conteo.reindex(por_dia.index, fill_value=0))
+    assert indice.por_dia(edad_min=1000).empty
+
+def test_bandera_desconocida(indice):
+    with pytest.raises(ValueError):
+        indice.cuenta(con=['NO_EXISTE'])
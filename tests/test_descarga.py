@@ -0,0 +1,172 @@
+import io
+import os
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pytest
+
+from covid19mx.descarga import descarga_archivo, bajar_diccionario, bajar_historicos
+
+def _zip(nombre, tam):
+    # Sin comprimir, para que el zip tenga el tamaño pedido
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr(nombre, np.random.default_rng(0).bytes(tam))
+    return buffer.getvalue()
+
+class ServidorPrueba(ThreadingHTTPServer):
+    """
+        Servidor local en lugar del de la DGE: sirve los archivos del diccionario `archivos` (ruta -> bytes), respeta
+        Range y corta la conexión a la mitad del cuerpo la primera vez que se pide cada ruta de `cortar`. Anota cada
+        petición como (ruta, encabezado Range).
+    """
+    daemon_threads = True
+
+    def __init__(self, archivos, cortar=()):
+        super().__init__(('127.0.0.1', 0), ManejadorPrueba)
+        self.archivos = archivos
+        self.cortar = set(cortar)
+        self.peticiones = []
+        self.candado = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class ManejadorPrueba(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        rango = self.headers.get('Range')
+        with self.server.candado:
+            self.server.peticiones.append((self.path, rango))
+            cortar = self.path in self.server.cortar
+            self.server.cortar.discard(self.path)
+        datos = self.server.archivos.get(self.path)
+        if datos is None:
+            self.send_error(404)
+            return
+        inicio = int(rango[len('bytes='):].rstrip('-')) if rango else 0
+        if inicio >= len(datos):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(datos)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if rango else 200)
+        if rango:
+            self.send_header('Content-Range', f'bytes {inicio}-{len(datos) - 1}/{len(datos)}')
+        self.send_header('Content-Length', str(len(datos) - inicio))
+        self.end_headers()
+        if cortar:
+            # Se anuncia el cuerpo completo pero sólo se manda la mitad y se cierra la conexión
+            self.wfile.write(datos[inicio:inicio + (len(datos) - inicio) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(datos[inicio:])
+
+@pytest.fixture
+def servidor():
+    servidores = []
+
+    def inicia(archivos, cortar=()):
+        servidor = ServidorPrueba(archivos, cortar)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        servidores.append(servidor)
+        return servidor
+
+    yield inicia
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+
+def test_continua_descarga_cortada(servidor, tmp_path):
+    datos = _zip('datos.csv', 200_000)
+    local = servidor({'/datos.zip': datos}, cortar=['/datos.zip'])
+    ruta = descarga_archivo(local.url + '/datos.zip', str(tmp_path / 'datos.zip'), tam_bloque=4096)
+    with open(ruta, 'rb') as f:
+        assert f.read() == datos
+    assert not os.path.exists(ruta + '.part')
+    # La segunda petición pide sólo lo que faltaba: desde lo que alcanzó a escribirse, que son bloques completos de
+    # la mitad que se mandó
+    (primera, rango_primera), (segunda, rango) = local.peticiones
+    assert primera == segunda == '/datos.zip' and rango_primera is None
+    assert rango.startswith('bytes=') and rango.endswith('-')
+    assert 0 < int(rango[len('bytes='):-1]) <= len(datos) // 2
+
+def test_continua_part_existente(servidor, tmp_path):
+    datos = _zip('datos.csv', 50_000)
+    local = servidor({'/datos.zip': datos})
+    ruta = str(tmp_path / 'datos.zip')
+    with open(ruta + '.part', 'wb') as f:
+        f.write(datos[:1000])
+    descarga_archivo(local.url + '/datos.zip', ruta)
+    with open(ruta, 'rb') as f:
+        assert f.read() == datos
+    assert local.peticiones == [('/datos.zip', 'bytes=1000-')]
+
+def test_zip_invalido_se_borra(servidor, tmp_path):
+    local = servidor({'/datos.zip': b'no es un zip'})
+    ruta = str(tmp_path / 'datos.zip')
+    with pytest.raises(IOError):
+        descarga_archivo(local.url + '/datos.zip', ruta)
+    assert not os.path.exists(ruta) and not os.path.exists(ruta + '.part')
+
+def test_bajar_historicos(servidor, tmp_path):
+    # Tres fechas: una se corta a la mitad y otra no existe en el servidor
+    rutas = {fecha: f'/historicos/2021/05/datos_abiertos_covid19_{fecha}.zip' for fecha in ['03.05.2021', '05.05.2021']}
+    archivos = {ruta: _zip(f'{fecha}.csv', 100_000) for fecha, ruta in rutas.items()}
+    archivos['/diccionario.zip'] = _zip('201128 Catalogos.xlsx', 1_000)
+    local = servidor(archivos, cortar=[rutas['05.05.2021']])
+    directorio = str(tmp_path)
+
+    def baja():
+        return bajar_historicos('03-05-2021', '05-05-2021', directorio, max_trabajadores=3,
+                                url_historicos=local.url + '/historicos/', url_diccionario=local.url + '/diccionario.zip')
+
+    resultados = baja()
+    assert list(resultados) == ['03-05-2021', '04-05-2021', '05-05-2021']
+    assert resultados['03-05-2021'] == os.path.join(directorio, '210503COVID19MEXICO.csv.zip')
+    assert resultados['05-05-2021'] == os.path.join(directorio, '210505COVID19MEXICO.csv.zip')
+    assert isinstance(resultados['04-05-2021'], Exception)
+    for fecha, ruta in rutas.items():
+        archivo = os.path.join(directorio, f'21{fecha[3:5]}{fecha[:2]}COVID19MEXICO.csv.zip')
+        with open(archivo, 'rb') as f:
+            assert f.read() == archivos[ruta]
+    assert os.path.exists(os.path.join(directorio, '201128 Catalogos.xlsx'))
+    assert [ruta for ruta, _ in local.peticiones].count('/diccionario.zip') == 1
+
+    # La segunda vez sólo se vuelve a pedir la fecha que falló
+    del local.peticiones[:]
+    resultados = baja()
+    assert isinstance(resultados['04-05-2021'], Exception)
+    assert [ruta for ruta, _ in local.peticiones] == ['/historicos/2021/05/datos_abiertos_covid19_04.05.2021.zip']
+
+def test_bajar_diccionario(servidor, tmp_path):
+    diccionario = io.BytesIO()
+    with zipfile.ZipFile(diccionario, 'w') as zip_ref:
+        zip_ref.writestr('201128 Catalogos.xlsx', b'catalogos' * 100)
+        zip_ref.writestr('201128 Descriptores_.xlsx', b'descriptores' * 100)
+    local = servidor({'/diccionario.zip': diccionario.getvalue()})
+    directorio = str(tmp_path)
+    catalogos = os.path.join(directorio, '201128 Catalogos.xlsx')
+    descriptores = os.path.join(directorio, '201128 Descriptores_.xlsx')
+
+    bajar_diccionario(directorio, local.url + '/diccionario.zip')
+    with open(catalogos, 'rb') as f:
+        assert f.read() == b'catalogos' * 100
+    # Con el zip ya bajado, lo que falta o quedó a medias se vuelve a descomprimir sin bajar otra vez
+    os.remove(descriptores)
+    with open(catalogos, 'wb') as f:
+        f.write(b'catal')
+    bajar_diccionario(directorio, local.url + '/diccionario.zip')
+    with open(catalogos, 'rb') as f:
+        assert f.read() == b'catalogos' * 100
+    with open(descriptores, 'rb') as f:
+        assert f.read() == b'descriptores' * 100
+    assert [ruta for ruta, _ in local.peticiones] == ['/diccionario.zip']
@@ -0,0 +1,78 @@
+import pytest
+
+from covid19mx.flujo import EtapaFlujo, Flujo
+
+# Etapas que ejecutó la función de cada etapa, en orden
+EJECUTADAS = []
+
+def base(n, nota=''):
+    EJECUTADAS.append('base')
+    return list(range(n))
+
+def multiplica(base, factor):
+    EJECUTADAS.append('multiplica')
+    return [valor * factor for valor in base]
+
+def suma(base):
+    EJECUTADAS.append('suma')
+    return sum(base)
+
+def total(multiplicados, suma):
+    EJECUTADAS.append('total')
+    return sum(multiplicados) + suma
+
+def _flujo(directorio, n=5, nota='', factor=2):
+    etapas = [EtapaFlujo('base', base, parametros={'n': n, 'nota': nota}),
+              EtapaFlujo('multiplica', multiplica, entradas=['base'], parametros={'factor': factor}),
+              EtapaFlujo('suma', suma, entradas=['base']),
+              EtapaFlujo('total', total, entradas={'multiplicados': 'multiplica', 'suma': 'suma'})]
+    return Flujo(etapas, str(directorio), max_trabajadores=2)
+
+def _corre(flujo, **kwargs):
+    del EJECUTADAS[:]
+    tabla = flujo.corre(**kwargs)
+    assert sorted(EJECUTADAS) == sorted(tabla.index[tabla['estado'] == 'ejecutada'])
+    return set(EJECUTADAS)
+
+def test_solo_corren_las_etapas_afectadas(tmp_path):
+    flujo = _flujo(tmp_path)
+    assert _corre(flujo) == {'base', 'multiplica', 'suma', 'total'}
+    assert flujo.resultado('total') == 20 + 10
+    # Nada cambió: todo sale del cache, también en un flujo nuevo sobre el mismo directorio
+    assert _corre(_flujo(tmp_path)) == set()
+    # Un parámetro de una etapa sólo vuelve a correr esa etapa y las que reciben un resultado distinto
+    flujo = _flujo(tmp_path, factor=3)
+    assert _corre(flujo) == {'multiplica', 'total'}
+    assert flujo.resultado('total') == 30 + 10 and flujo.resultado('suma') == 10
+    # Si la etapa vuelve a dar el mismo resultado, las que dependen de ella no corren
+    assert _corre(_flujo(tmp_path, factor=3, nota='otra')) == {'base'}
+    assert _corre(_flujo(tmp_path, n=4, factor=3)) == {'base', 'multiplica', 'suma', 'total'}
+
+def test_objetivos_y_forzar(tmp_path):
+    flujo = _flujo(tmp_path)
+    assert _corre(flujo, objetivos=['suma']) == {'base', 'suma'}
+    assert _corre(flujo) == {'multiplica', 'total'}
+    assert _corre(flujo, forzar=['suma']) == {'suma'}
+
+def test_archivos(tmp_path):
+    archivo = tmp_path / 'entrada.txt'
+    archivo.write_text('uno')
+    etapas = [EtapaFlujo('base', base, parametros={'n': 3}, archivos=[str(archivo)]),
+              EtapaFlujo('suma', suma, entradas=['base'])]
+    assert _corre(Flujo(etapas, str(tmp_path / 'cache'))) == {'base', 'suma'}
+    # Cambia el contenido del archivo pero no el resultado de la etapa que lo lee
+    archivo.write_text('dos')
+    assert _corre(Flujo(etapas, str(tmp_path / 'cache'))) == {'base'}
+
+def test_dependencias_invalidas(tmp_path):
+    with pytest.raises(ValueError, match='no existen'):
+        Flujo([EtapaFlujo('suma', suma, entradas=['base'])], str(tmp_path))
+    with pytest.raises(ValueError, match='dos etapas'):
+        Flujo([EtapaFlujo('base', base, parametros={'n': 1}), EtapaFlujo('base', base, parametros={'n': 2})],
+              str(tmp_path))
+    ciclo = Flujo([EtapaFlujo('multiplica', multiplica, entradas={'base': 'suma'}, parametros={'factor': 2}),
+                   EtapaFlujo('suma', suma, entradas={'base': 'multiplica'})], str(tmp_path))
+    with pytest.raises(ValueError, match='ciclo'):
+        ciclo.corre()
+    with pytest.raises(KeyError):
+        _flujo(tmp_path).orden(['no_existe'])
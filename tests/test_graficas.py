@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx.graficas import lttb, reduce_curvas
+
+def lttb_referencia(y, puntos):
+    """
+        LTTB de una sola curva tal como lo describe Steinarsson (2013), cubeta por cubeta. Regresa los índices
+        conservados.
+    """
+    n = len(y)
+    tam = (n - 2) / (puntos - 2)
+    escogidos = [0]
+    for i in range(puntos - 2):
+        inicio, fin = int(i * tam) + 1, int((i + 1) * tam) + 1
+        inicio_siguiente, fin_siguiente = fin, min(int((i + 2) * tam) + 1, n)
+        if i == puntos - 3:
+            fin, inicio_siguiente, fin_siguiente = n - 1, n - 1, n
+        x_siguiente = np.arange(inicio_siguiente, fin_siguiente).mean()
+        y_siguiente = y[inicio_siguiente:fin_siguiente].mean()
+        a = escogidos[-1]
+        areas = [abs((a - x_siguiente) * (y[j] - y[a]) - (a - j) * (y_siguiente - y[a])) for j in range(inicio, fin)]
+        escogidos.append(inicio + int(np.argmax(areas)))
+    return escogidos + [n - 1]
+
+@pytest.mark.parametrize('num_dias, puntos', [(500, 50), (101, 100), (1000, 3), (37, 10)])
+def test_lttb(num_dias, puntos):
+    valores = np.random.default_rng(0).normal(size=(5, num_dias)).cumsum(axis=1)
+    conserva = lttb(valores, puntos)
+    assert conserva.shape == valores.shape
+    np.testing.assert_array_equal(conserva.sum(axis=1), puntos)
+    assert conserva[:, 0].all() and conserva[:, -1].all()
+    for curva, mascara in zip(valores, conserva):
+        assert list(np.flatnonzero(mascara)) == lttb_referencia(curva, puntos)
+
+@pytest.mark.parametrize('puntos', [100, 101, 2])
+def test_lttb_sin_reducir(puntos):
+    # Con menos días que puntos (o menos de tres puntos) se conserva todo
+    assert lttb(np.arange(100.0), puntos).all()
+
+def test_lttb_conserva_picos():
+    valores = np.zeros(1000)
+    valores[[123, 640]] = [50, -30]
+    conserva = lttb(valores, 20)[0]
+    assert conserva[123] and conserva[640]
+
+def _curvas(num_curvas, num_dias):
+    fechas = pd.date_range('2020-03-01', periods=num_dias)
+    valores = np.random.default_rng(1).poisson(20, size=(num_curvas, num_dias)).astype(float)
+    curvas = pd.DataFrame({'CLAVE_MUNICIPIO_RES': np.repeat([f'{i:05d}' for i in range(num_curvas)], num_dias),
+                           'Fecha': np.tile(fechas, num_curvas), 'variable': 'Media Móvil',
+                           'value': valores.ravel(), 'Tipo': 'Casos Confirmados'})
+    return curvas.astype({'variable': 'category', 'Tipo': 'category'})
+
+def test_reduce_curvas():
+    curvas = _curvas(40, 400)
+    assert reduce_curvas(curvas, 'CLAVE_MUNICIPIO_RES', max_puntos=len(curvas)) is curvas
+    reducidas = reduce_curvas(curvas, 'CLAVE_MUNICIPIO_RES', max_puntos=8_000)
+    assert list(reducidas.columns) == list(curvas.columns)
+    assert (reducidas.groupby('CLAVE_MUNICIPIO_RES').size() == 200).all()
+    # Los puntos que quedan son puntos de las curvas originales
+    unidas = reducidas.merge(curvas, on=['CLAVE_MUNICIPIO_RES', 'Fecha'], suffixes=('', '_original'))
+    assert len(unidas) == len(reducidas) and (unidas['value'] == unidas['value_original']).all()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx.carga import carga_datos_covid19_MX, rutas_diccionario
+from covid19mx.agregados import curvas_epidemicas, CuboMunicipal
+from covid19mx.particionada import BaseParticionada
+
+from conftest import FECHA
+
+@pytest.fixture(scope='module')
+def base(directorio_datos, tmp_path_factory):
+    # Bloques chicos para que la base quede en varios archivos por entidad, con categorías distintas en cada uno
+    return BaseParticionada.particiona(FECHA, chunksize=3_000, directorio_datos=directorio_datos,
+                                       directorio_particiones=str(tmp_path_factory.mktemp('particiones')))
+
+@pytest.fixture(scope='module')
+def df(directorio_datos):
+    return carga_datos_covid19_MX(FECHA, entidad=None, directorio_datos=directorio_datos)
+
+def test_curvas_nacionales(base, df):
+    pd.testing.assert_frame_equal(base.curvas_epidemicas(), curvas_epidemicas(df))
+
+@pytest.mark.parametrize('nivel', ['ENTIDAD_RES', 'CLAVE_MUNICIPIO_RES'])
+def test_curvas_por_nivel(base, df, nivel):
+    pd.testing.assert_frame_equal(base.curvas_epidemicas(nivel=nivel), curvas_epidemicas(df, nivel=nivel))
+
+def test_curvas_de_entidades(base, df):
+    entidades = ['27', '09']
+    esperado = curvas_epidemicas(df[df['CLAVE_ENTIDAD_RES'].isin(entidades)], nivel='CLAVE_MUNICIPIO_RES')
+    pd.testing.assert_frame_equal(base.curvas_epidemicas(nivel='CLAVE_MUNICIPIO_RES', entidades=entidades), esperado)
+
+def test_cubo(base, df):
+    cubo = base.cubo()
+    esperado = CuboMunicipal.construye(df)
+    np.testing.assert_array_equal(cubo.acumulado, esperado.acumulado)
+    for nombre in ['inicio', 'columna_fecha', 'municipios', 'clasificaciones', 'tipos_paciente']:
+        assert cubo.etiquetas[nombre] == esperado.etiquetas[nombre]
+
+def test_aplanados(base, df):
+    # Los registros quedan en otro orden, pero son los mismos
+    aplanados = base.aplanados()
+    assert list(aplanados.columns) == list(df.columns)
+    llave = ['ID_REGISTRO']
+    izquierda = aplanados.sort_values(llave).reset_index(drop=True)
+    derecha = df.sort_values(llave).reset_index(drop=True)
+    # Las categorías de cada columna dependen de los bloques en que se leyó, sólo se comparan los valores
+    pd.testing.assert_frame_equal(izquierda, derecha, check_categorical=False)
+
+def test_cubo_sin_registros(base):
+    # Ninguna entidad de residencia tiene la clave 98
+    with pytest.raises(ValueError, match='FECHA_INGRESO'):
+        base.cubo(entidades=['98'])
+
+def test_csv_sin_registros(directorio_datos, tmp_path):
+    # Un zip con sólo el encabezado del CSV, con el diccionario de la publicación sintética
+    directorio = str(tmp_path) + '/'
+    with zipfile.ZipFile(os.path.join(directorio_datos, f'{FECHA}COVID19MEXICO.csv.zip')) as zip_ref:
+        with zip_ref.open(zip_ref.namelist()[0]) as f:
+            encabezado = f.readline()
+    with zipfile.ZipFile(os.path.join(directorio, f'{FECHA}COVID19MEXICO.csv.zip'), 'w') as zip_ref:
+        zip_ref.writestr(f'{FECHA}COVID19MEXICO.csv', encabezado)
+    for ruta in rutas_diccionario(directorio_datos):
+        shutil.copy(ruta, directorio)
+    with pytest.raises(ValueError, match='no tiene registros'):
+        BaseParticionada.particiona(FECHA, directorio_datos=directorio)
+    assert not os.path.exists(os.path.join(directorio, 'particiones'))
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx import retrasos
+from covid19mx.carga import CLAVES_ENTIDAD, rutas_diccionario
+from covid19mx.retrasos import SERIES_TRIANGULO, TrianguloRetrasos, conteos_publicacion
+from covid19mx.sinteticos import genera_diccionario
+
+from conftest import FECHA
+
+TIPO = 'Casos Confirmados'
+INICIO = np.datetime64('2020-12-30', 'D').astype(np.int64)
+
+# Registros de la entidad '01' por día del evento desde 2020-12-30 según cada publicación; la entidad '27' tiene diez
+# veces esos registros y las demás ninguno
+CONOCIDOS = {'210101': [2, 1, 1],
+             '210102': [4, 3, 2, 1],
+             '210103': [5, 6, 3, 2, 1]}
+
+def _conteos(conocidos):
+    conteo = np.zeros((len(CLAVES_ENTIDAD), len(conocidos)), dtype=np.int32)
+    conteo[CLAVES_ENTIDAD.index('01')] = conocidos
+    conteo[CLAVES_ENTIDAD.index('27')] = np.array(conocidos) * 10
+    return {TIPO: (int(INICIO), conteo)}
+
+@pytest.fixture
+def triangulo():
+    return TrianguloRetrasos.de_conteos({fecha: _conteos(conocidos) for fecha, conocidos in CONOCIDOS.items()},
+                                        {TIPO: SERIES_TRIANGULO[TIPO]})
+
+def test_triangulo(triangulo):
+    nan = np.nan
+    esperado = np.array([[2, 4, 5],
+                         [1, 3, 6],
+                         [1, 2, 3],
+                         [nan, 1, 2],
+                         [nan, nan, 1]])
+    tabla = triangulo.triangulo(TIPO, entidad='01')
+    assert list(tabla.index) == list(pd.date_range('2020-12-30', '2021-01-03'))
+    assert list(tabla.columns) == list(pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-03']))
+    np.testing.assert_array_equal(tabla.to_numpy(), esperado)
+    np.testing.assert_array_equal(triangulo.triangulo(TIPO).to_numpy(), esperado * 11)
+    np.testing.assert_array_equal(triangulo.triangulo(TIPO, entidad=['01', '27']).to_numpy(), esperado * 11)
+
+def test_por_retraso(triangulo):
+    nan = np.nan
+    # No hay publicación del 2020-12-30 ni del 2020-12-31, ni posterior al 2021-01-03
+    esperado = np.array([[nan, nan, 2, 4],
+                         [nan, 1, 3, 6],
+                         [1, 2, 3, nan],
+                         [1, 2, nan, nan],
+                         [1, nan, nan, nan]])
+    tabla = triangulo.por_retraso(TIPO, entidad='01', max_retraso=3)
+    assert list(tabla.columns) == [0, 1, 2, 3]
+    np.testing.assert_array_equal(tabla.to_numpy(), esperado)
+
+def test_nowcast(triangulo):
+    # Factores: de retraso 0 a 1, (2 + 2) / (1 + 1) = 2 con los eventos del 01-01 y 01-02; de 1 a 2, (3 + 3) / (1 + 2)
+    # = 2 con los del 12-31 y 01-01. A cada día le faltan los factores de los retrasos que no ha cumplido
+    nowcast = triangulo.nowcast(TIPO, entidad='01', max_retraso=2)
+    np.testing.assert_array_equal(nowcast['Observado'], [5, 6, 3, 2, 1])
+    np.testing.assert_array_equal(nowcast['Retraso'], [4, 3, 2, 1, 0])
+    np.testing.assert_allclose(nowcast['Estimado'], [5, 6, 3, 2 * 2, 1 * 2 * 2])
+    # Sólo con los días más recientes de referencia: el factor de 1 a 2 queda en 3 / 2
+    nowcast = triangulo.nowcast(TIPO, entidad='01', max_retraso=2, referencia=1)
+    np.testing.assert_allclose(nowcast['Estimado'], [5, 6, 3, 2 * 1.5, 1 * 2 * 1.5])
+
+def test_guarda_y_abre(triangulo, tmp_path):
+    triangulo.guarda(str(tmp_path))
+    abierto = TrianguloRetrasos.abre(str(tmp_path))
+    pd.testing.assert_frame_equal(abierto.triangulo(TIPO), triangulo.triangulo(TIPO))
+
+def test_cache_de_conteos(directorio_datos, tmp_path, monkeypatch):
+    directorio = str(tmp_path) + '/'
+    for ruta in [f'{FECHA}COVID19MEXICO.csv.zip', *rutas_diccionario(directorio_datos)]:
+        shutil.copy(os.path.join(directorio_datos, os.path.basename(ruta)), directorio)
+    llamadas = []
+    cuenta_publicacion = retrasos.cuenta_publicacion
+
+    def cuenta(*args, **kwargs):
+        llamadas.append(args[0])
+        return cuenta_publicacion(*args, **kwargs)
+
+    monkeypatch.setattr(retrasos, 'cuenta_publicacion', cuenta)
+    primeros = conteos_publicacion(FECHA, directorio)
+    segundos = conteos_publicacion(FECHA, directorio)
+    assert len(llamadas) == 1
+    assert list(segundos) == list(primeros) == list(SERIES_TRIANGULO)
+    for tipo, (inicio, conteo) in primeros.items():
+        assert segundos[tipo][0] == inicio
+        np.testing.assert_array_equal(segundos[tipo][1], conteo)
+        assert conteo.shape[0] == len(CLAVES_ENTIDAD) and conteo.sum() > 0
+
+    # El mismo catálogo con otra fecha de modificación no invalida el cache; uno distinto sí
+    catalogos, _ = rutas_diccionario(directorio)
+    os.utime(catalogos, ns=(os.stat(catalogos).st_atime_ns, os.stat(catalogos).st_mtime_ns + 10 ** 9))
+    conteos_publicacion(FECHA, directorio)
+    assert len(llamadas) == 1
+    genera_diccionario(directorio, semilla=1)
+    conteos_publicacion(FECHA, directorio)
+    assert len(llamadas) == 2
@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from covid19mx.servicio import ServicioConsultas, CacheLRU, poblacion_municipios
+
+from conftest import FECHA
+
+async def _pide(puerto, peticion):
+    """
+        Manda `peticion` (bytes) en una conexión nueva y regresa (código HTTP, cuerpo JSON).
+    """
+    lector, escritor = await asyncio.open_connection('127.0.0.1', puerto)
+    escritor.write(peticion)
+    await escritor.drain()
+    respuesta = await asyncio.wait_for(lector.read(), 30)
+    escritor.close()
+    encabezado, _, cuerpo = respuesta.partition(b'\r\n\r\n')
+    return int(encabezado.split()[1]), json.loads(cuerpo)
+
+def _peticion(metodo, ruta, encabezados=''):
+    return f'{metodo} {ruta} HTTP/1.1\r\nHost: prueba\r\nConnection: close\r\n{encabezados}\r\n'.encode('latin-1')
+
+def _corre(servicio, prueba):
+    # Levanta el servidor en un puerto libre, corre la corrutina prueba(puerto) y lo cierra
+    async def principal():
+        servidor = await servicio.inicia(puerto=0)
+        try:
+            return await prueba(servidor.sockets[0].getsockname()[1])
+        finally:
+            servidor.close()
+            await servidor.wait_closed()
+    return asyncio.run(principal())
+
+@pytest.fixture(scope='module')
+def servicio(directorio_datos):
+    servicio = ServicioConsultas(directorio_datos, entidad='27')
+    servicio.ingiere(FECHA)
+    return servicio
+
+def test_sin_publicacion(directorio_datos):
+    async def prueba(puerto):
+        estado, cuerpo = await _pide(puerto, _peticion('GET', '/curvas'))
+        assert estado == 503 and 'error' in cuerpo
+        estado, cuerpo = await _pide(puerto, _peticion('GET', '/estado'))
+        assert estado == 200 and cuerpo['publicacion'] is None
+    _corre(ServicioConsultas(directorio_datos), prueba)
+
+@pytest.mark.parametrize('consulta', ['defuncion=2', 'defuncion=-1', 'metrica=ultimos_dias&dias=0',
+                                      'metrica=ultimos_dias&dias=-3', 'dias=x', 'metrica=otra'])
+def test_municipios_parametros_invalidos(servicio, consulta):
+    async def prueba(puerto):
+        return await _pide(puerto, _peticion('GET', f'/municipios?{consulta}'))
+    estado, cuerpo = _corre(servicio, prueba)
+    assert estado == 400 and 'error' in cuerpo
+
+def test_municipios(servicio):
+    async def prueba(puerto):
+        return [await _pide(puerto, _peticion('GET', f'/municipios?{consulta}'))
+                for consulta in ['defuncion=0', 'defuncion=1', '']]
+    (estado_vivos, vivos), (estado_muertos, muertos), (estado_todos, todos) = _corre(servicio, prueba)
+    assert estado_vivos == estado_muertos == estado_todos == 200
+    total = {renglon['CLAVE_MUNICIPIO_RES']: renglon['valor'] for renglon in todos['datos']}
+    for vivo, muerto in zip(vivos['datos'], muertos['datos']):
+        assert vivo['valor'] + muerto['valor'] == total[vivo['CLAVE_MUNICIPIO_RES']]
+    assert sum(total.values()) == len(servicio.instantanea.df)
+
+def test_tasa(directorio_datos, servicio):
+    # Sin población la tasa es un error; con la del GeoJson es acumulados / pob2020 * 100,000, y nula en los
+    # municipios que no están en el GeoJson (999, no especificado)
+    async def prueba(puerto):
+        return [await _pide(puerto, _peticion('GET', f'/municipios?metrica={metrica}'))
+                for metrica in ['tasa', 'acumulados']]
+    (estado, cuerpo), _ = _corre(servicio, prueba)
+    assert estado == 400 and 'error' in cuerpo
+
+    poblacion = poblacion_municipios(os.path.join(directorio_datos, 'municipios_pob_2020_simple.json'))
+    con_poblacion = ServicioConsultas(directorio_datos, entidad='27', poblacion=poblacion)
+    con_poblacion.ingiere(FECHA)
+    (estado_tasa, tasas), (estado_acumulados, acumulados) = _corre(con_poblacion, prueba)
+    assert estado_tasa == estado_acumulados == 200
+    casos = {renglon['CLAVE_MUNICIPIO_RES']: renglon['valor'] for renglon in acumulados['datos']}
+    assert tasas['datos'] and len(tasas['datos']) == len(casos)
+    for renglon in tasas['datos']:
+        clave = renglon['CLAVE_MUNICIPIO_RES']
+        if clave in poblacion.index:
+            assert renglon['valor'] == pytest.approx(casos[clave] / poblacion[clave] * 100000)
+        else:
+            assert renglon['valor'] is None
+
+@pytest.mark.parametrize('encabezado, codigo', [('Content-Length: abc', 400), ('Content-Length: -5', 400),
+                                                ('Content-Length: 99999999', 413),
+                                                ('X-Relleno: ' + 'a' * 10_000, 431)])
+def test_peticion_invalida(servicio, encabezado, codigo):
+    async def prueba(puerto):
+        return await _pide(puerto, _peticion('GET', '/estado', encabezado + '\r\n'))
+    estado, cuerpo = _corre(servicio, prueba)
+    assert estado == codigo and 'error' in cuerpo
+
+def test_cache_se_vacia_al_ingerir(servicio):
+    consulta = _peticion('GET', '/curvas?tipo=Defunciones&metrica=Conteo')
+
+    async def prueba(puerto):
+        _, primera = await _pide(puerto, consulta)
+        aciertos = servicio.cache.aciertos
+        _, segunda = await _pide(puerto, consulta)
+        assert servicio.cache.aciertos == aciertos + 1 and segunda == primera
+
+        version = servicio.instantanea.version
+        estado, cuerpo = await _pide(puerto, _peticion('POST', f'/ingiere?fecha={FECHA}'))
+        assert estado == 200 and cuerpo['cache']['entradas'] == 0
+        assert servicio.instantanea.version == version + 1
+
+        fallos = servicio.cache.fallos
+        _, tercera = await _pide(puerto, consulta)
+        assert servicio.cache.fallos == fallos + 1 and tercera == primera
+    _corre(servicio, prueba)
+
+def test_cache_lru():
+    cache = CacheLRU(maximo=2)
+    cache.guarda('a', 1)
+    cache.guarda('b', 2)
+    assert cache.obten('a') == 1
+    # 'b' es la que se usó hace más tiempo
+    cache.guarda('c', 3)
+    assert cache.obten('b') is None and cache.obten('a') == 1 and cache.obten('c') == 3
+    assert (cache.aciertos, cache.fallos) == (3, 1)
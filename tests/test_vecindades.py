@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19mx.vecindades import PesosEspaciales
+
+CLAVES = ['a', 'b', 'c', 'd']
+
+@pytest.fixture
+def camino():
+    # a - b - c - d
+    indptr = np.array([0, 1, 3, 5, 6])
+    indices = np.array([1, 0, 2, 1, 3, 2], dtype=np.int32)
+    return PesosEspaciales(indptr, indices, {'claves': CLAVES})
+
+def test_vecinos(camino):
+    assert camino.vecinos('a') == ['b'] and camino.vecinos('c') == ['b', 'd']
+    np.testing.assert_array_equal(camino.grados, [1, 2, 2, 1])
+    sub = camino.subconjunto(['b', 'c', 'd'])
+    assert sub.vecinos('b') == ['c'] and sub.vecinos('d') == ['c']
+
+def test_moran_global(camino):
+    # z = (-1.5, -0.5, 0.5, 1.5), Σ z² = 5; con pesos por renglón Σ w_ij z_i z_j = 0.75 + 0.25 + 0.25 + 0.75 = 2,
+    # e I = (n / S0) Σ w_ij z_i z_j / Σ z² = 2 / 5
+    assert camino.moran_global(pd.Series([1, 2, 3, 4], index=CLAVES)) == pytest.approx(0.4)
+    # Valores alternados: cada vecino está del otro lado del promedio
+    assert camino.moran_global(pd.Series([1, 0, 1, 0], index=CLAVES)) == pytest.approx(-1)
+    # El orden de la Series no importa, se alinea por clave
+    assert camino.moran_global(pd.Series([4, 3, 2, 1], index=CLAVES[::-1])) == pytest.approx(0.4)
+
+def test_rezago_y_promedio(camino):
+    valores = pd.Series([1.0, 2.0, np.nan, 4.0], index=CLAVES)
+    np.testing.assert_allclose(camino.rezago(valores), [2, 1, 3, np.nan])
+    np.testing.assert_allclose(camino.promedio_vecinos(valores), [1.5, 1.5, 3, 4])
+
+def test_tasa_bayes_empirica_global(camino):
+    poblacion = pd.Series([1_000, 10_000, 100_000, 1_000_000], index=CLAVES)
+    casos = pd.Series([50, 20, 3_000, 10_000], index=CLAVES)
+    cruda = casos / poblacion
+    referencia = casos.sum() / poblacion.sum()
+    tasa = camino.tasa_bayes_empirica(casos, poblacion, por=1, local=False)
+
+    # Estimador de Marshall: peso = a / (a + b / p_i), con a = s² - b / (P / n)
+    varianza = (poblacion * (cruda - referencia) ** 2).sum() / poblacion.sum()
+    a = varianza - referencia / (poblacion.sum() / len(poblacion))
+    peso = a / (a + referencia / poblacion)
+    pd.testing.assert_series_equal(tasa, peso * cruda + (1 - peso) * referencia, check_names=False)
+
+    # Cada tasa queda entre la cruda y la global, y se acerca más a la global cuanto menor es la población
+    encogimiento = (tasa - referencia) / (cruda - referencia)
+    assert ((encogimiento > 0) & (encogimiento <= 1)).all()
+    assert encogimiento.is_monotonic_increasing
+
+def test_tasa_bayes_empirica_casos_limite(camino):
+    poblacion = pd.Series([1_000, 10_000, 100_000, 1_000_000], index=CLAVES)
+    # Sin varianza más allá de la de Poisson todas las tasas son la global
+    tasa = camino.tasa_bayes_empirica(poblacion / 100, poblacion, local=False)
+    np.testing.assert_allclose(tasa, 1000)
+    # Un municipio sin población no tiene tasa ni cuenta en la referencia de los demás
+    sin_d = poblacion.drop('d')
+    tasa = camino.tasa_bayes_empirica(pd.Series([50, 20, 3_000, 10_000], index=CLAVES), sin_d, por=1)
+    assert np.isnan(tasa['d']) and not tasa[['a', 'b', 'c']].isna().any()
@@ -56,26 +56,20 @@ La instalación de dependencias en Colab es relativamente sencilla, el caso de G
 # !pip install plotly_express
 # !pip install mapclassify
 
-"""Ahora vamos a importar de una vez todas las dependencias que vamos a usar en el resto del notebook"""
-
-import os
-import glob
-import itertools
-from pathlib import Path
-import zipfile
-import numpy as np
+"""Las funciones que usamos a lo largo del notebook están en el paquete `covid19mx` de este repositorio, separado en módulos: descarga (`covid19mx.descarga`), lectura y *aplanado* (`covid19mx.carga`), agregados (`covid19mx.agregados`), gráficas (`covid19mx.graficas`) y mapas (`covid19mx.mapas`). Cada módulo carga sus dependencias sólo cuando se usa, así que un proceso que sólo baja datos o calcula conteos no tiene que importar geopandas, folium ni plotly. En Colab basta con clonar el repositorio y agregarlo al *path*.
+
+Ahora vamos a importar de una vez las dependencias que usamos directamente en el resto del notebook"""
+
+# Commented out IPython magic to ensure Python compatibility.
+# !git clone https://github.com/jdanifalcon/sig-bigdata-python-covid19.git
+# import sys
+# sys.path.append('/content/sig-bigdata-python-covid19')
+
+from datetime import timedelta, datetime
 import pandas as pd
-import geopandas as gpd
-from datetime import timedelta, date, datetime
-import csv
-import openpyxl
-import requests
 import plotly.express as px
-import mapclassify
 import folium
 
-import logging
-
 """## Descargar datos
 
 El primer paso es, evidentemente, descargar los datos. Es claro que podríamos ir a la [página](https://www.gob.mx/salud/documentos/datos-abiertos-152127) de la Dirección General de Epidemiología (DGE) y descargarlos, sin embargo, lo vamos a hacer por el camino difícil de bajarlos usando Python.
@@ -90,47 +84,36 @@ Para trabajar vamos siempre a descargar tres archivos:
 
 El primer archivo contiene la serie de tiempo de seguimiento de casos hasta la fecha configurada, los dos archivos restantes sirven para entender la información contenida en los datos.
 
-Entonces, primero definimos la función
+Entonces, primero importamos la función (está en `covid19mx.descarga`). Los archivos son de varios cientos de MB, así que se bajan por bloques a un archivo temporal que sólo se renombra cuando la descarga terminó y el zip está completo; si la descarga se interrumpe, la siguiente vez se continúa desde donde se quedó.
 """
 
-def bajar_datos_salud(directorio_datos='/content/', fecha='05-05-2021'):
-    '''
-        Descarga el archivo de datos y los diccionarios para la fecha solicitada.
-    '''
-    fecha = datetime.strptime(fecha, "%d-%m-%Y")
-    url_salud_historicos = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/historicos/'    
-    archivo_nombre = f'{fecha.strftime("%y%m%d")}COVID19MEXICO.csv.zip'
-    archivo_ruta = os.path.join(directorio_datos, archivo_nombre)
-    url_diccionario = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/diccionario_datos_covid19.zip'
-    diccionario_ruta = os.path.join(directorio_datos, 'diccionario.zip')
-    if os.path.exists(archivo_ruta):
-        logging.debug(f'Ya existe {archivo_nombre}')
-    else:
-        print(f'Bajando datos {fecha.strftime("%d.%m.%Y")}')
-        url_dia = "{}/{}/datos_abiertos_covid19_{}.zip".format(fecha.strftime('%Y'),
-                                                                fecha.strftime('%m'),
-                                                                fecha.strftime('%d.%m.%Y'))
-        url = url_salud_historicos + url_dia
-        r = requests.get(url, allow_redirects=True)
-        open(archivo_ruta, 'wb').write(r.content)
-        r = requests.get(url_diccionario, allow_redirects=True)
-        open(diccionario_ruta, 'wb').write(r.content)
-        with zipfile.ZipFile(diccionario_ruta, 'r') as zip_ref:
-          zip_ref.extractall(directorio_datos)
+from covid19mx.descarga import bajar_datos_salud, bajar_historicos
 
 """Con la función que acabamos de definir, podemos bajar los datos hasta la última fecha disponible"""
 
 ayer = datetime.now() - timedelta(1)
 bajar_datos_salud(fecha=ayer.strftime('%d-%m-%Y'))
 
+"""Si necesitamos varias publicaciones (por ejemplo, para comparar cómo cambian los datos de un día a otro), `bajar_historicos` baja un rango de fechas en paralelo:
+
+```python
+bajar_historicos('01-05-2021', '31-05-2021', max_trabajadores=4)
+```
+"""
+
 """## Exploración del contenido
 
 Antes de empezar a manipular los datos, lo primero que tenemos que hacer es explorarlos brevemente y entender cómo están guardados. Leamos los datos en un DataFrame.
 
 Fíjense en la ruta en donde la función de arriba descarga los datos, con la barra exploradora del lado izquierdo pueden navegar hasta esa ruta y copiar el *path*
+
+Si dejamos que Pandas lea todo como texto (`dtype=object`), cada celda es un *string* de Python que ocupa decenas de bytes. Como casi todas las columnas son claves numéricas pequeñas (1, 2, 97, 98, 99), conviene decirle desde la lectura el tipo de cada columna: enteros chicos para las claves y la edad, categorías para las claves de entidad y municipio y fechas para los campos `FECHA_*` (la fecha `9999-99-99` significa que no hay fecha y la leemos como `NaT`). Así la memoria que ocupa la base baja alrededor de un orden de magnitud.
 """
 
-df = pd.read_csv('/content/210713COVID19MEXICO.csv.zip', dtype=object, encoding='latin-1')
+from covid19mx.carga import ESQUEMA_DGE, convierte_fechas
+
+df = pd.read_csv('/content/210713COVID19MEXICO.csv.zip', dtype=ESQUEMA_DGE, encoding='latin-1')
+df = convierte_fechas(df)
 df
 
 """Cada renglón en la base de datos corresponde a un caso en *seguimiento*, el resultado de cada caso se puede actualizar en sucesivas publicaciones de la base de datos. Las columnas describen un conjunto de variables asociadas al seguimiento de cada uno de los casos. Las dos primeras columnas corresponden a la fecha en la que se actualizó el caso y a un id único para cada caso respectivamente, en este taller no vamos a usar esas dos columnas.
@@ -167,147 +150,43 @@ Como ya vimos, la información viene codificada, entonces para utilizarla con m
 Para eso vamos a utilizar dos funciones, una que carga los datos que acabamos de bajar y llena los campos a partir de la información que viene en los catálogos y descriptores y otra que simplemente procesa las fechas para tenerlas en un formato más amistoso.
 
 La función también toma un argumento opcional para seleccionar una entidad en específico. En este caso siempre vamos a seleccionar alguna entidad, ya que la base completa es demasiado grande para procesarla en Colab. Noten cómo la selección de la entidad se hace sobre la entidad de residencia del paciente (campo `ENTIDAD_RES`), esto quiere decir que, para cada estado sólo estamos tomando los pacientes que residen en el.
+
+Como el archivo nacional es tan grande, la función puede leerlo por bloques (argumentos `chunksize` o `memoria_max_mb`): cada bloque se descomprime, se filtra por entidad y columnas y sólo se guarda lo que sobrevive al filtro, de esta forma nunca tenemos en memoria la base completa.
 """
 
-def carga_datos_covid19_MX(fecha='210505', resolver_claves='si_no_binarias', entidad='27'):
-    """
-        Lee en un DataFrame el CSV con el reporte de casos de la Secretaría de Salud de México publicado en una fecha dada. Esta función
-        también lee el diccionario de datos que acompaña a estas publicaciones para preparar algunos campos, en particular permite la funcionalidad
-        de generar columnas binarias para datos con valores 'SI', 'No'.
-
-        **Nota**: En esta versión la ruta esta y nombre de los archivos es fija. Asumimos que existe un directorio '/content/'
-        donde se encuentran todos los archivos.
-
-        **Nota 2**: Por las actualizaciones a los formatos de datos, esta función sólo va a servir para archivos posteriores a 20-11-28
-
-        resolver_claves: 'sustitucion', 'agregar', 'si_no_binarias', 'solo_localidades'. Resuelve los valores del conjunto de datos usando el
-        diccionario de datos y los catálogos. 'sustitucion' remplaza los valores en las columnas, 'agregar'
-        crea nuevas columnas. 'si_no_binarias' cambia valores SI, NO, No Aplica, SE IGNORA, NO ESPECIFICADO por 1, 0, 0, 0, 0 respectivamente.
-
-    """
-    fecha_formato = '201128'
-    nuevo_formato = True
-    fecha_carga = pd.to_datetime(fecha, yearfirst=True)
-    if fecha_carga < datetime.strptime('20-11-28', "%y-%m-%d"):
-      raise ValueError('La fecha debe ser posterior a 20-11-28.')
-    
-    catalogos=f'/content/{fecha_formato} Catalogos.xlsx'
-    descriptores=f'/content/{fecha_formato} Descriptores.xlsx'    
-    data_file = os.path.join('/content/', f'{fecha}COVID19MEXICO.csv.zip')
-    df = pd.read_csv(data_file, dtype=object, encoding='latin-1')
-    if entidad is not None:
-      df = df[df['ENTIDAD_RES'] == entidad]
-    # Hay un error y el campo OTRA_COMP es OTRAS_COMP según los descriptores
-    df.rename(columns={'OTRA_COM': 'OTRAS_COM'}, inplace=True)
-    # Asignar clave única a municipios
-    df['MUNICIPIO_RES'] = df['ENTIDAD_RES'] + df['MUNICIPIO_RES']
-    df['CLAVE_MUNICIPIO_RES'] = df['MUNICIPIO_RES']
-    # Leer catalogos
-    nombres_catalogos = ['Catálogo de ENTIDADES',
-                         'Catálogo MUNICIPIOS',
-                         'Catálogo RESULTADO',
-                         'Catálogo SI_NO',
-                         'Catálogo TIPO_PACIENTE']
-    if nuevo_formato:
-        nombres_catalogos.append('Catálogo CLASIFICACION_FINAL')
-        nombres_catalogos[2] = 'Catálogo RESULTADO_LAB'
-
-    dict_catalogos = pd.read_excel(catalogos,
-                              nombres_catalogos,
-                              dtype=str,
-                              engine='openpyxl')
-
-    entidades = dict_catalogos[nombres_catalogos[0]]
-    municipios = dict_catalogos[nombres_catalogos[1]]
-    tipo_resultado = dict_catalogos[nombres_catalogos[2]]
-    cat_si_no = dict_catalogos[nombres_catalogos[3]]
-    cat_tipo_pac = dict_catalogos[nombres_catalogos[4]]
-    # Arreglar los catálogos que tienen mal las primeras líneas
-    dict_catalogos[nombres_catalogos[2]].columns = ["CLAVE", "DESCRIPCIÓN"]
-    dict_catalogos[nombres_catalogos[5]].columns = ["CLAVE", "CLASIFICACIÓN", "DESCRIPCIÓN"]
-
-    if nuevo_formato:
-        clasificacion_final = dict_catalogos[nombres_catalogos[5]]
-
-
-    # Resolver códigos de entidad federal
-    cols_entidad = ['ENTIDAD_RES', 'ENTIDAD_UM', 'ENTIDAD_NAC']
-    df['CLAVE_ENTIDAD_RES'] = df['ENTIDAD_RES']
-    df[cols_entidad] = df[cols_entidad].replace(to_replace=entidades['CLAVE_ENTIDAD'].values,
-                                               value=entidades['ENTIDAD_FEDERATIVA'].values)
-
-    # Construye clave unica de municipios de catálogo para resolver nombres de municipio
-    municipios['CLAVE_MUNICIPIO'] = municipios['CLAVE_ENTIDAD'] + municipios['CLAVE_MUNICIPIO']
-
-    # Resolver códigos de municipio
-    municipios_dict = dict(zip(municipios['CLAVE_MUNICIPIO'], municipios['MUNICIPIO']))
-    df['MUNICIPIO_RES'] = df['MUNICIPIO_RES'].map(municipios_dict.get)
-
-    # Resolver resultados
-    if nuevo_formato:
-        df.rename(columns={'RESULTADO_LAB': 'RESULTADO'}, inplace=True)
-        tipo_resultado['DESCRIPCIÓN'].replace({'POSITIVO A SARS-COV-2': 'Positivo SARS-CoV-2'}, inplace=True)
-
-    tipo_resultado = dict(zip(tipo_resultado['CLAVE'], tipo_resultado['DESCRIPCIÓN']))
-    df['RESULTADO'] = df['RESULTADO'].map(tipo_resultado.get)
-    clasificacion_final = dict(zip(clasificacion_final['CLAVE'], clasificacion_final['CLASIFICACIÓN']))
-    df['CLASIFICACION_FINAL'] = df['CLASIFICACION_FINAL'].map(clasificacion_final.get)
-    # Resolver datos SI - NO
-
-    # Necesitamos encontrar todos los campos que tienen este tipo de dato y eso
-    # viene en los descriptores, en el campo FORMATO_O_FUENTE
-    descriptores = pd.read_excel('/content/201128 Descriptores_.xlsx',
-                                 index_col='Nº',
-                                 engine='openpyxl')
-    descriptores.columns = list(map(lambda col: col.replace(' ', '_'), descriptores.columns))
-    descriptores['FORMATO_O_FUENTE'] = descriptores.FORMATO_O_FUENTE.str.strip()
-
-    datos_si_no = descriptores.query('FORMATO_O_FUENTE == "CATÁLOGO: SI_ NO"')
-    cat_si_no['DESCRIPCIÓN'] = cat_si_no['DESCRIPCIÓN'].str.strip()
-
-    campos_si_no = datos_si_no.NOMBRE_DE_VARIABLE
-    nuevos_campos_si_no = campos_si_no
-
-    if resolver_claves == 'agregar':
-        nuevos_campos_si_no = [nombre_var + '_NOM' for nombre_var in campos_si_no]
-    elif resolver_claves == 'si_no_binarias':
-        nuevos_campos_si_no = [nombre_var + '_BIN' for nombre_var in campos_si_no]
-        cat_si_no['DESCRIPCIÓN'] = list(map(lambda val: 1 if val == 'SI' else 0, cat_si_no['DESCRIPCIÓN']))
-
-    df[nuevos_campos_si_no] = df[datos_si_no.NOMBRE_DE_VARIABLE].replace(
-                                                to_replace=cat_si_no['CLAVE'].values,
-                                                value=cat_si_no['DESCRIPCIÓN'].values)
-
-    # Resolver tipos de paciente
-    cat_tipo_pac = dict(zip(cat_tipo_pac['CLAVE'], cat_tipo_pac['DESCRIPCIÓN']))
-    df['TIPO_PACIENTE'] = df['TIPO_PACIENTE'].map(cat_tipo_pac.get)
-
-    df = procesa_fechas(df)
-
-    return df
-
-def procesa_fechas(covid_df):
-    df = covid_df.copy()
-
-    df['FECHA_INGRESO'] = pd.to_datetime(df['FECHA_INGRESO'])
-    df['FECHA_SINTOMAS'] = pd.to_datetime(df['FECHA_SINTOMAS'])
-    df['FECHA_DEF'] = pd.to_datetime(df['FECHA_DEF'], 'coerce')
-    df['DEFUNCION'] = (df['FECHA_DEF'].notna()).astype(int)
-    df['EDAD'] = df['EDAD'].astype(int)
-
-    df.set_index('FECHA_INGRESO', drop=False, inplace=True)
-    df['AÑO_INGRESO'] = df.index.year
-    df['MES_INGRESO'] = df.index.month
-    df['DIA_SEMANA_INGRESO'] = df.index.weekday
-    df['SEMANA_AÑO_INGRESO'] = df.index.week
-    df['DIA_MES_INGRESO'] = df.index.day
-    df['DIA_AÑO_INGRESO'] = df.index.dayofyear
-
-    return df
-
-aplanados = carga_datos_covid19_MX(fecha=ayer.strftime('%y%m%d'), entidad='27')
+from covid19mx.carga import carga_datos_covid19_MX
+
+aplanados = carga_datos_covid19_MX(fecha=ayer.strftime('%y%m%d'), entidad='27', chunksize=500_000)
 aplanados
 
+"""### Varias publicaciones: ingesta incremental
+
+Cada publicación de la DGE trae otra vez *todos* los registros, aunque la mayoría no cambió desde el día anterior. Si queremos trabajar con muchos días de historia, en lugar de aplanar cada publicación completa podemos guardar el último estado de cada registro (identificado por `ID_REGISTRO`) y, con cada publicación nueva, comparar un *hash* de cada renglón para aplicar sólo las altas, los cambios y las bajas. De paso nos queda una bitácora de lo que cambió en cada fecha de publicación, que es justo lo que se necesita para estudiar los retrasos en el reporte.
+"""
+
+from covid19mx.carga import AlmacenRegistros
+
+"""Por ejemplo, para ir agregando las publicaciones de mayo de 2021 (que ya bajamos con `bajar_historicos`):
+
+```python
+almacen = AlmacenRegistros('/content/almacen_27/', entidad='27')
+for fecha in pd.date_range('2021-05-01', '2021-05-31'):
+    print(fecha.date(), almacen.ingiere(fecha.strftime('%y%m%d')))
+cambios = almacen.bitacora()
+```
+
+Si lo que queremos son los retrasos en el reporte, no hace falta guardar los registros: basta con contar, en cada publicación, los casos por fecha de inicio de síntomas y las defunciones por fecha de defunción de cada entidad. `TrianguloRetrasos` lee de cada publicación sólo esas columnas, cuenta varias publicaciones en paralelo y guarda los conteos de cada una en el cache, así que agregar un día más sólo lee ese archivo. Con el triángulo vemos cuánto crecen los días recientes con las publicaciones siguientes y `nowcast` estima cuánto falta por reportar:
+
+```python
+from covid19mx.retrasos import TrianguloRetrasos
+
+triangulo = TrianguloRetrasos.construye(pd.date_range('2021-05-01', '2021-05-31'), '/content/')
+triangulo.guarda('/content/triangulo/')
+triangulo.por_retraso('Defunciones', entidad='27')
+triangulo.nowcast('Casos Confirmados', entidad='27')
+```
+"""
+
 """Como pueden ver, lo que tenemos ahora es la misma base de datos que antes, pero con los valores de los campos obtenidos de los diccionarios y descriptores, lo que hace mucha más fácil utilizarlos.
 
 Con esta base podemos empezar a hacer algunas visualizaciones en la siguiente sección.
@@ -371,7 +250,7 @@ fig.show()
 """Para graficar las dos series en la misma gráfica lo más sencillo es pasar los datos de el formato ancho (en columnas) al formato largo (en filas con una columna que los distinga)"""
 
 confirmados_diarios = confirmados_diarios.melt(id_vars=['FECHA_SINTOMAS'], value_vars=['Confirmados', 'Media Móvil'])
- confirmados_diarios
+confirmados_diarios
 
 fig = px.line(confirmados_diarios, x='FECHA_SINTOMAS', y='value', color='variable')
 fig.show(renderer="colab")
@@ -414,7 +293,7 @@ defunciones_diarios = defunciones_diarios.rename({'FECHA_DEF': 'Fecha'}, axis=1)
 confirmados_diarios['Tipo'] = 'Casos Confirmados'
 confirmados_diarios.loc[confirmados_diarios['variable'] == 'Confirmados', 'variable'] = 'Conteo'
 confirmados_diarios = confirmados_diarios.rename({'FECHA_SINTOMAS': 'Fecha'}, axis=1)
-casos_defunciones = defunciones_diarios.append(confirmados_diarios)
+casos_defunciones = pd.concat([defunciones_diarios, confirmados_diarios], ignore_index=True)
 casos_defunciones
 
 """Ya con la nueva serie como la queremos, podemos hacer un Facet, la parte importante es decirle que no queremos que compartan el eje $y$ porque las escalas son muy diferentes"""
@@ -451,7 +330,8 @@ fig.show()
 hospitalizados_diarios['Tipo'] = 'Hospitalizaciones'
 hospitalizados_diarios.loc[hospitalizados_diarios['variable'] == 'Hospitalizaciones', 'variable'] = 'Conteo'
 hospitalizados_diarios = hospitalizados_diarios.rename({'FECHA_SINTOMAS': 'Fecha'}, axis=1)
-casos_defunciones_hospitalizaciones = casos_defunciones.append(hospitalizados_diarios)
+casos_defunciones_hospitalizaciones = pd.concat([defunciones_diarios, confirmados_diarios, hospitalizados_diarios],
+                                                ignore_index=True)
 casos_defunciones_hospitalizaciones
 
 """La ventaja de la estructura de datos que estamos usando es que la nueva gráfica se hace exactamente igual que antes"""
@@ -460,18 +340,34 @@ fig = px.line(casos_defunciones_hospitalizaciones, x='Fecha', y='value', color='
 fig.update_yaxes(matches=None)
 fig.show()
 
+"""### Todas las curvas de una vez
+
+Para cada curva repetimos los mismos pasos: filtrar, indexar por una fecha, agrupar por día, calcular la media móvil, pasar a formato largo y juntar. Cuando queremos muchas curvas (por ejemplo, una por municipio) conviene hacerlo todo en una sola función.
+
+`curvas_epidemicas` recibe la descripción de cada serie (qué filtros aplicar y qué fecha usar) y, opcionalmente, un nivel geográfico. Cada registro se convierte en un número de día (días desde la primera fecha) y los conteos diarios de todos los grupos se obtienen con un solo `np.bincount`. La media móvil sale de las sumas acumuladas. El resultado ya tiene el formato largo que usamos para el Facet.
+"""
+
+from covid19mx.agregados import VALORES_CONFIRMADOS, curvas_epidemicas
+from covid19mx.graficas import grafica_curvas
+
+curvas = curvas_epidemicas(aplanados)
+fig = grafica_curvas(curvas)
+fig.show()
+
 """## Mapas
 
-En esta sección del taller vamos a hacer algunos mapas sencillos a partir de los datos que ya tenemos. El primer paso es bajar los datos con la geometría de los municipios del país y su población total
+En esta sección del taller vamos a hacer algunos mapas sencillos a partir de los datos que ya tenemos. El primer paso es bajar los datos con la geometría de los municipios del país y su población total.
+
+El archivo es un GeoJson con todos los municipios del país. Leerlo es lento y, si se lo pasamos así a folium, cada mapa lleva todos los vértices de cada municipio aunque en la pantalla no se distingan. Por eso lo bajamos una sola vez y lo guardamos partido por entidad en [GeoParquet](https://geoparquet.org/), junto con versiones simplificadas para algunos niveles de zoom: en el zoom z de los mapas web un pixel mide unos 360 / (256 × 2^z) grados, así que los vértices más cercanos que eso no se ven.
 """
 
-url = "https://www.dropbox.com/s/2zw0fh3vdl0rxh4/municipios_pob_2020_simple.json?dl=1"
-r = requests.get(url, allow_redirects=True)
-open('/content/municipios_pob_2020_simple.json', 'wb').write(r.content)
+from covid19mx.mapas import AlmacenGeometrias
+
+geometrias = AlmacenGeometrias.prepara('/content/')
 
-"""El archivo que acabamos de bajar es un GeoJson con las geometrías de los municipios y algunos otros datos. Para manipularlos en Python usamos la librería [GeoPandas](https://geopandas.org/) que es una extensión espacial de Panda. Para empezar, simplemente vamos a cargar los datos y hacer un mapa muy sencillo"""
+"""El archivo que acabamos de bajar es un GeoJson con las geometrías de los municipios y algunos otros datos. Para manipularlos en Python usamos la librería [GeoPandas](https://geopandas.org/) que es una extensión espacial de Panda. Para empezar, simplemente vamos a cargar los datos de todo el país (simplificados para verse completos) y hacer un mapa muy sencillo"""
 
-municipios = gpd.read_file('/content/municipios_pob_2020_simple.json')
+municipios = geometrias.municipios(zoom=5)
 municipios
 
 """Geopandas provee un método `plot` para hacer mapas facilmente, sólo es necesario pasar la columna que se quiere usar para colorear el mapa, el esquema de colores y la clasificación a utilizar"""
@@ -489,7 +385,7 @@ ultima_fecha.head()
 """Ya con esta tabla, podemos hacer un agregado por municipio para ver el total de casos en cada uno."""
 
 por_municipio = (ultima_fecha
-                 .groupby(['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'])['ID_REGISTRO']
+                 .groupby(['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'], observed=True)['ID_REGISTRO'] # Las claves son categóricas: sólo las combinaciones que aparecen
                  .size()
                  .reset_index()
                  .rename({"ID_REGISTRO": "Nuevos Casos"}, axis=1)
@@ -498,12 +394,13 @@ por_municipio
 
 """Tenemos la lista de los municipios *que tuvieron* casos en la fecha que estamos analizando, para hacer un mapa necesitamos unir estos datos a la geometría de los municipios.
 
-Primero vamos a seleccionar, a partir del GeoDataFrame que ya tenemos sólo los municipios de la entidad que estamos analizando. A partir de eso podemos realizar una unión via la clave del municipio, sólo tenemos que tener cuiaddo de utilizar el tipo de unión adecuada para no dejar fuera los municipios sin casos.
+Primero vamos a seleccionar, del almacén de geometrías, sólo los municipios de la entidad que estamos analizando. A partir de eso podemos realizar una unión via la clave del municipio, sólo tenemos que tener cuiaddo de utilizar el tipo de unión adecuada para no dejar fuera los municipios sin casos.
 """
 
-tabasco = municipios[municipios.entidad_cvegeo == '27']
+tabasco = geometrias.entidad('27') # Los municipios de Tabasco, simplificados para el zoom del mapa
 casos_municipio = (tabasco
-                   .merge(por_municipio, left_on='municipio_cvegeo', right_on='CLAVE_MUNICIPIO_RES', how='left') # Unimos con los municipios
+                   .merge(por_municipio, left_on='municipio_cvegeo', right_on='CLAVE_MUNICIPIO_RES', how='left',
+                          validate='one_to_one') # Unimos con los municipios, revisando que quede un renglón por municipio
                    .drop(columns=['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES']) # eliminamos dos columnas que ya no vamosd a usar
                    .fillna(0) # Los municipios sin casos deben tener 0 en lugar de NaN
                    )
@@ -528,7 +425,7 @@ m
 """Ya hicimos un mapa para una fecha específica, ahora podemos hacer un mapa igual pero del total de casos acumulados. Lo primero que tenemos que hacer es calcular los acumulados totales para cada municipio, esto se hace agrpando los datos por municipio y calculando el tamaño de cada grupo."""
 
 acumulados_municipio = (aplanados
-                        .groupby(['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'])['ID_REGISTRO']
+                        .groupby(['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'], observed=True)['ID_REGISTRO']
                         .size()
                         .reset_index()
                         .rename({'ID_REGISTRO': 'Casos Acumulados'}, axis=1)
@@ -538,7 +435,8 @@ acumulados_municipio
 """Unimos a las geometrías de municipios y hacemos un mapa"""
 
 acumulados_municipio = (tabasco
-                        .merge(acumulados_municipio, left_on='municipio_cvegeo', right_on='CLAVE_MUNICIPIO_RES', how='left')
+                        .merge(acumulados_municipio, left_on='municipio_cvegeo', right_on='CLAVE_MUNICIPIO_RES', how='left',
+                               validate='one_to_one')
                         .drop(columns=['CLAVE_MUNICIPIO_RES', 'MUNICIPIO_RES'])
                         .fillna(0)
                         )
@@ -606,3 +504,133 @@ folium.Choropleth( # Instanciamos un mapa de coropletas
 folium.LayerControl().add_to(m)
 m
 
+"""### Varias capas con una sola geometría
+
+En el mapa anterior cada `folium.Choropleth` guarda en el HTML su propia copia de la geometría de los municipios, así que un mapa con n capas pesa n veces más aunque la geometría sea la misma. Además, para cada mapa repetimos el mismo bloque de código cambiando sólo la columna y los intervalos.
+
+`mapa_capas` recibe un GeoDataFrame y la lista de columnas a mapear. La geometría se guarda una sola vez en formato [TopoJSON](https://github.com/topojson/topojson-specification) cuantizado (coordenadas enteras en una cuadrícula, guardadas como diferencias entre puntos consecutivos) y cada capa sólo agrega, para cada municipio, el número de su clase de color. En el navegador todas las capas dibujan la misma geometría y sólo cambian el color; con el control de la esquina se elige la capa.
+"""
+
+from covid19mx.mapas import mapa_capas
+
+"""El mismo mapa de dos capas de arriba, pero ahora con la geometría una sola vez:"""
+
+m = mapa_capas(acumulados_municipio, ['Tasa x 100,000 habitantes', 'Casos Acumulados'])
+m
+
+
+"""### Cubo de agregados por municipio
+
+Cada mapa de arriba vuelve a recorrer todos los registros: filtrar la última fecha, agrupar por municipio, etc. Si vamos a hacer muchos mapas (otra fecha, sólo defunciones, los últimos 14 días...) conviene calcular una sola vez un *cubo*: un arreglo con los conteos acumulados por día × municipio × clasificación final × tipo de paciente × defunción. Con el cubo, cualquiera de esas preguntas es una resta de dos rebanadas del arreglo, sin volver a tocar los registros.
+
+El cubo se guarda en disco (un `.npy` que se abre con *memory map*) junto con sus etiquetas, así que sólo se calcula una vez por publicación.
+"""
+
+from covid19mx.agregados import CuboMunicipal
+
+"""Por ejemplo, los mismos datos de los mapas de arriba, pero ahora del cubo:"""
+
+cubo = CuboMunicipal.construye(aplanados)
+nuevos_ultimo_dia = cubo.nuevos()
+acumulados_cubo = cubo.acumulados()
+tasa_14_dias = cubo.tasa(tabasco.set_index('municipio_cvegeo')['pob2020'], dias=14, clasificacion=VALORES_CONFIRMADOS)
+tasa_14_dias.sort_values(ascending=False).head()
+
+"""### Tasas suavizadas con los municipios vecinos
+
+En los municipios con poca población unos cuantos casos cambian mucho la tasa por 100,000 habitantes, así que el mapa de tasas se ve muy ruidoso. Una forma de estabilizarlas es usar a los municipios vecinos. `PesosEspaciales` guarda qué municipios son vecinos como una matriz dispersa; se construye una sola vez a partir del GeoJson de municipios y se guarda en el cache, así que después cualquier cálculo con los vecinos es una suma por renglón de la matriz:
+
+* `tasa_suavizada` junta los casos y la población de cada municipio con los de sus vecinos
+* `tasa_bayes_empirica` acerca la tasa de cada municipio a la de su vecindad, tanto más cuanto más chico es
+* `moran_local` dice qué municipios forman focos (alto rodeado de altos) o están fuera de lo que los rodea
+
+Como sólo tenemos los datos de Tabasco, nos quedamos con las vecindades entre sus municipios.
+"""
+
+from covid19mx.vecindades import PesosEspaciales
+
+pesos = PesosEspaciales.prepara('/content/').subconjunto(tabasco['municipio_cvegeo'])
+poblacion = tabasco.set_index('municipio_cvegeo')['pob2020']
+casos = cubo.acumulados(clasificacion=VALORES_CONFIRMADOS)
+tasas = tabasco.set_index('municipio_cvegeo', drop=False).assign(**{
+    'Tasa x 100,000 habitantes': cubo.tasa(poblacion, clasificacion=VALORES_CONFIRMADOS),
+    'Tasa suavizada': pesos.tasa_suavizada(casos, poblacion),
+    'Tasa bayesiana empírica': pesos.tasa_bayes_empirica(casos, poblacion)}).reset_index(drop=True)
+m = mapa_capas(tasas, ['Tasa x 100,000 habitantes', 'Tasa suavizada', 'Tasa bayesiana empírica'])
+m
+
+pesos.moran_local(pesos.tasa_bayes_empirica(casos, poblacion)).sort_values('I', ascending=False).head()
+
+"""### Mapa animado por día
+
+Con el cubo también podemos ver la evolución día por día en un solo mapa. Hacer un mapa de folium por día repetiría la geometría cientos de veces; en lugar de eso, `valores_diarios` calcula de una vez los valores de todos los días × municipios (nuevos casos, su media móvil de 7 días y la tasa acumulada por 100,000 habitantes) restando rebanadas del cubo, y `mapa_animado` guarda la geometría una sola vez, como `mapa_capas`, junto con la clase de color de cada día × municipio en un arreglo de bytes. En el navegador, el deslizador (o el botón de reproducir) sólo vuelve a pintar los municipios con las clases del día elegido.
+
+Los intervalos de cada capa se calculan con todos los días juntos, así que un mismo color significa lo mismo en cualquier día.
+"""
+
+from covid19mx.agregados import valores_diarios
+
+from covid19mx.mapas import mapa_animado
+
+"""Los casos confirmados de Tabasco día por día:"""
+
+m = mapa_animado(tabasco, valores_diarios(cubo, tabasco), cubo.fechas)
+m
+
+"""### Cohortes por comorbilidades
+
+Preguntas como "¿cuántos casos confirmados hospitalizados, con diabetes y obesidad y de más de 60 años hubo cada día?" combinan muchas columnas `_BIN` con la clasificación, el tipo de paciente y la edad. `IndiceBanderas` empaca todas las banderas SI_NO de cada registro (y DEFUNCION) en un solo entero de 32 bits, un bit por bandera, y guarda la clasificación, el tipo de paciente, el municipio, la edad y las fechas como arreglos chicos. Así una cohorte se filtra con unas cuantas operaciones de bits sobre arreglos de enteros, sin recorrer la base aplanada.
+"""
+
+from covid19mx.cohortes import IndiceBanderas
+
+indice = IndiceBanderas.construye(aplanados)
+cohorte = dict(clasificacion=VALORES_CONFIRMADOS, tipo_paciente=['HOSPITALIZADO'], edad_min=60)
+print(indice.cuenta(con=['DIABETES', 'OBESIDAD'], **cohorte), 'registros;',
+      indice.cuenta(con=['DIABETES', 'OBESIDAD', 'DEFUNCION'], **cohorte), 'defunciones')
+indice.por_municipio(con=['DIABETES', 'OBESIDAD'], **cohorte).sort_values(ascending=False).head()
+
+"""Y la misma cohorte por fecha de inicio de síntomas:"""
+
+fig = px.line(indice.por_dia('FECHA_SINTOMAS', con=['DIABETES', 'OBESIDAD'], **cohorte).reset_index(),
+              x='FECHA_SINTOMAS', y='Registros')
+fig.show()
+
+"""### Todas las entidades
+
+Hasta aquí todo el análisis es para un solo estado: leemos sólo los registros de Tabasco, filtramos sus municipios y centramos los mapas en coordenadas fijas. Para repetirlo en las 32 entidades no hace falta leer 32 veces el CSV nacional: lo leemos una vez, lo partimos por entidad de residencia y cada parte se procesa en un proceso distinto, así que el tiempo total baja con el número de núcleos.
+
+Cada proceso calcula las curvas epidémicas de su entidad (estatales y por municipio) y un mapa de coropletas de sus municipios, con el centro y el zoom calculados a partir de los límites de la geometría del estado. Los resultados se guardan en un directorio por entidad y la función regresa cuánto tardó cada una.
+"""
+
+from covid19mx.entidades import procesa_entidades
+
+"""Por ejemplo, para la misma publicación que usamos arriba:"""
+
+tiempos_entidades = procesa_entidades('210505', geometrias, '/content/entidades/')
+tiempos_entidades
+
+"""### Todo el país sin cargarlo en memoria
+
+La base nacional completa no cabe en la memoria de una máquina modesta (ni en la de Colab), por eso hasta aquí siempre la filtramos por entidad. Para tener curvas y agregados de todo el país la podemos procesar *fuera de memoria*: leemos el CSV por bloques, aplanamos cada bloque igual que en `carga_datos_covid19_MX` y lo guardamos en disco partido por entidad de residencia y ordenado por fecha de ingreso. Después las curvas y el cubo se calculan bloque por bloque, sumando los conteos parciales, así que en memoria sólo hay un bloque a la vez más los resultados (que no dependen del número de registros).
+"""
+
+from covid19mx.particionada import BaseParticionada
+
+"""Por ejemplo, las curvas nacionales y por municipio y el cubo de todo el país:"""
+
+nacional = BaseParticionada.particiona('210505')
+curvas_nacionales = nacional.curvas_epidemicas()
+curvas_municipales = nacional.curvas_epidemicas(nivel='CLAVE_MUNICIPIO_RES')
+cubo_nacional = nacional.cubo()
+fig = grafica_curvas(curvas_nacionales)
+fig.show()
+
+"""Las curvas de todos los municipios del país en toda la historia son millones de puntos, demasiados para el navegador. `grafica_curvas` dibuja las líneas con WebGL y, cuando la figura pasaría de `MAX_PUNTOS` puntos, reduce cada curva con LTTB (*Largest-Triangle-Three-Buckets*), que se queda con los puntos que mejor conservan los picos y la forma de la curva.
+
+Para guardar muchas figuras a la vez, `exporta_figuras` escribe un solo `plotly.min.js` en el directorio y todos los HTML lo comparten, en lugar de llevar cada uno su propia copia de varios MB. También guarda un `index.html` con todas las figuras. Las imágenes estáticas (`formatos=('html', 'png')`) necesitan `kaleido`."""
+
+from covid19mx.graficas import exporta_figuras
+
+fig_municipios = grafica_curvas(curvas_municipales, nivel='CLAVE_MUNICIPIO_RES')
+exporta_figuras({'nacional': grafica_curvas(curvas_nacionales), 'municipios': fig_municipios}, '/content/figuras/')